@@ -0,0 +1,100 @@
+"""
+Token authentication with the token -> user lookup cached.
+
+DRF's `TokenAuthentication` joins `Token` and `User` on every request. This
+keeps the user's auth-relevant fields in the cache for `AUTH_TOKEN_CACHE_TTL`
+seconds under a hash of the token, and rebuilds `(user, token)` from there,
+so most authenticated requests don't touch the database to authenticate.
+An entry dropped in one worker must be dropped for all of them, so this
+only happens with a cache every worker shares (`CACHE_SHARED`); otherwise
+every request authenticates against the database, as `TokenAuthentication`
+does.
+
+Users are rebuilt with only those fields loaded; anything else (like the
+password) is deferred and loaded on access, and saving such a user writes
+only the loaded fields. Entries are dropped when the token is saved or
+deleted, when the user is saved or deleted, and on logout. Misses are read
+from the primary, so a token revoked moments ago can't be cached again from
+a lagging replica.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from backend import metrics
+
+# In model field order, as `Model.from_db` expects.
+USER_FIELDS = (
+    "id",
+    "is_superuser",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "is_staff",
+    "is_active",
+    "date_joined",
+)
+
+
+def token_cache_key(key: str) -> str:
+    return "auth_token:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key: str):
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    keys = Token.objects.filter(user_id=user_id).values_list("key", flat=True)
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        if not settings.CACHE_SHARED:
+            return self.load_credentials(key)
+        cache_key = token_cache_key(key)
+        entry = cache.get(cache_key)
+        if entry is None:
+            metrics.record_cache(misses=1)
+            # Raises for unknown tokens and inactive users, which aren't cached.
+            user, token = self.load_credentials(key)
+            cache.set(
+                cache_key,
+                {
+                    "user": [getattr(user, field) for field in USER_FIELDS],
+                    "created": token.created,
+                },
+                settings.AUTH_TOKEN_CACHE_TTL,
+            )
+            return user, token
+
+        metrics.record_cache(hits=1)
+        user = User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, entry["user"])
+        token = Token.from_db(
+            DEFAULT_DB_ALIAS,
+            ["key", "user_id", "created"],
+            [key, user.pk, entry["created"]],
+        )
+        token.user = user
+        return user, token
+
+    def load_credentials(self, key):
+        """`TokenAuthentication.authenticate_credentials`, on the primary."""
+        try:
+            token = (
+                Token.objects.using(DEFAULT_DB_ALIAS).select_related("user").get(key=key)
+            )
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return token.user, token
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:20
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # auth.User belongs to another app, so its email index for the admin
+    # user search is plain SQL. Usernames already have their unique index.
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX accounts_user_email_idx ON auth_user (email);",
+            "DROP INDEX accounts_user_email_idx;",
+        ),
+    ]
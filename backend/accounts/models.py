@@ -1,3 +1,10 @@
+from django.contrib.auth.models import User
 from django.db import models
 
-# Create your models here.
+
+class Profile(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
+    avatar = models.FileField(upload_to="avatars/", blank=True, null=True)
+
+    def __str__(self):
+        return f"Profile of {self.user.username}"
@@ -0,0 +1,13 @@
+from books.pagination import KeysetPagination
+
+
+class UserPagination(KeysetPagination):
+    """Pages of `(username, email)` rows in username order."""
+
+    ordering = ("username",)
+    results_key = "users"
+    page_size = 100
+    max_page_size = 1000
+
+    def get_cursor_values(self, row):
+        return [row[0]]
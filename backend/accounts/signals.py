@@ -1,9 +1,43 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
+from .authentication import invalidate_token, invalidate_user_tokens
+from .models import Profile
+from .summaries import invalidate_user_summary
+
+
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance=None, **kwargs):
+    invalidate_user_summary(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance=None, **kwargs):
+    invalidate_user_summary(instance.user_id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance=None, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_tokens(
+    sender, instance=None, created=False, update_fields=None, **kwargs
+):
+    # Logging in only touches last_login, which isn't cached. Deleting a user
+    # deletes their tokens, which invalidates them above.
+    if created or (update_fields and set(update_fields) == {"last_login"}):
+        return
+    invalidate_user_tokens(instance.pk)
@@ -0,0 +1,55 @@
+"""
+Cached `{id, username, avatar}` summaries of users.
+
+Serializers render the author of every quote and comment; loading those
+summaries in bulk from the cache (and in one query for the misses) keeps
+the cost of a page constant instead of one profile lookup per row.
+"""
+from typing import Dict, Iterable
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from backend import metrics
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def summary_cache_key(user_id) -> str:
+    return f"user_summary:{user_id}"
+
+
+def build_summary(user: User) -> dict:
+    profile = getattr(user, "profile", None)
+    return {
+        "id": user.id,
+        "username": user.username,
+        "avatar": profile.avatar.url if profile and profile.avatar else None,
+    }
+
+
+def get_user_summaries(user_ids: Iterable[int]) -> Dict[int, dict]:
+    keys = {summary_cache_key(user_id): user_id for user_id in set(user_ids)}
+    summaries = {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+    missing = set(keys.values()) - summaries.keys()
+    metrics.record_cache(hits=len(summaries), misses=len(missing))
+    if missing:
+        # From the primary, so a lagging replica isn't cached for an hour.
+        users = (
+            User.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk__in=missing)
+            .select_related("profile")
+        )
+        fresh = {user.pk: build_summary(user) for user in users}
+        cache.set_many(
+            {summary_cache_key(user_id): summary for user_id, summary in fresh.items()},
+            CACHE_TIMEOUT,
+        )
+        summaries.update(fresh)
+    return summaries
+
+
+def invalidate_user_summary(user_id):
+    cache.delete(summary_cache_key(user_id))
@@ -1,3 +1,163 @@
-from django.test import TestCase
+import json
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache_key
+from .models import Profile
+from .summaries import get_user_summaries
+
+
+class UserSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(f"user{index}", password="pass12345")
+            for index in range(5)
+        ]
+
+    def test_summaries_load_in_one_query_then_come_from_the_cache(self):
+        ids = [user.pk for user in self.users]
+        with self.assertNumQueries(1):
+            summaries = get_user_summaries(ids)
+        self.assertEqual(
+            summaries[ids[0]], {"id": ids[0], "username": "user0", "avatar": None}
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_summaries(ids), summaries)
+
+    def test_profile_changes_invalidate_the_summary(self):
+        user = self.users[0]
+        get_user_summaries([user.pk])
+        Profile.objects.create(user=user, avatar="avatars/me.png")
+        self.assertEqual(
+            get_user_summaries([user.pk])[user.pk]["avatar"], "/media/avatars/me.png"
+        )
+
+        user.username = "renamed"
+        user.save()
+        self.assertEqual(get_user_summaries([user.pk])[user.pk]["username"], "renamed")
+
+
+@override_settings(CACHE_SHARED=True)
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.token = Token.objects.get(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_authentication_is_served_from_the_cache(self):
+        self.assertEqual(self.client.get(reverse("user")).status_code, 200)
+        self.assertIsNotNone(cache.get(token_cache_key(self.token.key)))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("user"))
+        self.assertEqual(response.data["user"]["username"], "reader")
+
+    def test_deleting_the_token_invalidates_it(self):
+        self.client.get(reverse("user"))
+        self.token.delete()
+        self.assertEqual(self.client.get(reverse("user")).status_code, 401)
+
+    def test_logout_invalidates_the_token(self):
+        self.client.get(reverse("user"))
+        self.assertEqual(self.client.post(reverse("logout")).status_code, 204)
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_user_changes_invalidate_the_token(self):
+        self.client.get(reverse("user"))
+        self.user.username = "renamed"
+        self.user.save()
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.data["user"]["username"], "renamed")
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("user")).status_code, 401)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_without_a_shared_cache_every_request_checks_the_database(self):
+        self.client.get(reverse("user"))
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        # Another worker revoking the token is seen at once.
+        Token.objects.filter(pk=self.token.pk).delete()
+        self.assertEqual(self.client.get(reverse("user")).status_code, 401)
+
+
+class SessionEngineTests(TestCase):
+    def worker_store(self, worker_cache, session_key=None):
+        """A session store of the configured engine, as one worker sees it."""
+        engine = import_module(settings.SESSION_ENGINE)
+        caches = {settings.SESSION_CACHE_ALIAS: worker_cache}
+        with mock.patch("django.contrib.sessions.backends.cached_db.caches", caches):
+            return engine.SessionStore(session_key)
+
+    def test_flushed_session_is_not_served_by_another_workers_cache(self):
+        # Per-process caches, as without CACHE_URL.
+        first = LocMemCache("first", {})
+        second = LocMemCache("second", {})
+        session = self.worker_store(first)
+        session["user"] = "reader"
+        session.save()
+        key = session.session_key
+        self.assertEqual(self.worker_store(second, key).load(), {"user": "reader"})
+
+        session.flush()
+        self.assertEqual(self.worker_store(second, key).load(), {})
+
+
+class AllUsersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser("admin", "root@example.com", "pass")
+        for index in range(5):
+            User.objects.create_user(f"user{index}", f"reader{index}@example.com")
+        self.client = APIClient()
+        token = Token.objects.get(user=self.admin)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def test_users_are_paginated_by_username(self):
+        response = self.client.get(reverse("users"), {"page_size": 4})
+        self.assertEqual(
+            response.data["users"],
+            [
+                ["admin", "root@example.com"],
+                ["user0", "reader0@example.com"],
+                ["user1", "reader1@example.com"],
+                ["user2", "reader2@example.com"],
+            ],
+        )
+        response = self.client.get(
+            reverse("users"), {"page_size": 4, "cursor": response.data["next"]}
+        )
+        self.assertEqual(
+            [row[0] for row in response.data["users"]], ["user3", "user4"]
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_prefix_search_matches_usernames_and_emails(self):
+        response = self.client.get(reverse("users"), {"q": "user3"})
+        self.assertEqual(response.data["users"], [["user3", "reader3@example.com"]])
+        response = self.client.get(reverse("users"), {"q": "root"})
+        self.assertEqual(response.data["users"], [["admin", "root@example.com"]])
+
+    def test_ndjson_output_streams_every_user(self):
+        response = self.client.get(reverse("users"), {"output": "ndjson", "q": "user"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0]), ["user0", "reader0@example.com"])
+
+    def test_only_admins_can_list_users(self):
+        token = Token.objects.get(user__username="user0")
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        self.assertEqual(self.client.get(reverse("users")).status_code, 403)
@@ -1,14 +1,19 @@
 # accounts/views.py
+import json
 from rest_framework import viewsets, permissions
 from .permissions import IsAdminUser
 from django.contrib.auth import login, logout
 from rest_framework.authtoken.models import Token
-from rest_framework.authentication import TokenAuthentication
+from .authentication import CachedTokenAuthentication, invalidate_token
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .serializers import UserRegisterSerializer, UserLoginSerializer, UserSerializer
 from rest_framework import permissions, status
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from .pagination import UserPagination
 
 
 class UserRegister(APIView):
@@ -44,16 +49,18 @@ class UserLogin(APIView):
 
 class UserLogout(APIView):
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     def post(self, request):
         logout(request)
+        if request.auth is not None:
+            invalidate_token(request.auth.key)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class UserView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     def get(self, request):
         serializer = UserSerializer(request.user)
@@ -62,12 +69,34 @@ class UserView(APIView):
 
 class AllUsers(APIView):
     permission_classes = (permissions.IsAdminUser,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     def get(self, request, format=None):
         """
-        Return a list of all users
+        Return `[username, email]` for all users in username order, a page at
+        a time (`?cursor=`, `?page_size=`), or every row at once as NDJSON with
+        `?output=ndjson`. `?q=` narrows to usernames or emails with a prefix.
         """
-        all_users = [[user.username, user.email] for user in User.objects.all()]
-        return Response(all_users)
+        users = User.objects.values_list("username", "email")
+        prefix = request.query_params.get("q", "").strip()
+        if prefix:
+            # Range scans on the username and email indexes.
+            end = prefix + "\uffff"
+            users = users.filter(
+                Q(username__gte=prefix, username__lt=end)
+                | Q(email__gte=prefix, email__lt=end)
+            )
+
+        if request.query_params.get("output") == "ndjson":
+            rows = users.order_by("username").iterator(
+                chunk_size=settings.EXPORT_CHUNK_SIZE
+            )
+            return StreamingHttpResponse(
+                (json.dumps(row, ensure_ascii=False) + "\n" for row in rows),
+                content_type="application/x-ndjson",
+            )
+
+        paginator = UserPagination()
+        page = paginator.paginate_queryset(users, request, view=self)
+        return paginator.get_paginated_response([list(row) for row in page])
 
@@ -0,0 +1,166 @@
+"""
+Read-replica routing.
+
+`ReplicaRoutingMiddleware` decides per request whether reads may go to the
+replica: only GET/HEAD requests to the views named in `REPLICA_READ_VIEWS`
+(viewset actions or plain view function names) qualify. `PrimaryReplicaRouter`
+then sends their reads to `DATABASE_REPLICA`; everything else, and every
+write, goes to the primary.
+
+A write pins the rest of its request to the primary, and a POST, PUT,
+PATCH or DELETE that wrote pins the client (by its Authorization header or
+session cookie) for `REPLICA_PIN_SECONDS`, so users read their own writes
+while the replica catches up. A request that signed the client in pins the
+session or token it hands out instead; writes made while serving a GET
+(sessions, last-seen stamps) pin nothing. Pins are kept
+in the cache, so the replica is only used when that cache is shared by
+every worker (`CACHE_SHARED`); with a per-process cache the next request
+could land on a worker that never saw the pin.
+
+Reads that fill long-lived caches (timelines, user summaries, token
+lookups) go to the primary whatever the routing says, so a lagging replica
+is never cached for longer than it lags.
+
+`sync_replica()` copies the primary into the replica with SQLite's backup
+API, which stands in for real replication locally and in tests.
+"""
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.authentication import TokenAuthentication
+
+_current = ContextVar("db_routing", default=None)
+
+SAFE_METHODS = ("GET", "HEAD")
+
+
+class RoutingState:
+    __slots__ = ("use_replica", "wrote")
+
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is not None and state.use_replica and not state.wrote:
+            return settings.DATABASE_REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        # Even for instances that were read from the replica.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets its schema from the primary.
+        return db == DEFAULT_DB_ALIAS
+
+
+def pin_key(request):
+    credentials = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    return credentials_key(credentials)
+
+
+def credentials_key(credentials):
+    if not credentials:
+        return None
+    return "db-pin:" + hashlib.sha1(credentials.encode()).hexdigest()
+
+
+def issued_pin_keys(response):
+    """Keys for the session and token a response hands out, e.g. on login."""
+    cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    data = getattr(response, "data", None)
+    token = data.get("token") if isinstance(data, dict) else None
+    credentials = [
+        cookie.value if cookie else None,
+        f"{TokenAuthentication.keyword} {token}" if token else None,
+    ]
+    return [key for key in map(credentials_key, credentials) if key]
+
+
+def view_name(view_func) -> str:
+    # Viewset views know which action each method maps to.
+    actions = getattr(view_func, "actions", None)
+    return actions.get("get") if actions else view_func.__name__
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, state)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _current.get()
+        if (
+            state is None
+            or not settings.DATABASE_REPLICA
+            or not settings.CACHE_SHARED
+            or request.method not in SAFE_METHODS
+            or view_name(view_func) not in settings.REPLICA_READ_VIEWS
+        ):
+            return None
+        key = pin_key(request)
+        state.use_replica = not (key and cache.get(key))
+        return None
+
+    def finish(self, request, response, state):
+        if (
+            not state.wrote
+            or not settings.DATABASE_REPLICA
+            or request.method in SAFE_METHODS
+        ):
+            return
+        keys = {pin_key(request), *issued_pin_keys(response)} - {None}
+        if keys:
+            cache.set_many(dict.fromkeys(keys, True), settings.REPLICA_PIN_SECONDS)
+
+
+def sync_replica(primary: str = DEFAULT_DB_ALIAS, replica: str = None):
+    """Copy the primary SQLite database over the replica, schema and all."""
+    source = connections[primary]
+    target = connections[replica or settings.DATABASE_REPLICA]
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,247 @@
+"""
+Per-request instrumentation.
+
+`RequestMetricsMiddleware` times each request, and an execute wrapper on
+every database connection times the SQL queries it runs (including those of
+async views, which run in `sync_to_async` threads). Code elsewhere adds
+its own numbers for the current request with `record()` / `timed()`:
+serializers, upstream Google Books calls and cache lookups. The totals are
+folded into per-endpoint histograms, readable by admins at `/api/metrics/`,
+and go back to staff users (or everyone, with
+`REQUEST_METRICS_SERVER_TIMING`) as a `Server-Timing` header.
+
+Everything is kept in process memory, so each worker reports its own
+numbers. Recording is a few `perf_counter()` calls and additions per event,
+cheap enough to leave on.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("counts", "durations", "active")
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.durations = defaultdict(float)
+        # Names being timed right now, so nested timers don't double count.
+        self.active = set()
+
+
+def record(name: str, duration: float = 0.0, count: int = 1):
+    """Add `count` events taking `duration` seconds to the current request."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counts[name] += count
+        metrics.durations[name] += duration
+
+
+def record_cache(hits: int = 0, misses: int = 0):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counts["cache_hit"] += hits
+        metrics.counts["cache_miss"] += misses
+
+
+@contextmanager
+def timed(name: str):
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.active.discard(name)
+        record(name, time.perf_counter() - started)
+
+
+def timed_function(name: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class EndpointStats:
+    """Aggregated metrics of every request to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.total_ms = 0.0
+        self.counts = defaultdict(int)
+        self.durations_ms = defaultdict(float)
+
+    def add(self, total_ms: float, metrics: RequestMetrics):
+        self.requests += 1
+        self.total_ms += total_ms
+        for index, bound in enumerate(BUCKETS_MS):
+            if total_ms <= bound:
+                self.buckets[index] += 1
+                break
+        for name, count in metrics.counts.items():
+            self.counts[name] += count
+        for name, duration in metrics.durations.items():
+            self.durations_ms[name] += duration * 1000
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "mean_ms": round(self.total_ms / self.requests, 2),
+            "histogram_ms": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(BUCKETS_MS, self.buckets)
+            },
+            "counts": dict(self.counts),
+            "durations_ms": {
+                name: round(duration, 2) for name, duration in self.durations_ms.items()
+            },
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._endpoints = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, total_ms: float, metrics: RequestMetrics):
+        with self._lock:
+            self._endpoints[endpoint].add(total_ms, metrics)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: stats.snapshot()
+                for endpoint, stats in sorted(self._endpoints.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _query_timer(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record("db", time.perf_counter() - started)
+
+
+def install_query_timer(connection, **kwargs):
+    # What `connection.execute_wrapper()` does, but for the connection's
+    # whole life: per-request wrappers would miss sync_to_async threads.
+    if _query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_timer)
+
+
+connection_created.connect(install_query_timer)
+
+
+def server_timing(total_ms: float, metrics: RequestMetrics) -> str:
+    durations, counts = metrics.durations, metrics.counts
+    parts = [
+        f'db;dur={durations["db"] * 1000:.1f};desc="{counts["db"]} queries"',
+        f'serialize;dur={durations["serialize"] * 1000:.1f}',
+        f'upstream;dur={durations["upstream"] * 1000:.1f};'
+        f'desc="{counts["upstream"]} calls"',
+        f'cache;desc="{counts["cache_hit"]} hits, {counts["cache_miss"]} misses"',
+        f"total;dur={total_ms:.1f}",
+    ]
+    return ", ".join(parts)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported.
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS_ENABLED:
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def finish(self, request, response, metrics, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        match = request.resolver_match
+        endpoint = f"{request.method} {match.view_name if match else 'unresolved'}"
+        registry.add(endpoint, total_ms, metrics)
+        if settings.REQUEST_METRICS_SERVER_TIMING or is_staff(request):
+            response["Server-Timing"] = server_timing(total_ms, metrics)
+        return response
+
+
+def is_staff(request) -> bool:
+    # DRF sets the user it authenticated on the underlying request too.
+    user = getattr(request, "user", None)
+    return bool(user is not None and user.is_staff)
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Per-endpoint request metrics of this process; DELETE resets them."""
+    if request.method == "DELETE":
+        registry.reset()
+        return Response(status=204)
+    return Response(registry.snapshot())
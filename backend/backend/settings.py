@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.RequestMetricsMiddleware',
+    'backend.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -79,7 +81,7 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication', 
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',   
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -176,3 +178,114 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Point CACHE_URL at a Redis server (e.g. redis://localhost:6379/0; needs the
+# redis package) so every worker process shares one cache. Without it each
+# process has its own local-memory cache, and whatever must agree across
+# workers (feed timelines, ...) falls back to the database.
+CACHE_URL = os.environ.get("CACHE_URL")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+CACHE_SHARED = bool(CACHE_URL)
+
+# Precomputed feed timelines (see books/timeline.py)
+TIMELINE_MAX_LENGTH = 500
+TIMELINE_CACHE_TIMEOUT = 60 * 10
+
+# Google Books upstream client (see books/upstream.py)
+GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes"
+GOOGLE_BOOKS_CONNECT_TIMEOUT = 3.05
+GOOGLE_BOOKS_READ_TIMEOUT = 10
+GOOGLE_BOOKS_RETRIES = 2
+GOOGLE_BOOKS_POOL_SIZE = 10
+# One ASGI worker can have this many upstream requests in flight at once
+GOOGLE_BOOKS_ASYNC_POOL_SIZE = 100
+GOOGLE_BOOKS_BREAKER_THRESHOLD = 5
+GOOGLE_BOOKS_BREAKER_RESET = 30
+
+# Book search cache, in seconds (see GoogleBooksAPI.search_books)
+BOOK_SEARCH_CACHE_TTL = 60 * 60
+BOOK_SEARCH_EMPTY_TTL = 60 * 5
+BOOK_SEARCH_ERROR_TTL = 30
+BOOK_SEARCH_STALE_TTL = 60 * 60 * 24
+
+# Book searches with at least this many local matches skip Google Books
+LOCAL_SEARCH_MIN_RESULTS = 5
+
+# How long concurrent creators of the same new book wait on each other (s)
+BOOK_CREATE_LOCK_TIMEOUT = 15
+
+# Per-request SQL/serializer/upstream/cache metrics (see backend/metrics.py)
+REQUEST_METRICS_ENABLED = True
+# Send the Server-Timing header to every client, not just staff users
+REQUEST_METRICS_SERVER_TIMING = False
+
+# Highlight imports (see books/imports.py): quotes per chunk, and how many
+# Google Books lookups for unknown titles may run at once
+IMPORT_BATCH_SIZE = 500
+IMPORT_UPSTREAM_CONCURRENCY = 4
+
+# Quotes rendered per chunk by the streaming export (see books/exports.py)
+EXPORT_CHUNK_SIZE = 500
+
+# Trending quotes (see books/trending.py): score added per reaction/comment,
+# how fast scores halve, and the floor below which a score is reset to zero
+TRENDING_REACTION_WEIGHT = 1.0
+TRENDING_COMMENT_WEIGHT = 2.0
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_MIN_SCORE = 0.01
+
+# Write-behind reactions (see books/reaction_buffer.py): off by default; when
+# on, reactions are buffered in process and flushed at least every interval
+# (seconds), or as soon as this many users have one pending
+REACTION_WRITE_BEHIND = False
+REACTION_FLUSH_INTERVAL = 1.0
+REACTION_BUFFER_MAX = 1000
+
+# Read replica (see backend/db_routing.py). Point DATABASE_REPLICA_NAME at a
+# copy of the database to send safe reads of the views below there; a
+# client that wrote keeps reading from the primary for REPLICA_PIN_SECONDS
+DATABASE_REPLICA = None
+if os.environ.get("DATABASE_REPLICA_NAME"):
+    DATABASE_REPLICA = "replica"
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ["DATABASE_REPLICA_NAME"],
+    }
+DATABASE_ROUTERS = ["backend.db_routing.PrimaryReplicaRouter"]
+REPLICA_READ_VIEWS = {
+    "list",
+    "retrieve",
+    "feed",
+    "trending",
+    "comments_by_quote",
+    "search",
+    "book_search",
+    "search_books",
+    "quotes",
+}
+REPLICA_PIN_SECONDS = 5
+
+# Seconds a token -> user lookup stays cached (see accounts/authentication.py)
+AUTH_TOKEN_CACHE_TTL = 60
+# Session reads come from the cache, falling back to the sessions table, but
+# only when every worker shares the cache: a session flushed (logged out) in
+# one worker would otherwise live on in the others' caches
+SESSION_ENGINE = (
+    "django.contrib.sessions.backends.cached_db"
+    if CACHE_SHARED
+    else "django.contrib.sessions.backends.db"
+)
+
+# Background enrichment of placeholder books (see books/enrichment.py): pool
+# size, lookups per book, the first retry delay in seconds (doubled for each
+# retry after it) and how long one process holds a book's enrichment lock
+BOOK_ENRICH_WORKERS = 2
+BOOK_ENRICH_ATTEMPTS = 4
+BOOK_ENRICH_RETRY_DELAY = 2.0
+BOOK_ENRICH_LOCK_TIMEOUT = 120
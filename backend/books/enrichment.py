@@ -0,0 +1,193 @@
+"""
+Background enrichment of placeholder books.
+
+Creating a quote for a book we haven't stored yet doesn't wait on Google
+Books: `create_placeholder` stores the book straight from the result a
+recent Google Books search returned for it (`is_placeholder=True`), and a
+`BookEnricher` fetches the full details on a small thread pool and fills
+them in.
+
+Enrichment is deduplicated by `google_books_id`: a book already queued in
+this process isn't queued again, and a cache lock keeps other processes from
+fetching it at the same time. That lock only holds across processes with a
+shared cache (`CACHE_SHARED`); either way, filling a book in claims it with
+a conditional UPDATE, so only one process ever applies details to it.
+
+Failed lookups are retried with exponential backoff, `BOOK_ENRICH_ATTEMPTS`
+times in all. Books still left as placeholders after that, or after a
+restart, are picked up again by the `enrich_books` management command. A
+book Google Books says doesn't exist is final: it keeps the data its search
+result gave it and stops being a placeholder.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+DETAIL_FIELDS = ("title", "authors", "genres", "cover_image")
+
+
+def _text(value, field: str) -> str:
+    return str(value or "")[: Book._meta.get_field(field).max_length]
+
+
+def _names(value) -> list:
+    return [str(name) for name in value] if isinstance(value, list) else []
+
+
+def book_fields(details: dict) -> dict:
+    """
+    Book fields from a search result (`thumbnail_url`) or from full book
+    details (`cover_image`), coerced to what the columns hold.
+    """
+    return {
+        "title": _text(details.get("title"), "title"),
+        "authors": _names(details.get("authors")),
+        "genres": _names(details.get("genres")),
+        "cover_image": _text(
+            details.get("cover_image") or details.get("thumbnail_url"), "cover_image"
+        ),
+    }
+
+
+def create_placeholder(google_books_id: str, details: dict) -> Book:
+    """The stored book, or a new placeholder made from `details`."""
+    book = Book.objects.filter(google_books_id=google_books_id).first()
+    if book:
+        return book
+    try:
+        with transaction.atomic():
+            return Book.objects.create(
+                google_books_id=google_books_id,
+                is_placeholder=True,
+                **book_fields(details),
+            )
+    except IntegrityError:
+        # Someone else stored it first.
+        return Book.objects.get(google_books_id=google_books_id)
+
+
+def apply_details(google_books_id: str, details: dict) -> bool:
+    """
+    Fill a placeholder in from full book details, keeping what it has where
+    the details are empty. False if it's gone or no longer a placeholder.
+    """
+    with transaction.atomic():
+        # Claimed first, so concurrent enrichers can't both apply.
+        claimed = Book.objects.filter(
+            google_books_id=google_books_id, is_placeholder=True
+        ).update(is_placeholder=False)
+        if not claimed:
+            return False
+        book = Book.objects.get(google_books_id=google_books_id)
+        for field, value in book_fields(details).items():
+            if value:
+                setattr(book, field, value)
+        # A save, so the search index and cached quote pages follow.
+        book.save(update_fields=[*DETAIL_FIELDS, "updated_at"])
+    return True
+
+
+class BookEnricher:
+    def __init__(
+        self,
+        fetch: Callable[[str], Optional[dict]],
+        workers: int = None,
+        attempts: int = None,
+        retry_delay: float = None,
+    ):
+        self.fetch = fetch
+        self._workers = workers
+        self._attempts = attempts
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._executor = None
+
+    @property
+    def attempts(self) -> int:
+        return self._attempts or settings.BOOK_ENRICH_ATTEMPTS
+
+    @property
+    def retry_delay(self) -> float:
+        if self._retry_delay is None:
+            return settings.BOOK_ENRICH_RETRY_DELAY
+        return self._retry_delay
+
+    def enqueue(self, google_books_id: str) -> Optional[Future]:
+        """
+        Enrich the book in the background. Returns a future of `enrich`'s
+        result, or None if the book is already queued.
+        """
+        with self._lock:
+            if google_books_id in self._queued:
+                return None
+            self._queued.add(google_books_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers or settings.BOOK_ENRICH_WORKERS,
+                    thread_name_prefix="book-enrich",
+                )
+        return self._executor.submit(self._run, google_books_id)
+
+    def _run(self, google_books_id: str) -> bool:
+        try:
+            return self.enrich(google_books_id)
+        except Exception:
+            logger.exception("Enriching book %s failed", google_books_id)
+            return False
+        finally:
+            with self._lock:
+                self._queued.discard(google_books_id)
+            connection.close()
+
+    def enrich(self, google_books_id: str) -> bool:
+        """
+        Fetch the details of a placeholder book and fill them in, retrying
+        failed lookups. True if this call enriched the book; a book Google
+        Books doesn't know is settled as it is, and False.
+        """
+        lock_key = f"book_enrich_lock:{google_books_id}"
+        if not cache.add(lock_key, 1, settings.BOOK_ENRICH_LOCK_TIMEOUT):
+            return False  # Another process is on it.
+        try:
+            for attempt in range(self.attempts):
+                if attempt:
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                if not Book.objects.filter(
+                    google_books_id=google_books_id, is_placeholder=True
+                ).exists():
+                    return False
+                try:
+                    details = self.fetch(google_books_id)
+                except Exception:
+                    logger.warning(
+                        "Fetching book %s failed", google_books_id, exc_info=True
+                    )
+                    continue
+                if details is None:
+                    # Not found is an answer, not a failure: don't retry it.
+                    logger.warning(
+                        "Google Books has no book %s; keeping its search result",
+                        google_books_id,
+                    )
+                    apply_details(google_books_id, {})
+                    return False
+                return apply_details(google_books_id, details)
+            logger.warning(
+                "Giving up on enriching book %s after %d attempts",
+                google_books_id,
+                self.attempts,
+            )
+            return False
+        finally:
+            cache.delete(lock_key)
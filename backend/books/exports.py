@@ -0,0 +1,105 @@
+"""
+Streaming exports of quotes as NDJSON or CSV, optionally gzipped.
+
+Rows are read with `.iterator(chunk_size=...)` and rendered one chunk at a
+time through the `.values()` fast path (one tag query and one batch of
+cached user summaries per chunk), so memory stays flat and the first bytes
+go out as soon as the first chunk is ready, however many quotes there are.
+"""
+import csv
+import json
+import zlib
+from itertools import islice
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .row_serializers import quote_rows, serialize_quote_rows
+
+OUTPUTS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+CSV_COLUMNS = [
+    "id",
+    "created_at",
+    "book_title",
+    "book_authors",
+    "google_books_id",
+    "text",
+    "context",
+    "tags",
+]
+
+
+def quote_chunks(queryset, chunk_size: int = None) -> Iterator[list]:
+    """Serialized quotes in `queryset`, a chunk at a time, in id order."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = quote_rows(queryset.order_by("id")).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield serialize_quote_rows(chunk)
+
+
+def ndjson_lines(chunks: Iterable[list]) -> Iterator[str]:
+    for quotes in chunks:
+        yield "".join(
+            json.dumps(quote, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+            for quote in quotes
+        )
+
+
+class _Echo:
+    """File-like object whose `write` hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(chunks: Iterable[list]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for quotes in chunks:
+        yield "".join(
+            writer.writerow(
+                [
+                    quote["id"],
+                    quote["created_at"],
+                    quote["book"]["title"],
+                    "; ".join(quote["book"]["authors"] or []),
+                    quote["book"]["google_books_id"],
+                    quote["text"],
+                    quote["context"],
+                    "; ".join(tag["name"] for tag in quote["tags"]),
+                ]
+            )
+            for quote in quotes
+        )
+
+
+def encode(pieces: Iterable[str]) -> Iterator[bytes]:
+    for piece in pieces:
+        yield piece.encode()
+
+
+def gzip_stream(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Gzip a byte stream incrementally. Each piece is sync-flushed, so a
+    client sees data as each chunk is produced instead of at the end.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(queryset, output: str = "ndjson", gzip: bool = False):
+    """Bytes of the export of `queryset` in `output` format."""
+    render = ndjson_lines if output == "ndjson" else csv_lines
+    stream = encode(render(quote_chunks(queryset)))
+    return gzip_stream(stream) if gzip else stream
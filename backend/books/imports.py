@@ -0,0 +1,293 @@
+"""
+Bulk import of highlights exported from other reading apps.
+
+Files are parsed line by line into `Highlight`s and imported in chunks:
+each chunk resolves its books in one query (plus bounded-parallel Google
+Books lookups for unknown titles), its tags in one `resolve_tags` call and
+inserts quotes and tag rows with `bulk_create`. Memory stays flat however
+long the file is; only the title -> book id map grows, with the number of
+distinct books.
+
+Bulk inserts skip model signals, so the search index, timelines and version
+counters are updated explicitly.
+"""
+import csv
+import hashlib
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from . import search, timeline, versions
+from .models import Book, Quote, QuoteTag
+from .tags import adjust_quote_counts, normalize_tag_names, resolve_tags
+from .utils import GoogleBooksAPI
+
+FORMATS = ("kindle", "csv")
+
+
+class Highlight(NamedTuple):
+    title: str
+    author: str
+    text: str
+    context: str = ""
+    tags: tuple = ()
+
+
+class ImportStats(NamedTuple):
+    read: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    books_created: int = 0
+
+    def add(self, **counts) -> "ImportStats":
+        return self._replace(
+            **{name: getattr(self, name) + value for name, value in counts.items()}
+        )
+
+
+KINDLE_SEPARATOR = "=========="
+KINDLE_TITLE = re.compile(r"^(?P<title>.*?)\s*(?:\((?P<author>[^()]*)\))?$")
+
+
+def parse_kindle_clippings(lines: Iterable[str]) -> Iterator[Highlight]:
+    """
+    Highlights from a Kindle "My Clippings.txt". Each clipping is a title
+    line, a metadata line, a blank line and the text, ended by "==========";
+    bookmarks and notes are skipped.
+    """
+    block = []
+    for line in lines:
+        line = line.strip().lstrip("\ufeff")
+        if line != KINDLE_SEPARATOR:
+            block.append(line)
+            continue
+        if len(block) >= 3 and "highlight" in block[1].lower():
+            match = KINDLE_TITLE.match(block[0])
+            text = " ".join(part for part in block[2:] if part)
+            if text:
+                yield Highlight(
+                    title=match["title"],
+                    author=(match["author"] or "").strip(),
+                    text=text,
+                )
+        block = []
+
+
+def parse_highlights_csv(lines: Iterable[str]) -> Iterator[Highlight]:
+    """
+    Highlights from a CSV export with a header row. Recognizes the column
+    names used by Goodreads/Readwise style exports: `Highlight` or `Text`,
+    `Title` or `Book Title`, `Author`, `Note` and `Tags` (comma separated).
+    """
+    for row in csv.DictReader(lines):
+        row = {
+            (key or "").strip().lower(): (value or "").strip()
+            for key, value in row.items()
+        }
+        text = row.get("highlight") or row.get("text")
+        title = row.get("title") or row.get("book title")
+        if not text or not title:
+            continue
+        yield Highlight(
+            title=title,
+            author=row.get("author") or row.get("book author") or "",
+            text=text,
+            context=row.get("note", ""),
+            tags=tuple(normalize_tag_names(row.get("tags", "").split(","))),
+        )
+
+
+PARSERS = {"kindle": parse_kindle_clippings, "csv": parse_highlights_csv}
+
+
+def guess_format(filename: str) -> str:
+    return "csv" if filename.lower().endswith(".csv") else "kindle"
+
+
+def book_key(title: str, author: str) -> tuple:
+    return (title.casefold().strip(), author.casefold().strip())
+
+
+class HighlightImporter:
+    """
+    Imports highlights for one user, one transaction per chunk, so a
+    failing chunk only loses its own rows.
+    """
+
+    def __init__(
+        self, user, api=None, batch_size: int = None, concurrency: int = None
+    ):
+        self.user = user
+        self.api = api or GoogleBooksAPI()
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.concurrency = concurrency or settings.IMPORT_UPSTREAM_CONCURRENCY
+        self.book_ids: Dict[tuple, int] = {}
+        self.stats = ImportStats()
+
+    def run(self, highlights: Iterable[Highlight], progress=None) -> ImportStats:
+        for stats in self.import_chunks(highlights):
+            if progress:
+                progress(stats)
+        return self.stats
+
+    def import_chunks(self, highlights: Iterable[Highlight]) -> Iterator[ImportStats]:
+        """Import chunk by chunk, yielding the running totals after each."""
+        highlights = iter(highlights)
+        while True:
+            chunk = list(islice(highlights, self.batch_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                self.import_chunk(chunk)
+            yield self.stats
+
+        # One rebuild instead of a fan-out per imported quote.
+        timeline.rebuild(timeline.HOME)
+        timeline.rebuild(timeline.user_timeline(self.user.pk))
+
+    def import_chunk(self, chunk: List[Highlight]):
+        keys = [book_key(highlight.title, highlight.author) for highlight in chunk]
+        changed = self.resolve_books(dict(zip(keys, chunk)))
+        book_ids = [self.book_ids[key] for key in keys]
+
+        # Highlights already imported (or repeated in the file) are skipped.
+        seen = set(
+            Quote.objects.filter(user=self.user, book_id__in=set(book_ids)).values_list(
+                "book_id", "text"
+            )
+        )
+        quotes, tag_names = [], []
+        for book_id, highlight in zip(book_ids, chunk):
+            if (book_id, highlight.text) in seen:
+                continue
+            seen.add((book_id, highlight.text))
+            quotes.append(
+                Quote(
+                    user=self.user,
+                    book_id=book_id,
+                    text=highlight.text,
+                    context=highlight.context,
+                )
+            )
+            tag_names.append(highlight.tags)
+
+        quotes = Quote.objects.bulk_create(quotes)
+        tags = {
+            tag.name: tag.pk
+            for tag in resolve_tags(name for names in tag_names for name in names)
+        }
+        # Names sharing a slug resolve to the same tag, hence the set.
+        links = {
+            (quote.pk, tags[name])
+            for quote, names in zip(quotes, tag_names)
+            for name in names
+            if name in tags
+        }
+        QuoteTag.objects.bulk_create(
+            [QuoteTag(quote_id=quote_id, tag_id=tag_id) for quote_id, tag_id in links]
+        )
+        adjust_quote_counts(Counter(tag_id for _, tag_id in links))
+        search.index_quotes(quotes)
+        if quotes:
+            changed.append(versions.QUOTES)
+        if changed:
+            # One bump for the whole chunk, not one per book.
+            versions.bump(*changed)
+
+        self.stats = self.stats.add(
+            read=len(chunk),
+            imported=len(quotes),
+            duplicates=len(chunk) - len(quotes),
+        )
+
+    def resolve_books(self, highlights_by_key: Dict[tuple, Highlight]) -> List[str]:
+        """
+        Fill `self.book_ids` for every key: local match, upstream or new.
+        Returns the version names of the books it created.
+        """
+        missing = {
+            key: highlight
+            for key, highlight in highlights_by_key.items()
+            if key not in self.book_ids
+        }
+        if not missing:
+            return []
+
+        titles = {key[0] for key in missing}
+        for book in (
+            Book.objects.annotate(lower_title=Lower("title"))
+            .filter(lower_title__in=titles)
+            .only("pk", "title", "authors")
+        ):
+            authors = [author.casefold() for author in book.authors or []]
+            for key in list(missing):
+                title, author = key
+                if title == book.title.casefold() and (not author or author in authors):
+                    self.book_ids[key] = book.pk
+                    del missing[key]
+        if not missing:
+            return []
+
+        # Unknown titles are looked up upstream a few at a time.
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            found = dict(
+                zip(missing, pool.map(self.lookup_upstream, missing.values()))
+            )
+
+        books, google_ids = {}, {}
+        for key, highlight in missing.items():
+            details = found[key] or {}
+            google_books_id = details.get("google_books_id") or local_book_id(key)
+            google_ids[key] = google_books_id
+            books.setdefault(
+                google_books_id,
+                Book(
+                    google_books_id=google_books_id,
+                    title=details.get("title") or highlight.title,
+                    authors=details.get("authors")
+                    or ([highlight.author] if highlight.author else []),
+                    genres=details.get("genres") or [],
+                    cover_image=details.get("thumbnail_url") or "",
+                ),
+            )
+        before = set(
+            Book.objects.filter(google_books_id__in=books).values_list(
+                "google_books_id", flat=True
+            )
+        )
+        Book.objects.bulk_create(
+            [book for google_id, book in books.items() if google_id not in before],
+            ignore_conflicts=True,
+        )
+        stored = {
+            book.google_books_id: book
+            for book in Book.objects.filter(google_books_id__in=books)
+        }
+        created = []
+        for google_books_id, book in stored.items():
+            if google_books_id not in before:
+                search.index_book(book)
+                created.append(versions.book(book.pk))
+        for key, google_books_id in google_ids.items():
+            self.book_ids[key] = stored[google_books_id].pk
+        self.stats = self.stats.add(books_created=len(stored.keys() - before))
+        return created
+
+    def lookup_upstream(self, highlight: Highlight) -> Optional[dict]:
+        query = f"intitle:{highlight.title}"
+        if highlight.author:
+            query += f" inauthor:{highlight.author}"
+        results = self.api.search_books(query)
+        return results[0] if results else None
+
+
+def local_book_id(key: tuple) -> str:
+    """Stable id for a book Google Books doesn't know."""
+    digest = hashlib.sha1("\0".join(key).encode()).hexdigest()[:20]
+    return f"local:{digest}"
@@ -0,0 +1,121 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.models import Book, Comment, Quote, Tag
+from books.row_serializers import (
+    quote_rows,
+    serialize_books,
+    serialize_comment_thread,
+    serialize_quote_rows,
+)
+from books.serializers import BookSerializer, CommentSerializer, QuoteSerializer
+from books.threads import load_thread
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ModelSerializer and the .values() fast path on generated rows. "
+        "Everything runs in a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options["rows"], options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def best_of(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def report(self, label, rows, repeat, slow, fast):
+        slow_time = self.best_of(repeat, slow)
+        fast_time = self.best_of(repeat, fast)
+        per_1k = 1000 / rows * 1000
+        self.stdout.write(
+            f"{label:<10} serializer {slow_time * per_1k:8.1f} ms/1k rows   "
+            f"fast path {fast_time * per_1k:8.1f} ms/1k rows   "
+            f"speedup x{slow_time / fast_time:.1f}"
+        )
+
+    def run(self, rows, repeat):
+        user = User.objects.create_user("bench-serializers")
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Bench book {index}",
+                authors=["Author"],
+                google_books_id=f"bench-serializers-{index}",
+            )
+            for index in range(rows)
+        )
+        quotes = Quote.objects.bulk_create(
+            Quote(user=user, book=books[index % len(books)], text=f"Quote {index}")
+            for index in range(rows)
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f"bench-{index}", slug=f"bench-{index}") for index in range(5)
+        )
+        Quote.tags.through.objects.bulk_create(
+            Quote.tags.through(quote_id=quote.pk, tag_id=tags[index % 5].pk)
+            for index, quote in enumerate(quotes)
+        )
+        quote = quotes[0]
+        parents = [None]
+        for index in range(rows):
+            comment = Comment(
+                user=user, quote=quote, parent=parents[index // 4], content="c"
+            )
+            comment.save()
+            parents.append(comment)
+
+        quote_ids = [quote.pk for quote in quotes]
+        quote_qs = Quote.objects.filter(pk__in=quote_ids).order_by("-created_at", "-id")
+        book_qs = Book.objects.filter(pk__in=[book.pk for book in books])
+
+        def slow_quotes():
+            QuoteSerializer(
+                quote_qs.select_related("book").prefetch_related("tags"), many=True
+            ).data
+
+        def slow_thread():
+            roots, reply_map = load_thread(quote.pk)
+            CommentSerializer(roots, many=True, context={"reply_map": reply_map}).data
+
+        self.report(
+            "quotes",
+            rows,
+            repeat,
+            slow_quotes,
+            lambda: serialize_quote_rows(quote_rows(quote_qs)),
+        )
+        self.report(
+            "comments",
+            rows,
+            repeat,
+            slow_thread,
+            lambda: serialize_comment_thread(Comment.objects.filter(quote=quote)),
+        )
+        self.report(
+            "books",
+            len(books),
+            repeat,
+            lambda: BookSerializer(book_qs, many=True).data,
+            lambda: serialize_books(book_qs),
+        )
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from books import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Decay the trending scores of quotes by --hours worth of half-lives. "
+        "Schedule it at the same interval, e.g. hourly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=1.0,
+            help="Time elapsed since the previous run.",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute every score from recent reactions and comments instead.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            count = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} trending scores"))
+            return
+        count = trending.decay(timedelta(hours=options["hours"]))
+        self.stdout.write(self.style.SUCCESS(f"Decayed {count} trending scores"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+from books.views import book_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the full Google Books details of books still stored as "
+        "placeholders, e.g. after their background enrichment gave up or "
+        "the server restarted first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Enrich at most this many books.",
+        )
+
+    def handle(self, *args, **options):
+        pending = Book.objects.filter(is_placeholder=True).values_list(
+            "google_books_id", flat=True
+        )
+        if options["limit"] is not None:
+            pending = pending[: options["limit"]]
+        pending = list(pending)
+        enriched = sum(book_service.enricher.enrich(book_id) for book_id in pending)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Enriched {enriched} of {len(pending)} placeholder books"
+            )
+        )
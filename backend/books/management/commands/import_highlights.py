@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from books.imports import FORMATS, PARSERS, HighlightImporter, guess_format
+
+
+class Command(BaseCommand):
+    help = "Import a Kindle clippings file or a highlights CSV as a user's quotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="Username to import for.")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}")
+
+        parse = PARSERS[options["format"] or guess_format(options["path"])]
+        importer = HighlightImporter(user, batch_size=options["batch_size"])
+        with open(options["path"], encoding="utf-8-sig", newline="") as lines:
+            for stats in importer.import_chunks(parse(lines)):
+                self.stdout.write(
+                    f"read {stats.read}, imported {stats.imported}, "
+                    f"skipped {stats.duplicates} duplicates, "
+                    f"created {stats.books_created} books"
+                )
+        self.stdout.write(self.style.SUCCESS("Import finished"))
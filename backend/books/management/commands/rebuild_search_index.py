@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the local full-text index over books and quotes."
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            self.stdout.write("Full-text index is only kept on SQLite; nothing to do.")
+            return
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from books import timeline
+from books.models import Quote
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cached quote timelines from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Only rebuild the timeline of this author (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["users"]
+        names = []
+        if not user_ids:
+            names.append(timeline.HOME)
+            user_ids = Quote.objects.values_list("user_id", flat=True).distinct()
+        names.extend(timeline.user_timeline(user_id) for user_id in user_ids)
+
+        for name in names:
+            entries = timeline.rebuild(name)
+            self.stdout.write(f"{name}: {len(entries)} entries")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(names)} timelines"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from books.reactions import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-type reaction counters on quotes and fix drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--quote",
+            type=int,
+            action="append",
+            dest="quotes",
+            help="Only reconcile this quote (repeatable).",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        fixed = reconcile(options["quotes"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Fixed counters on {fixed} quotes"))
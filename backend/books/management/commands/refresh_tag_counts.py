@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.tags import refresh_quote_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute the quote counts on tags and fix drift."
+
+    def handle(self, *args, **options):
+        fixed = refresh_quote_counts()
+        self.stdout.write(self.style.SUCCESS(f"Fixed quote counts on {fixed} tags"))
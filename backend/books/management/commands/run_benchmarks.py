@@ -0,0 +1,281 @@
+import itertools
+import json
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from books.models import Quote, Reaction, Tag
+from books.utils import search_result_entries
+from books.views import book_service
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"
+
+
+class StubGoogleBooksAPI:
+    """Answers like GoogleBooksAPI without touching the network."""
+
+    def search_books(self, query):
+        return [
+            {
+                "google_books_id": f"stub-{query}-{index}",
+                "title": f"{query.title()} volume {index}",
+                "authors": ["Stub Author"],
+                "genres": ["Fiction"],
+                "thumbnail_url": "",
+            }
+            for index in range(10)
+        ]
+
+    def fetch_book_details(self, google_books_id):
+        return {
+            "google_books_id": google_books_id,
+            "title": f"Book {google_books_id}",
+            "authors": ["Stub Author"],
+            "genres": ["Fiction"],
+            "cover_image": "",
+        }
+
+
+class AsyncStubGoogleBooksAPI(StubGoogleBooksAPI):
+    async def search_books(self, query):
+        return super().search_books(query)
+
+    async def fetch_book_details(self, google_books_id):
+        return super().fetch_book_details(google_books_id)
+
+
+def new_book_quote(index):
+    """A quote on a book we don't have yet, as if just found by book search."""
+    google_books_id = f"bench-{index}"
+    cache.set_many(
+        search_result_entries(
+            [
+                {
+                    "google_books_id": google_books_id,
+                    "title": "A Benchmark Book",
+                    "authors": ["Stub Author"],
+                    "genres": [],
+                    "thumbnail_url": "",
+                }
+            ]
+        )
+    )
+    return (
+        "/api/quotes/create-quote/",
+        {
+            "book": google_books_id,
+            "text": "A benchmark quote.",
+            "tags": ["hope", "memory"],
+        },
+    )
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, time the hot endpoints and compare "
+        "latency percentiles and query counts against a stored baseline. "
+        "Exits non-zero when an endpoint needs more queries than the baseline "
+        "(or, with --check-latency, is slower than it allows)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--quotes", type=int, default=2000)
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Write this run's results as the new baseline.",
+        )
+        parser.add_argument(
+            "--check-latency",
+            action="store_true",
+            help=(
+                "Also fail on p95 latency regressions. Off by default: timings "
+                "vary between machines and runs, query counts don't."
+            ),
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=1.5,
+            help="Allowed p95 latency as a multiple of the baseline p95.",
+        )
+        parser.add_argument(
+            "--slack-ms",
+            type=float,
+            default=2.0,
+            help="Absolute p95 slack, so sub-millisecond noise never fails a run.",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cache.clear()
+            call_command("seed_data", quotes=options["quotes"], stdout=self.stdout)
+            # Book enrichment runs off the request path; keep it out of timings.
+            with mock.patch.object(
+                book_service, "api", StubGoogleBooksAPI()
+            ), mock.patch.object(
+                book_service, "async_api", AsyncStubGoogleBooksAPI()
+            ), mock.patch.object(book_service.enricher, "enqueue"):
+                results = self.run_all(options["iterations"], options["warmup"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        baseline_path = Path(options["baseline"])
+        if options["update_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {baseline_path}"))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(f"No baseline at {baseline_path}; nothing to compare.")
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        failures, slow = self.compare(
+            results, baseline, options["tolerance"], options["slack_ms"]
+        )
+        if options["check_latency"]:
+            failures += slow
+        else:
+            for warning in slow:
+                self.stdout.write(self.style.WARNING(f"Slower than baseline: {warning}"))
+        if failures:
+            raise CommandError("Performance regression:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def endpoints(self):
+        """`(name, method, callable returning (url, data))` for each endpoint."""
+        busy_quotes = list(
+            Quote.objects.annotate(total=Count("comments"))
+            .order_by("-total")
+            .values_list("pk", flat=True)[:20]
+        )
+        quote_ids = itertools.cycle(busy_quotes)
+        toggle_ids = itertools.cycle(busy_quotes)
+        reaction_types = itertools.cycle(Reaction.COUNTER_FIELDS)
+        words = itertools.cycle(["river", "winter light", "memory", "silence of"])
+        new_books = itertools.count()
+        popular_tags = itertools.cycle(
+            Tag.objects.order_by("-quote_count").values_list("slug", flat=True)[:5]
+        )
+
+        return [
+            ("feed", "get", lambda: ("/api/quotes/feed/", None)),
+            ("trending", "get", lambda: ("/api/quotes/trending/", None)),
+            (
+                "tag_quotes",
+                "get",
+                lambda: (f"/api/tags/{next(popular_tags)}/quotes/", None),
+            ),
+            (
+                "comments_by_quote",
+                "get",
+                lambda: (f"/api/comments/quote/{next(quote_ids)}/", None),
+            ),
+            (
+                "book_search",
+                "get",
+                lambda: ("/api/books/search/", {"q": next(words)}),
+            ),
+            (
+                "quote_search",
+                "get",
+                lambda: ("/api/quotes/search/", {"q": next(words)}),
+            ),
+            ("create_quote", "post", lambda: new_book_quote(next(new_books))),
+            (
+                "toggle_reaction",
+                "post",
+                lambda: (
+                    f"/api/quotes/{next(toggle_ids)}/toggle-reaction/",
+                    {"reaction_type": next(reaction_types)},
+                ),
+            ),
+        ]
+
+    def run_all(self, iterations, warmup):
+        client = APIClient()
+        token = Token.objects.select_related("user").first()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+        results = {}
+        for name, method, request in self.endpoints():
+            timings, queries = [], []
+            for index in range(warmup + iterations):
+                url, data = request()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, data, format="json")
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f"{name}: {method.upper()} {url} returned "
+                        f"{response.status_code}: {response.content[:200]!r}"
+                    )
+                if index >= warmup:
+                    timings.append(elapsed * 1000)
+                    queries.append(len(captured))
+            results[name] = {
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "queries": max(queries),
+            }
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}"
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<20}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                f"{row['p99_ms']:>10.2f}{row['queries']:>10}"
+            )
+
+    def compare(self, results, baseline, tolerance, slack_ms):
+        """`(query count regressions, p95 latency regressions)`."""
+        failures, slow = [], []
+        for name, row in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            if row["queries"] > expected["queries"]:
+                failures.append(
+                    f"{name}: {row['queries']} queries, baseline {expected['queries']}"
+                )
+            allowed = expected["p95_ms"] * tolerance + slack_ms
+            if row["p95_ms"] > allowed:
+                slow.append(
+                    f"{name}: p95 {row['p95_ms']:.2f} ms, allowed {allowed:.2f} ms "
+                    f"(baseline {expected['p95_ms']:.2f} ms)"
+                )
+        return failures, slow
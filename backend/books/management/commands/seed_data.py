@@ -0,0 +1,225 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from books import reactions, search, timeline, trending, versions
+from books.models import Book, Comment, Quote, Reaction, Tag
+from books.tags import refresh_quote_counts
+
+WORDS = (
+    "time memory river light silence winter city stranger letter garden war "
+    "house ocean promise shadow morning fire road mirror dream truth night "
+    "hope mother father child voice story heart machine star desert storm "
+    "forgotten quiet broken endless golden small ancient wild gentle bright"
+).split()
+GENRES = ["Fiction", "Science Fiction", "Fantasy", "History", "Poetry", "Philosophy"]
+TAG_WORDS = (
+    "love loss courage hope grief wisdom humor nature freedom justice faith "
+    "friendship power identity war home travel art death childhood"
+).split()
+
+
+def sentence(rng, low, high):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return " ".join(words).capitalize() + "."
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users, books, quotes, tags, reactions and threaded comments "
+        "in bulk. Use a deterministic --seed to get the same dataset again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--books", type=int, default=500)
+        parser.add_argument("--quotes", type=int, default=5000)
+        parser.add_argument("--tags", type=int, default=60)
+        parser.add_argument("--tags-per-quote", type=int, default=3)
+        parser.add_argument("--reactions-per-quote", type=int, default=5)
+        parser.add_argument("--comments-per-quote", type=int, default=4)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        # Rows get spread over the last 90 days, newest last.
+        self.now = timezone.now()
+        with transaction.atomic():
+            users = self.create_users(options["users"])
+            books = self.create_books(options["books"])
+            tags = self.create_tags(options["tags"])
+            quotes = self.create_quotes(options["quotes"], users, books)
+            self.tag_quotes(quotes, tags, options["tags_per_quote"])
+            self.react(quotes, users, options["reactions_per_quote"])
+            comments = self.comment(quotes, users, options["comments_per_quote"])
+            # Bulk inserts skip the signals that keep these in sync.
+            reactions.reconcile([quote.pk for quote in quotes])
+            search.rebuild()
+            trending.rebuild()
+            refresh_quote_counts()
+        self.refresh_caches(users, books, quotes)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(users)} users, {len(books)} books, {len(tags)} tags, "
+                f"{len(quotes)} quotes and {comments} comments"
+            )
+        )
+
+    def refresh_caches(self, users, books, quotes):
+        """Bring timelines and version counters up to the bulk-inserted rows."""
+        if timeline.enabled():
+            names = [timeline.user_timeline(user.pk) for user in users]
+            for name in [timeline.HOME, *names]:
+                timeline.rebuild(name)
+        versions.bump(
+            versions.QUOTES,
+            versions.TAGS,
+            versions.USERS,
+            *(versions.book(book.pk) for book in books),
+            *(versions.quote_comments(quote.pk) for quote in quotes),
+        )
+
+    def timestamp(self, index, total):
+        minutes = 90 * 24 * 60 * (total - index) / max(total, 1)
+        return self.now - timedelta(minutes=minutes)
+
+    def author_name(self):
+        return f"{self.rng.choice(WORDS).title()} {self.rng.choice(WORDS).title()}"
+
+    def create_users(self, count):
+        start = User.objects.count()
+        password = make_password("seed-password")
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f"seed-user-{start + index}",
+                    email=f"seed-user-{start + index}@example.com",
+                    password=password,
+                )
+                for index in range(count)
+            ]
+        )
+        Token.objects.bulk_create(
+            [Token(user=user, key=Token.generate_key()) for user in users]
+        )
+        return users
+
+    def create_books(self, count):
+        start = Book.objects.count()
+        return Book.objects.bulk_create(
+            [
+                Book(
+                    title=sentence(self.rng, 1, 4).rstrip("."),
+                    authors=[self.author_name()],
+                    description=sentence(self.rng, 20, 60),
+                    google_books_id=f"seed-{start + index}",
+                    genres=self.rng.sample(GENRES, 2),
+                )
+                for index in range(count)
+            ]
+        )
+
+    def create_tags(self, count):
+        names = [
+            TAG_WORDS[index % len(TAG_WORDS)]
+            + (f"-{index // len(TAG_WORDS)}" if index >= len(TAG_WORDS) else "")
+            for index in range(count)
+        ]
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=name) for name in names], ignore_conflicts=True
+        )
+        return list(Tag.objects.filter(name__in=names))
+
+    def create_quotes(self, count, users, books):
+        quotes = Quote.objects.bulk_create(
+            [
+                Quote(
+                    user=self.rng.choice(users),
+                    book=self.rng.choice(books),
+                    text=sentence(self.rng, 8, 40),
+                    context=(
+                        sentence(self.rng, 3, 10) if self.rng.random() < 0.3 else ""
+                    ),
+                )
+                for _ in range(count)
+            ]
+        )
+        # auto_now_add ignores explicit values, so spread the timestamps after.
+        for index, quote in enumerate(quotes):
+            quote.created_at = self.timestamp(index, count)
+        Quote.objects.bulk_update(quotes, ["created_at"], batch_size=1000)
+        return quotes
+
+    def tag_quotes(self, quotes, tags, per_quote):
+        if not tags:
+            return
+        Through = Quote.tags.through
+        Through.objects.bulk_create(
+            [
+                Through(quote_id=quote.pk, tag_id=tag.pk)
+                for quote in quotes
+                # Skewed so a few tags are much more popular than the rest.
+                for tag in set(
+                    self.rng.choices(
+                        tags,
+                        weights=[1 / (rank + 1) for rank in range(len(tags))],
+                        k=self.rng.randint(0, per_quote),
+                    )
+                )
+            ],
+            batch_size=1000,
+        )
+
+    def react(self, quotes, users, per_quote):
+        types = list(Reaction.COUNTER_FIELDS)
+        Reaction.objects.bulk_create(
+            [
+                Reaction(user=user, quote=quote, type=self.rng.choice(types))
+                for quote in quotes
+                for user in self.rng.sample(
+                    users, min(len(users), self.rng.randint(0, per_quote * 2))
+                )
+            ],
+            batch_size=1000,
+        )
+
+    def comment(self, quotes, users, per_quote):
+        """Threads where every comment replies to an earlier one half the time."""
+        total = 0
+        level = [
+            Comment(
+                quote=quote,
+                user=self.rng.choice(users),
+                content=sentence(self.rng, 4, 25),
+            )
+            for quote in quotes
+            for _ in range(self.rng.randint(0, per_quote))
+        ]
+        parents = {}
+        while level:
+            created = Comment.objects.bulk_create(level, batch_size=1000)
+            for comment in created:
+                parent = parents.get(comment.parent_id)
+                comment.depth = parent.depth + 1 if parent else 0
+                comment.path = f"{parent.path if parent else ''}{comment.pk:010d}/"
+                parents[comment.pk] = comment
+            Comment.objects.bulk_update(created, ["path", "depth"], batch_size=1000)
+            total += len(created)
+            level = [
+                Comment(
+                    quote_id=comment.quote_id,
+                    user=self.rng.choice(users),
+                    parent=comment,
+                    content=sentence(self.rng, 4, 25),
+                )
+                for comment in created
+                if comment.depth < 5 and self.rng.random() < 0.5
+            ]
+        return total
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.db_routing import sync_replica
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the read replica, for trying "
+        "replica routing locally (set DATABASE_REPLICA_NAME to a second file)."
+    )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICA:
+            raise CommandError("No replica configured; set DATABASE_REPLICA_NAME.")
+        sync_replica()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Copied the primary to {settings.DATABASES['replica']['NAME']}"
+            )
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0005_alter_comment_options_comment_parent_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="quote",
+            index=models.Index(fields=["-created_at", "-id"], name="quote_feed_idx"),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:49
+
+from django.db import migrations, models
+from django.db.models import Count
+
+COUNTER_FIELDS = {
+    "LIKE": "like_count",
+    "LOVE": "love_count",
+    "THINK": "think_count",
+    "INSPIRE": "inspire_count",
+}
+
+
+def backfill_counters(apps, schema_editor):
+    Quote = apps.get_model("books", "Quote")
+    Reaction = apps.get_model("books", "Reaction")
+    rows = (
+        Reaction.objects.values_list("quote_id", "type")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for quote_id, reaction_type, count in rows:
+        field = COUNTER_FIELDS.get(reaction_type)
+        if field:
+            Quote.objects.filter(pk=quote_id).update(**{field: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0006_quote_feed_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quote",
+            name="inspire_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="quote",
+            name="like_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="quote",
+            name="love_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="quote",
+            name="think_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
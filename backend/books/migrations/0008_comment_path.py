@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model("books", "Comment")
+    paths = {}
+    # Parents are always created before their replies, so pk order is safe.
+    for comment in Comment.objects.order_by("pk").only("pk", "parent_id").iterator():
+        path = f"{paths.get(comment.parent_id, '')}{comment.pk:010d}/"
+        paths[comment.pk] = path
+        Comment.objects.filter(pk=comment.pk).update(
+            path=path, depth=path.count("/") - 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0007_quote_reaction_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=models.TextField(
+                blank=True, db_index=True, default="", editable=False
+            ),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:10
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    Book = apps.get_model("books", "Book")
+    Quote = apps.get_model("books", "Quote")
+    tokenizer = "tokenize = 'unicode61 remove_diacritics 2'"
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE books_book_fts USING fts5(title, authors, {tokenizer})"
+    )
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE books_quote_fts USING fts5(text, context, {tokenizer})"
+    )
+    for book in Book.objects.only("title", "authors").iterator():
+        schema_editor.execute(
+            "INSERT INTO books_book_fts (rowid, title, authors) VALUES (%s, %s, %s)",
+            [book.pk, book.title, " ".join(book.authors or [])],
+        )
+    for quote in Quote.objects.only("text", "context").iterator():
+        schema_editor.execute(
+            "INSERT INTO books_quote_fts (rowid, text, context) VALUES (%s, %s, %s)",
+            [quote.pk, quote.text, quote.context or ""],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS books_book_fts")
+    schema_editor.execute("DROP TABLE IF EXISTS books_quote_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0008_comment_path"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
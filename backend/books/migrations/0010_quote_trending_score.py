@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:15
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_scores(apps, schema_editor):
+    Quote = apps.get_model("books", "Quote")
+    Reaction = apps.get_model("books", "Reaction")
+    Comment = apps.get_model("books", "Comment")
+    now = timezone.now()
+    half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+    scores = {}
+    for model, weight in (
+        (Reaction, settings.TRENDING_REACTION_WEIGHT),
+        (Comment, settings.TRENDING_COMMENT_WEIGHT),
+    ):
+        rows = model.objects.filter(created_at__gte=now - half_life * 10).values_list(
+            "quote_id", "created_at"
+        )
+        for quote_id, created_at in rows.iterator():
+            scores[quote_id] = scores.get(quote_id, 0.0) + weight * 0.5 ** (
+                (now - created_at) / half_life
+            )
+    Quote.objects.bulk_update(
+        [
+            Quote(pk=quote_id, trending_score=score)
+            for quote_id, score in scores.items()
+            if score >= settings.TRENDING_MIN_SCORE
+        ],
+        ["trending_score"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0009_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quote",
+            name="trending_score",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name="quote",
+            index=models.Index(
+                fields=["-trending_score", "-id"], name="quote_trending_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_quote_counts(apps, schema_editor):
+    Tag = apps.get_model("books", "Tag")
+    QuoteTag = apps.get_model("books", "QuoteTag")
+    counts = QuoteTag.objects.values_list("tag_id").annotate(count=Count("id")).order_by()
+    Tag.objects.bulk_update(
+        [Tag(pk=tag_id, quote_count=count) for tag_id, count in counts],
+        ["quote_count"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0010_quote_trending_score"),
+    ]
+
+    operations = [
+        # The auto-created through table becomes an explicit model over the
+        # same table and columns, so it can carry its own index.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="QuoteTag",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "quote",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="books.quote",
+                            ),
+                        ),
+                        (
+                            "tag",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="books.tag",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "books_quote_tags",
+                        "unique_together": {("quote", "tag")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="quote",
+                    name="tags",
+                    field=models.ManyToManyField(
+                        related_name="quotes", through="books.QuoteTag", to="books.tag"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="quotetag",
+            index=models.Index(fields=["tag", "-quote"], name="quote_tag_recent_idx"),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="quote_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="tag",
+            index=models.Index(
+                fields=["-quote_count", "name"], name="tag_popularity_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_quote_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0011_quote_tag_through"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="is_placeholder",
+            field=models.BooleanField(default=False),
+        ),
+    ]
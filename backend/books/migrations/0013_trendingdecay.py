@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0012_book_is_placeholder"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingDecay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("decayed_at", models.DateTimeField()),
+            ],
+        ),
+    ]
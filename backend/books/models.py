@@ -14,6 +14,9 @@ class Book(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Stored from a search result, waiting for books.enrichment to fill in
+    # the full Google Books details
+    is_placeholder = models.BooleanField(default=False)
 
     class Meta:
         indexes = [
@@ -28,8 +31,17 @@ class Book(models.Model):
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=50, unique=True, blank=True)
+    # Number of quotes with this tag, kept up to date by books.tags
+    quote_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-quote_count", "name"], name="tag_popularity_idx"),
+        ]
 
     def save(self, *args, **kwargs):
+        # Lookups and the `?q=` prefix search expect normalized names.
+        self.name = self.name.strip().lower()
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
@@ -45,17 +57,74 @@ class Quote(models.Model):
     context = models.TextField(
         blank=True, help_text="Additional context or chapter info"
     )
-    tags = models.ManyToManyField(Tag, related_name="quotes")
+    tags = models.ManyToManyField(Tag, related_name="quotes", through="QuoteTag")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized per-type reaction counters, kept in sync by books.reactions
+    like_count = models.IntegerField(default=0)
+    love_count = models.IntegerField(default=0)
+    think_count = models.IntegerField(default=0)
+    inspire_count = models.IntegerField(default=0)
+
+    # Time-decayed activity score, kept up to date by books.trending
+    trending_score = models.FloatField(default=0.0)
+
     class Meta:
         indexes = [
             models.Index(fields=["created_at"]),
+            models.Index(fields=["-created_at", "-id"], name="quote_feed_idx"),
+            models.Index(
+                fields=["-trending_score", "-id"], name="quote_trending_idx"
+            ),
         ]
 
+    # Only ever changed with F() updates; see save()
+    DENORMALIZED_FIELDS = (
+        "like_count",
+        "love_count",
+        "think_count",
+        "inspire_count",
+        "trending_score",
+    )
+
     def __str__(self):
         return f"{self.text[:50]}..."
 
+    def save(self, *args, **kwargs):
+        # A full save of a loaded quote would write back the counters and
+        # score it was loaded with, undoing reactions counted since. Leave
+        # them out unless they are asked for by name.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.DENORMALIZED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def reaction_counts(self):
+        return {
+            reaction_type: getattr(self, field)
+            for reaction_type, field in Reaction.COUNTER_FIELDS.items()
+        }
+
+
+class QuoteTag(models.Model):
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = "books_quote_tags"
+        unique_together = [("quote", "tag")]
+        indexes = [
+            # Newest quotes for a tag, read straight off the index
+            models.Index(fields=["tag", "-quote"], name="quote_tag_recent_idx"),
+        ]
+
 
 class Reaction(models.Model):
     REACTION_CHOICES = [
@@ -64,6 +133,12 @@ class Reaction(models.Model):
         ("THINK", "🤔"),
         ("INSPIRE", "✨"),
     ]
+    COUNTER_FIELDS = {
+        "LIKE": "like_count",
+        "LOVE": "love_count",
+        "THINK": "think_count",
+        "INSPIRE": "inspire_count",
+    }
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     quote = models.ForeignKey(Quote, on_delete=models.CASCADE, related_name="reactions")
@@ -79,6 +154,13 @@ class Reaction(models.Model):
     def __str__(self):
         return f"{self.user.username} reacted with {self.type} on {self.quote.text}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored type so counters can follow type changes.
+        instance._loaded_type = instance.__dict__.get("type")
+        return instance
+
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -93,6 +175,9 @@ class Comment(models.Model):
         on_delete=models.CASCADE
     )
     content = models.TextField()
+    # Materialized path of zero-padded ancestor ids, e.g. "0000000003/0000000007/"
+    path = models.TextField(blank=True, default="", db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -102,6 +187,15 @@ class Comment(models.Model):
     def __str__(self):
         return f"Comment by {self.user.username} on {self.quote.text[:50]}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.path:
+            # The path embeds our own id, so it can only be set after insert.
+            prefix = self.parent.path if self.parent_id else ""
+            self.path = f"{prefix}{self.pk:010d}/"
+            self.depth = self.path.count("/") - 1
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
 
 class UserFavorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -113,3 +207,12 @@ class UserFavorite(models.Model):
 
     def __str__(self):
         return f"{self.user.username} favorited {self.book.title}"
+
+
+class TrendingDecay(models.Model):
+    """When the trending scores were last decayed; a single row."""
+
+    decayed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Trending scores decayed at {self.decayed_at}"
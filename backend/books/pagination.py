@@ -0,0 +1,137 @@
+import base64
+import json
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from . import timeline
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination over a fixed, unique ordering.
+
+    The cursor is an opaque base64 token holding the ordering values of the
+    last row on the previous page, so fetching any page is a single indexed
+    range scan no matter how deep the client has scrolled.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    results_key = "results"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values):
+        payload = json.dumps([str(value) for value in values])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, token, model):
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            raw = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if not isinstance(raw, list) or len(raw) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip("-")).to_python(value)
+                for name, value in zip(self.ordering, raw)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_position_filter(self, values):
+        """Build `(a, b, ...) < (x, y, ...)` for the configured ordering."""
+        clauses = []
+        for index, name in enumerate(self.ordering):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            equal = {
+                prev.lstrip("-"): value
+                for prev, value in zip(self.ordering[:index], values[:index])
+            }
+            clauses.append(Q(**equal, **{f"{field}__{lookup}": values[index]}))
+        return reduce(lambda left, right: left | right, clauses)
+
+    def get_cursor_values(self, row):
+        """Ordering values of a model instance or a `.values()` dict."""
+        if isinstance(row, dict):
+            return [row[name.lstrip("-")] for name in self.ordering]
+        return [getattr(row, name.lstrip("-")) for name in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size_value = self.get_page_size(request)
+        token = request.query_params.get(self.cursor_query_param)
+
+        queryset = queryset.order_by(*self.ordering)
+        if token:
+            values = self.decode_cursor(token, queryset.model)
+            queryset = queryset.filter(self.get_position_filter(values))
+
+        rows = list(queryset[: self.page_size_value + 1])
+        self.has_next = len(rows) > self.page_size_value
+        rows = rows[: self.page_size_value]
+        self.next_cursor = (
+            self.encode_cursor(self.get_cursor_values(rows[-1]))
+            if self.has_next
+            else None
+        )
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.next_cursor, self.results_key: data})
+
+
+class TrendingPagination(KeysetPagination):
+    ordering = ("-trending_score", "-id")
+    results_key = "quotes"
+
+
+class TagQuotesPagination(KeysetPagination):
+    """Pages of a tag's through rows, newest quote (highest id) first."""
+
+    ordering = ("-quote_id",)
+    results_key = "quotes"
+
+
+class QuoteFeedPagination(KeysetPagination):
+    ordering = ("-created_at", "-id")
+    results_key = "quotes"
+
+    def paginate_timeline(self, name, queryset, request, view=None):
+        """
+        Serve the page from a precomputed timeline, falling back to a keyset
+        query when the page lies beyond what the timeline keeps.
+        """
+        self.page_size_value = self.get_page_size(request)
+        token = request.query_params.get(self.cursor_query_param)
+        after = self.decode_cursor(token, queryset.model) if token else None
+
+        page = timeline.read_page(name, after, self.page_size_value)
+        if page is None:
+            return self.paginate_queryset(queryset, request, view)
+
+        entries, self.has_next = page
+        quote_ids = [quote_id for _, quote_id in entries]
+        by_id = {
+            row["id"] if isinstance(row, dict) else row.pk: row
+            for row in queryset.filter(pk__in=quote_ids)
+        }
+        rows = [by_id[quote_id] for quote_id in quote_ids if quote_id in by_id]
+        # From the last entry rather than the last row: quotes deleted since
+        # the timeline was read leave gaps (even a whole page) in the rows.
+        self.next_cursor = (
+            self.encode_cursor(entries[-1]) if self.has_next else None
+        )
+        return rows
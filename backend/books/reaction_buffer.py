@@ -0,0 +1,211 @@
+"""
+Optional write-behind buffering of reactions (`REACTION_WRITE_BEHIND`).
+
+When a quote goes viral, every reaction to it is an INSERT plus a counter
+UPDATE on the same hot row, and SQLite runs them one at a time. In
+write-behind mode a reaction only records the user's wanted state in this
+process's buffer; a background thread writes the buffer out every
+`REACTION_FLUSH_INTERVAL` seconds (sooner once `REACTION_BUFFER_MAX` users
+are pending) with `reactions.apply_reactions`: one upsert, one DELETE and one
+counter UPDATE per quote for the whole batch. Repeated toggles by one user
+collapse into their final state.
+
+The reaction endpoints answer from the buffer, so a user sees their own
+reaction and the counts it implies straight away (read-your-writes), also
+while a flush is in progress; other readers see the change once flushed.
+
+The buffer lives in process memory: it is drained when the process exits
+normally (`atexit`), but a crash loses at most one interval of reactions.
+The stored counters stay exact either way, because a flush applies the
+difference against the rows actually in the database.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from . import reactions
+from .models import Quote, Reaction
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionBuffer:
+    def __init__(self, interval: float = None, max_pending: int = None):
+        self._interval = interval
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, quote_id) -> [state before buffering, wanted state]
+        self._pending = {}
+        self._flushing = {}
+        # quote_id -> {type: delta} the pending states add to the counters
+        self._overlay = defaultdict(Counter)
+        self._flushing_overlay = defaultdict(Counter)
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    @property
+    def interval(self) -> float:
+        if self._interval is None:
+            return settings.REACTION_FLUSH_INTERVAL
+        return self._interval
+
+    @property
+    def max_pending(self) -> int:
+        if self._max_pending is None:
+            return settings.REACTION_BUFFER_MAX
+        return self._max_pending
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def toggle(
+        self, user_id: int, quote_id: int, reaction_type: str
+    ) -> Tuple[Optional[str], dict]:
+        """Buffered `reactions.toggle`: same arguments, same result."""
+        return self.update(
+            user_id,
+            quote_id,
+            lambda current: None if current == reaction_type else reaction_type,
+        )
+
+    def react(
+        self, user_id: int, quote_id: int, reaction_type: str
+    ) -> Tuple[Optional[str], dict]:
+        """Set the user's reaction to `reaction_type`, whatever it was."""
+        return self.update(user_id, quote_id, lambda current: reaction_type)
+
+    def update(
+        self, user_id: int, quote_id: int, change
+    ) -> Tuple[Optional[str], dict]:
+        """
+        Buffer `change(current_type) -> wanted_type` for the user's reaction
+        and return the wanted type with the quote's counts as they will be
+        once flushed. Raises Quote.DoesNotExist for an unknown quote.
+        """
+        key = (user_id, quote_id)
+        fields = list(Reaction.COUNTER_FIELDS.values())
+        stored = Quote.objects.filter(pk=quote_id).values_list(*fields).first()
+        if stored is None:
+            raise Quote.DoesNotExist
+
+        with self._lock:
+            known, current = self._state(key)
+        if not known:
+            current = (
+                Reaction.objects.filter(user_id=user_id, quote_id=quote_id)
+                .values_list("type", flat=True)
+                .first()
+            )
+
+        with self._lock:
+            # Another request from the same user may have buffered meanwhile.
+            known, buffered = self._state(key)
+            if known:
+                current = buffered
+            wanted = change(current)
+            entry = self._pending.setdefault(key, [current, current])
+            overlay = self._overlay[quote_id]
+            if entry[1]:
+                overlay[entry[1]] -= 1
+            if wanted:
+                overlay[wanted] += 1
+            entry[1] = wanted
+            full = len(self._pending) >= self.max_pending
+            counts = {
+                reaction_type: count
+                + self._overlay[quote_id][reaction_type]
+                + self._flushing_overlay[quote_id][reaction_type]
+                for reaction_type, count in zip(Reaction.COUNTER_FIELDS, stored)
+            }
+
+        self.start()
+        if full:
+            self._wake.set()
+        return wanted, counts
+
+    def _state(self, key) -> Tuple[bool, Optional[str]]:
+        """`(known, wanted type)` of a buffered reaction; hold the lock."""
+        for entries in (self._pending, self._flushing):
+            if key in entries:
+                return True, entries[key][1]
+        return False, None
+
+    def flush(self) -> int:
+        """Write every pending reaction out now. Returns how many changed."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                self._flushing_overlay, self._overlay = (
+                    self._overlay,
+                    defaultdict(Counter),
+                )
+            try:
+                changed = reactions.apply_reactions(
+                    {key: wanted for key, (_, wanted) in self._flushing.items()}
+                )
+            except Exception:
+                self._restore()
+                raise
+            with self._lock:
+                self._flushing = {}
+                self._flushing_overlay = defaultdict(Counter)
+            return changed
+
+    def _restore(self):
+        """Put a failed flush back in front of what was buffered since."""
+        with self._lock:
+            for key, entry in self._flushing.items():
+                if key in self._pending:
+                    self._pending[key][0] = entry[0]
+                else:
+                    self._pending[key] = entry
+            for quote_id, deltas in self._flushing_overlay.items():
+                self._overlay[quote_id].update(deltas)
+            self._flushing = {}
+            self._flushing_overlay = defaultdict(Counter)
+
+    def start(self):
+        """Start the flush thread, unless running or the interval is 0."""
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None and not self._stopping.is_set():
+                self._thread = threading.Thread(
+                    target=self._run, name="reaction-buffer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Reaction buffer flush failed; will retry")
+            finally:
+                connections.close_all()
+
+    def stop(self):
+        """Stop the flush thread and drain whatever is still buffered."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self._stopping.clear()
+
+
+reaction_buffer = ReactionBuffer()
+atexit.register(reaction_buffer.stop)
@@ -0,0 +1,306 @@
+"""
+Helpers for keeping the denormalized reaction counters on `Quote` exact,
+and the atomic reaction toggle that writes through them.
+"""
+import random
+import time
+from collections import defaultdict
+from typing import Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db import (
+    DatabaseError,
+    OperationalError,
+    connections,
+    router,
+    transaction,
+)
+from django.db.models import Count, F
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery, UpdateQuery
+
+from . import trending, versions
+from .models import Quote, Reaction
+
+TOGGLE_ATTEMPTS = 30
+
+
+def count_changes(deltas: dict, trending_delta: float = 0) -> dict:
+    changes = {
+        Reaction.COUNTER_FIELDS[reaction_type]: F(Reaction.COUNTER_FIELDS[reaction_type])
+        + delta
+        for reaction_type, delta in deltas.items()
+        if delta
+    }
+    if trending_delta:
+        changes["trending_score"] = trending.score_change(trending_delta)
+    return changes
+
+
+def apply_count_deltas(quote_id: int, deltas: dict, trending: float = 0):
+    """
+    Atomically add `{reaction_type: delta}` to a quote's counters, and
+    `trending` to its trending score, in a single UPDATE.
+    """
+    changes = count_changes(deltas, trending)
+    if changes:
+        Quote.objects.filter(pk=quote_id).update(**changes)
+
+
+def reconcile(quote_ids=None, batch_size: int = 500) -> int:
+    """
+    Recompute the counters from the reactions table in batches of quotes and
+    fix any that drifted. Returns the number of quotes that were corrected.
+    """
+    fields = list(Reaction.COUNTER_FIELDS.values())
+    quotes = Quote.objects.order_by("pk").only("pk", *fields)
+    if quote_ids is not None:
+        quotes = quotes.filter(pk__in=quote_ids)
+
+    fixed = 0
+    last_pk = 0
+    while True:
+        batch = list(quotes.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return fixed
+        last_pk = batch[-1].pk
+
+        actual = defaultdict(dict)
+        rows = (
+            Reaction.objects.filter(quote_id__in=[quote.pk for quote in batch])
+            .values_list("quote_id", "type")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        for quote_id, reaction_type, count in rows:
+            actual[quote_id][reaction_type] = count
+
+        stale = []
+        for quote in batch:
+            counts = actual[quote.pk]
+            expected = {
+                field: counts.get(reaction_type, 0)
+                for reaction_type, field in Reaction.COUNTER_FIELDS.items()
+            }
+            if any(getattr(quote, field) != value for field, value in expected.items()):
+                for field, value in expected.items():
+                    setattr(quote, field, value)
+                stale.append(quote)
+
+        if stale:
+            Quote.objects.bulk_update(stale, fields)
+            versions.bump(versions.QUOTES)
+        fixed += len(stale)
+
+
+def supports_update_returning(connection) -> bool:
+    # SQLite gained RETURNING in the same release (3.35) as INSERT ... RETURNING.
+    return connection.vendor == "postgresql" or (
+        connection.vendor == "sqlite"
+        and connection.features.can_return_columns_from_insert
+    )
+
+
+def update_counts(quote_id: int, changes: dict) -> Optional[dict]:
+    """
+    Apply `changes` to a quote and return its counters afterwards, as
+    `{reaction_type: count}`, or None if there is no such quote. Uses
+    UPDATE ... RETURNING where the database has it, so it is one statement.
+    """
+    fields = list(Reaction.COUNTER_FIELDS.values())
+    db = router.db_for_write(Quote)
+    queryset = Quote.objects.db_manager(db).filter(pk=quote_id)
+    connection = connections[db]
+    if supports_update_returning(connection):
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(changes)
+        sql, params = query.get_compiler(db).as_sql()
+        columns = ", ".join(connection.ops.quote_name(field) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} RETURNING {columns}", params)
+            row = cursor.fetchone()
+    else:
+        queryset.update(**changes)
+        row = queryset.values_list(*fields).first()
+    if row is None:
+        return None
+    return dict(zip(Reaction.COUNTER_FIELDS, row))
+
+
+def insert_reaction(user_id: int, quote_id: int, reaction_type: str) -> bool:
+    """
+    INSERT the reaction unless the user already reacted to the quote
+    (`ON CONFLICT DO NOTHING`, `INSERT OR IGNORE`... per database).
+    Returns whether a row was inserted.
+    """
+    db = router.db_for_write(Reaction)
+    fields = [
+        field for field in Reaction._meta.concrete_fields if not field.primary_key
+    ]
+    query = InsertQuery(Reaction, on_conflict=OnConflict.IGNORE)
+    query.insert_values(
+        fields, [Reaction(user_id=user_id, quote_id=quote_id, type=reaction_type)]
+    )
+    inserted = 0
+    with connections[db].cursor() as cursor:
+        for sql, params in query.get_compiler(db).as_sql():
+            cursor.execute(sql, params)
+            inserted += cursor.rowcount
+    return inserted > 0
+
+
+def delete_reaction(pk: int, reaction_type: str) -> bool:
+    """DELETE the reaction if it still has `reaction_type`, without signals."""
+    db = router.db_for_write(Reaction)
+    connection = connections[db]
+    table = connection.ops.quote_name(Reaction._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE id = %s AND type = %s", [pk, reaction_type]
+        )
+        return cursor.rowcount > 0
+
+
+def toggle(
+    user_id: int, quote_id: int, reaction_type: str
+) -> Tuple[Optional[str], dict]:
+    """
+    Toggle a user's reaction on a quote: add it, switch its type, or remove
+    it when it already has `reaction_type`. Returns the user's reaction type
+    afterwards (None once removed) and the quote's new `{type: count}`.
+
+    Each write is conditional on the state just read (a compare-and-set),
+    and the counters move by the delta of the write that succeeded, in the
+    same transaction. A toggle racing another on the same row retries, so
+    counts stay exact under concurrency even where SELECT ... FOR UPDATE is
+    a no-op. These writes bypass model signals, so the trending score and
+    version counters are updated here. Raises Quote.DoesNotExist for an
+    unknown quote.
+
+    SQLite fails a writer that finds the database locked right away rather
+    than blocking it, so there lock errors are retried with jittered backoff.
+    """
+    db = router.db_for_write(Reaction)
+    weight = trending.reaction_weight()
+    for attempt in range(TOGGLE_ATTEMPTS):
+        try:
+            with transaction.atomic(using=db):
+                current = (
+                    Reaction.objects.select_for_update()
+                    .filter(user_id=user_id, quote_id=quote_id)
+                    .annotate(decayed_at=trending.last_decay_subquery())
+                    .values_list("pk", "type", "created_at", "decayed_at")
+                    .first()
+                )
+                if current is None:
+                    done = insert_reaction(user_id, quote_id, reaction_type)
+                    result, deltas, score = reaction_type, {reaction_type: 1}, weight
+                elif current[1] == reaction_type:
+                    done = delete_reaction(current[0], reaction_type)
+                    result, deltas = None, {reaction_type: -1}
+                    score = -trending.reaction_contribution(current[2], current[3])
+                else:
+                    done = Reaction.objects.filter(
+                        pk=current[0], type=current[1]
+                    ).update(type=reaction_type)
+                    result, score = reaction_type, 0
+                    deltas = {current[1]: -1, reaction_type: 1}
+                if not done:
+                    # A concurrent toggle changed the row first; look again.
+                    continue
+                counts = update_counts(quote_id, count_changes(deltas, score))
+                if counts is None:
+                    raise Quote.DoesNotExist
+        except OperationalError as exc:
+            # SQLite reports a competing writer instead of waiting for it.
+            if connections[db].vendor != "sqlite" or "locked" not in str(exc):
+                raise
+            time.sleep(random.uniform(0, 0.002 * 2 ** min(attempt, 6)))
+            continue
+        versions.bump(versions.QUOTES)
+        return result, counts
+    raise DatabaseError("Reaction toggle kept conflicting with concurrent writes")
+
+
+def apply_reactions(states: dict, batch_size: int = 500) -> int:
+    """
+    Bring many users' reactions to the given states in bulk, with
+    `states` as `{(user_id, quote_id): reaction_type or None}` (None for
+    no reaction). Per batch: one read of the current rows, one upsert, one
+    DELETE per quote and one counter UPDATE per quote, so a thousand likes
+    on one quote cost a handful of statements. Counters move by the
+    difference against what is actually stored, so they stay exact whatever
+    happened to the rows in between. Returns the number of reactions changed.
+    """
+    changed = 0
+    keys = list(states)
+    for start in range(0, len(keys), batch_size):
+        batch = {key: states[key] for key in keys[start : start + batch_size]}
+        with transaction.atomic(using=router.db_for_write(Reaction)):
+            changed += apply_reaction_batch(batch)
+    if changed:
+        versions.bump(versions.QUOTES)
+    return changed
+
+
+def apply_reaction_batch(states: dict) -> int:
+    quote_ids = {quote_id for _, quote_id in states}
+    user_ids = {user_id for user_id, _ in states}
+    # Quotes or users deleted since the reaction was buffered are dropped.
+    live_quotes = set(
+        Quote.objects.filter(pk__in=quote_ids).values_list("pk", flat=True)
+    )
+    live_users = set(
+        User.objects.filter(pk__in=user_ids).values_list("pk", flat=True)
+    )
+    stored = {
+        (user_id, quote_id): (reaction_type, created_at)
+        for user_id, quote_id, reaction_type, created_at in (
+            Reaction.objects.select_for_update()
+            .filter(quote_id__in=quote_ids, user_id__in=user_ids)
+            .values_list("user_id", "quote_id", "type", "created_at")
+        )
+    }
+
+    upserts, deletes = [], defaultdict(list)
+    deltas = defaultdict(lambda: defaultdict(int))
+    scores = defaultdict(float)
+    decayed_at = trending.last_decay()
+    for (user_id, quote_id), wanted in states.items():
+        if quote_id not in live_quotes or user_id not in live_users:
+            continue
+        current, created_at = stored.get((user_id, quote_id), (None, None))
+        if current == wanted:
+            continue
+        if wanted is None:
+            deletes[quote_id].append(user_id)
+            # Take off what the reaction still adds, not its full weight.
+            scores[quote_id] -= trending.reaction_contribution(created_at, decayed_at)
+        else:
+            upserts.append(Reaction(user_id=user_id, quote_id=quote_id, type=wanted))
+            deltas[quote_id][wanted] += 1
+            if current is None:
+                scores[quote_id] += trending.reaction_weight()
+        if current is not None:
+            deltas[quote_id][current] -= 1
+
+    Reaction.objects.bulk_create(
+        upserts,
+        update_conflicts=True,
+        unique_fields=["user", "quote"],
+        update_fields=["type"],
+    )
+    connection = connections[router.db_for_write(Reaction)]
+    table = connection.ops.quote_name(Reaction._meta.db_table)
+    with connection.cursor() as cursor:
+        for quote_id, users in deletes.items():
+            placeholders = ", ".join(["%s"] * len(users))
+            cursor.execute(
+                f"DELETE FROM {table} "
+                f"WHERE quote_id = %s AND user_id IN ({placeholders})",
+                [quote_id, *users],
+            )
+
+    for quote_id, quote_deltas in deltas.items():
+        apply_count_deltas(quote_id, quote_deltas, scores[quote_id])
+    return len(upserts) + sum(len(users) for users in deletes.values())
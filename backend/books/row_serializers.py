@@ -0,0 +1,207 @@
+"""
+Read-only fast path for hot list endpoints.
+
+Builds the same JSON shapes as `QuoteSerializer`, `CommentSerializer` and
+`BookSerializer` straight from `.values()` rows, using row-to-dict functions
+compiled once from the serializers' own field definitions. That skips the
+per-field, per-row machinery of `ModelSerializer` (attribute lookups,
+`get_attribute`, nested serializer instances) while staying in sync with the
+fields the serializers declare.
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from accounts.summaries import get_user_summaries
+from backend import metrics
+from .models import Quote, Reaction
+from .serializers import BookSerializer, CommentSerializer, QuoteSerializer
+
+# Fields whose representation of a `.values()` value is the value itself.
+PLAIN_FIELDS = (
+    serializers.IntegerField,
+    serializers.CharField,
+    serializers.JSONField,
+    serializers.BooleanField,
+    serializers.FloatField,
+    serializers.PrimaryKeyRelatedField,
+)
+# Fields whose representation needs the DRF field's own conversion.
+CONVERTED_FIELDS = (
+    serializers.DateField,
+    serializers.DecimalField,
+)
+
+
+def datetime_converter(field):
+    """
+    DRF's DateTimeField looks up the current timezone for every value; for
+    the default ISO 8601 output do the same conversion with the timezone
+    resolved once per batch (see `row_context`).
+    """
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if (
+        output_format is None
+        or output_format.lower() != ISO_8601
+        or getattr(field, "timezone", None) is not None
+    ):
+        return lambda value, context: field.to_representation(value)
+
+    def convert(value, context):
+        if timezone.is_naive(value):
+            return field.to_representation(value)
+        if context["timezone"] is not None:
+            value = value.astimezone(context["timezone"])
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return convert
+
+
+def row_context(**extra):
+    zone = timezone.get_current_timezone() if settings.USE_TZ else None
+    return {"timezone": zone, **extra}
+
+
+def compile_row_serializer(serializer_class, prefix="", **custom):
+    """
+    Compile a `serialize(row, context)` function for `serializer_class`.
+
+    Plain model fields are copied from `row[prefix + source]`, converted
+    fields go through the DRF field's `to_representation`, and every other
+    field must be supplied in `custom` as a `callable(row, context)`. The
+    `.values()` columns the plain fields need are exposed as `.columns`;
+    `context` comes from `row_context()`.
+    """
+    plan = []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if name in custom:
+            plan.append((name, None, custom[name]))
+        elif isinstance(field, serializers.DateTimeField):
+            plan.append((name, prefix + field.source, datetime_converter(field)))
+        elif isinstance(field, CONVERTED_FIELDS):
+            convert = field.to_representation
+            plan.append(
+                (name, prefix + field.source, lambda value, context: convert(value))
+            )
+        elif isinstance(field, PLAIN_FIELDS):
+            plan.append((name, prefix + field.source, None))
+        else:
+            raise TypeError(
+                f"{serializer_class.__name__}.{name} needs a custom row function"
+            )
+
+    def serialize(row, context):
+        data = {}
+        for name, column, convert in plan:
+            if column is None:
+                data[name] = convert(row, context)
+            else:
+                value = row[column]
+                if convert is not None and value is not None:
+                    value = convert(value, context)
+                data[name] = value
+        return data
+
+    serialize.columns = [column for _, column, _ in plan if column is not None]
+    return serialize
+
+
+@lru_cache(maxsize=None)
+def book_row_serializer(prefix=""):
+    return compile_row_serializer(BookSerializer, prefix=prefix)
+
+
+@lru_cache(maxsize=None)
+def quote_row_serializer():
+    book = book_row_serializer("book__")
+    serialize = compile_row_serializer(
+        QuoteSerializer,
+        user=lambda row, context: context["users"].get(row["user_id"]),
+        book=lambda row, context: book(row, context),
+        tags=lambda row, context: context["tags"].get(row["id"], []),
+        reaction_counts=lambda row, context: {
+            reaction_type: row[field]
+            for reaction_type, field in Reaction.COUNTER_FIELDS.items()
+        },
+    )
+    serialize.columns += [
+        "user_id",
+        *Reaction.COUNTER_FIELDS.values(),
+        *book.columns,
+    ]
+    return serialize
+
+
+@lru_cache(maxsize=None)
+def comment_row_serializer():
+    serialize = compile_row_serializer(
+        CommentSerializer,
+        user=lambda row, context: context["users"].get(row["user_id"]),
+        replies=lambda row, context: [],
+    )
+    serialize.columns += ["user_id"]
+    return serialize
+
+
+def quote_rows(queryset, *extra):
+    """
+    `.values()` queryset with every column `serialize_quote_rows` needs,
+    plus any `extra` ones (e.g. a pagination cursor's ordering field).
+    """
+    return queryset.values(*quote_row_serializer().columns, *extra)
+
+
+@metrics.timed_function("serialize")
+def serialize_quote_rows(rows):
+    rows = list(rows)
+    quote_ids = [row["id"] for row in rows]
+    tags = defaultdict(list)
+    tag_rows = (
+        Quote.tags.through.objects.filter(quote_id__in=quote_ids)
+        .order_by("quote_id", "tag_id")
+        .values_list("quote_id", "tag_id", "tag__name", "tag__slug")
+    )
+    for quote_id, tag_id, name, slug in tag_rows:
+        tags[quote_id].append({"id": tag_id, "name": name, "slug": slug})
+
+    context = row_context(
+        tags=tags, users=get_user_summaries(row["user_id"] for row in rows)
+    )
+    serialize = quote_row_serializer()
+    return [serialize(row, context) for row in rows]
+
+
+@metrics.timed_function("serialize")
+def serialize_books(queryset):
+    serialize = book_row_serializer()
+    context = row_context()
+    return [serialize(row, context) for row in queryset.values(*serialize.columns)]
+
+
+@metrics.timed_function("serialize")
+def serialize_comment_thread(queryset):
+    """
+    Serialize a thread from a comment queryset (e.g. one quote's comments,
+    optionally depth-limited) as nested top-level comments with replies.
+    """
+    serialize = comment_row_serializer()
+    rows = list(queryset.values(*serialize.columns))
+    context = row_context(users=get_user_summaries(row["user_id"] for row in rows))
+
+    by_id = {row["id"]: serialize(row, context) for row in rows}
+    roots = []
+    # Rows keep Comment.Meta.ordering, so sibling lists keep it too.
+    for row in rows:
+        parent = by_id.get(row["parent"])
+        if parent is None:
+            roots.append(by_id[row["id"]])
+        else:
+            parent["replies"].append(by_id[row["id"]])
+    return roots
@@ -0,0 +1,132 @@
+"""
+Local full-text search over books and quotes.
+
+On SQLite the text lives in FTS5 tables (created by migration 0009) and is
+kept in sync by signals in `books.signals`; results are ranked by bm25. Other
+database backends fall back to plain `icontains` lookups.
+"""
+import re
+from typing import List
+
+from django.db import connection
+
+from .models import Book, Quote
+from .utils import normalize_query
+
+BOOK_TABLE = "books_book_fts"
+QUOTE_TABLE = "books_quote_fts"
+
+
+def fts_enabled() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def match_expression(query: str) -> str:
+    """
+    Turn free text into a safe FTS5 query: every word must match, and the
+    last one may be a prefix so search-as-you-type works.
+    """
+    words = re.findall(r"\w+", normalize_query(query))
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _replace(table: str, rowid: int, columns: dict):
+    names = ", ".join(columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {table} (rowid, {names}) VALUES (%s, {placeholders})",
+            [rowid, *columns.values()],
+        )
+
+
+def _delete(table: str, rowid: int):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [rowid])
+
+
+def _match(table: str, query: str, limit: int) -> List[int]:
+    expression = match_expression(query)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH %s "
+            f"ORDER BY bm25({table}) LIMIT %s",
+            [expression, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def book_document(book: Book) -> dict:
+    return {"title": book.title, "authors": " ".join(book.authors or [])}
+
+
+def quote_document(quote: Quote) -> dict:
+    return {"text": quote.text, "context": quote.context or ""}
+
+
+def index_book(book: Book):
+    if fts_enabled():
+        _replace(BOOK_TABLE, book.pk, book_document(book))
+
+
+def remove_book(book_id: int):
+    if fts_enabled():
+        _delete(BOOK_TABLE, book_id)
+
+
+def index_quote(quote: Quote):
+    if fts_enabled():
+        _replace(QUOTE_TABLE, quote.pk, quote_document(quote))
+
+
+def index_quotes(quotes: List[Quote]):
+    """Index freshly bulk-created quotes in one statement."""
+    if fts_enabled() and quotes:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {QUOTE_TABLE} (rowid, text, context) VALUES (%s, %s, %s)",
+                [(quote.pk, quote.text, quote.context or "") for quote in quotes],
+            )
+
+
+def remove_quote(quote_id: int):
+    if fts_enabled():
+        _delete(QUOTE_TABLE, quote_id)
+
+
+def rebuild():
+    """Re-index every book and quote from scratch."""
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {BOOK_TABLE}")
+        cursor.execute(f"DELETE FROM {QUOTE_TABLE}")
+    for book in Book.objects.only("title", "authors").iterator(chunk_size=2000):
+        index_book(book)
+    for quote in Quote.objects.only("text", "context").iterator(chunk_size=2000):
+        index_quote(quote)
+
+
+def _ordered(queryset, ids):
+    by_id = queryset.in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+def search_books(query: str, limit: int = 20) -> List[Book]:
+    if fts_enabled():
+        return _ordered(Book.objects.all(), _match(BOOK_TABLE, query, limit))
+    return list(Book.objects.filter(title__icontains=query.strip())[:limit])
+
+
+def search_quotes(query: str, limit: int = 20, queryset=None) -> List[Quote]:
+    queryset = Quote.objects.all() if queryset is None else queryset
+    if fts_enabled():
+        return _ordered(queryset, _match(QUOTE_TABLE, query, limit))
+    return list(queryset.filter(text__icontains=query.strip())[:limit])
@@ -1,6 +1,34 @@
+from django.db import models
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from accounts.summaries import get_user_summaries
+from backend import metrics
 from .models import Book, Quote, Tag, Reaction, Comment, UserFavorite
-from django.utils.text import slugify
+from .tags import set_quote_tags
+
+
+def preload_user_summaries(context, user_ids):
+    """Add any missing user summaries to a serializer context in one batch."""
+    summaries = context.setdefault("user_summaries", {})
+    missing = set(user_ids) - summaries.keys()
+    if missing:
+        summaries.update(get_user_summaries(missing))
+    return summaries
+
+
+def get_user_summary(serializer, obj):
+    return preload_user_summaries(serializer.context, [obj.user_id]).get(obj.user_id)
+
+
+class UserSummaryListSerializer(serializers.ListSerializer):
+    """Loads the authors of a whole page of rows before rendering it."""
+
+    def to_representation(self, data):
+        rows = data.all() if isinstance(data, models.manager.BaseManager) else data
+        with metrics.timed("serialize"):
+            rows = list(rows)
+            preload_user_summaries(self.context, [row.user_id for row in rows])
+            return super().to_representation(rows)
 
 
 class BookSerializer(serializers.ModelSerializer):
@@ -8,11 +36,29 @@ class BookSerializer(serializers.ModelSerializer):
         model = Book
         fields = "__all__"
 
+class TagNameField(serializers.CharField):
+    """Tag names are stored stripped and lowercased, whoever writes them."""
+
+    def to_internal_value(self, data):
+        return super().to_internal_value(data).strip().lower()
+
+
 class TagSerializer(serializers.ModelSerializer):
+    name = TagNameField(
+        max_length=50, validators=[UniqueValidator(queryset=Tag.objects.all())]
+    )
+
     class Meta:
         model = Tag
         fields = ['id', 'name', 'slug']
 
+class TagCountSerializer(TagSerializer):
+    """A tag with how many quotes use it, for tag clouds and autocomplete."""
+
+    class Meta(TagSerializer.Meta):
+        fields = ['id', 'name', 'slug', 'quote_count']
+        read_only_fields = ['quote_count']
+
 class QuoteSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     tags_list = serializers.ListField(
@@ -24,47 +70,39 @@ class QuoteSerializer(serializers.ModelSerializer):
     )
     book = BookSerializer(read_only=True)
     user = serializers.SerializerMethodField()
+    reaction_counts = serializers.DictField(
+        child=serializers.IntegerField(), read_only=True
+    )
 
     class Meta:
         model = Quote
-        fields = ["id", "user", "book", "text", "context", "tags", "tags_list", "created_at"]
+        fields = [
+            "id",
+            "user",
+            "book",
+            "text",
+            "context",
+            "tags",
+            "tags_list",
+            "reaction_counts",
+            "created_at",
+        ]
         read_only_fields = ["user", "book"]
+        list_serializer_class = UserSummaryListSerializer
 
     def get_user(self, obj):
-        return {
-            'id': obj.user.id,
-            'username': obj.user.username,
-            'avatar': obj.user.profile.avatar.url if hasattr(obj.user, 'profile') and obj.user.profile.avatar else None
-        }
+        return get_user_summary(self, obj)
 
     def create(self, validated_data):
         tags_data = validated_data.pop("tags")
         quote = Quote.objects.create(**validated_data)
-
-        for tag_name in tags_data:
-            tag_name = tag_name.lower().strip()
-            slug = slugify(tag_name)
-            tag, _ = Tag.objects.get_or_create(
-                name=tag_name,
-                defaults={"slug": slug}
-            )
-            quote.tags.add(tag)
-
+        set_quote_tags(quote, tags_data, replace=False)
         return quote
 
     def update(self, instance, validated_data):
         if 'tags' in validated_data:
-            tags_data = validated_data.pop("tags")
-            instance.tags.clear()
-            for tag_name in tags_data:
-                tag_name = tag_name.lower().strip()
-                slug = slugify(tag_name)
-                tag, _ = Tag.objects.get_or_create(
-                    name=tag_name,
-                    defaults={"slug": slug}
-                )
-                instance.tags.add(tag)
-        
+            set_quote_tags(instance, validated_data.pop("tags"))
+
         return super().update(instance, validated_data)
 
 
@@ -91,17 +129,19 @@ class CommentSerializer(serializers.ModelSerializer):
             'replies'
         ]
         read_only_fields = ['user', 'created_at', 'updated_at']
+        list_serializer_class = UserSummaryListSerializer
 
     def get_user(self, obj):
-        return {
-            'id': obj.user.id,
-            'username': obj.user.username,
-            'avatar': obj.user.profile.avatar.url if hasattr(obj.user, 'profile') and obj.user.profile.avatar else None
-        }
+        return get_user_summary(self, obj)
 
     def get_replies(self, obj):
-        replies = obj.replies.all()
-        return CommentSerializer(replies, many=True).data
+        # Views that load the thread up front pass a `reply_map` in the context
+        reply_map = self.context.get("reply_map")
+        if reply_map is None:
+            replies = obj.replies.all()
+        else:
+            replies = reply_map.get(obj.pk, [])
+        return CommentSerializer(replies, many=True, context=self.context).data
 
 
 class QuoteFeedSerializer(serializers.ModelSerializer):
@@ -0,0 +1,121 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import Profile
+from . import search, tags, timeline, trending, versions
+from .models import Book, Comment, Quote, QuoteTag, Reaction, Tag
+from .reactions import apply_count_deltas
+
+
+@receiver(post_save, sender=Quote)
+def fan_out_quote(sender, instance=None, created=False, **kwargs):
+    if created:
+        transaction.on_commit(partial(timeline.fan_out, instance))
+
+
+@receiver(post_delete, sender=Quote)
+def retract_quote(sender, instance=None, **kwargs):
+    timeline.retract(instance)
+
+
+@receiver(post_save, sender=Quote)
+def index_quote(sender, instance=None, **kwargs):
+    search.index_quote(instance)
+
+
+@receiver(post_delete, sender=Quote)
+def unindex_quote(sender, instance=None, **kwargs):
+    search.remove_quote(instance.pk)
+
+
+@receiver(pre_delete, sender=Quote)
+def uncount_quote_tags(sender, instance=None, **kwargs):
+    # The through rows go in a cascade that sends no signals of its own.
+    tag_ids = QuoteTag.objects.filter(quote_id=instance.pk).values_list(
+        "tag_id", flat=True
+    )
+    tags.adjust_quote_counts({tag_id: -1 for tag_id in tag_ids})
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance=None, **kwargs):
+    search.index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance=None, **kwargs):
+    search.remove_book(instance.pk)
+
+
+@receiver(post_save, sender=Reaction)
+def count_saved_reaction(sender, instance=None, created=False, **kwargs):
+    previous = None if created else getattr(instance, "_loaded_type", None)
+    if created:
+        apply_count_deltas(
+            instance.quote_id, {instance.type: 1}, trending.reaction_weight()
+        )
+    elif previous and previous != instance.type:
+        apply_count_deltas(instance.quote_id, {previous: -1, instance.type: 1})
+    instance._loaded_type = instance.type
+
+
+@receiver(post_delete, sender=Reaction)
+def count_deleted_reaction(sender, instance=None, origin=None, **kwargs):
+    # Skip the update when the quote itself is being deleted.
+    if isinstance(origin, Quote) or (
+        isinstance(origin, QuerySet) and origin.model is Quote
+    ):
+        return
+    apply_count_deltas(
+        instance.quote_id,
+        {instance.type: -1},
+        -trending.reaction_contribution(instance.created_at, trending.last_decay()),
+    )
+
+
+@receiver(post_save, sender=Comment)
+def score_comment(sender, instance=None, created=False, **kwargs):
+    if created:
+        trending.add(instance.quote_id, trending.comment_weight())
+
+
+@receiver(post_save, sender=Quote)
+@receiver(post_delete, sender=Quote)
+@receiver(post_save, sender=Reaction)
+@receiver(post_delete, sender=Reaction)
+def bump_quote_versions(sender, instance=None, **kwargs):
+    versions.bump(versions.QUOTES)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_versions(sender, instance=None, **kwargs):
+    versions.bump(versions.quote_comments(instance.quote_id))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tag_versions(sender, instance=None, **kwargs):
+    versions.bump(versions.TAGS, versions.QUOTES)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_versions(sender, instance=None, **kwargs):
+    versions.bump(versions.book(instance.pk), versions.QUOTES)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def bump_user_versions(sender, instance=None, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which no rendered summary shows.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    versions.bump(versions.USERS)
@@ -0,0 +1,167 @@
+"""
+Resolve and attach tags with a constant number of queries, and keep the
+denormalized `Tag.quote_count` popularity counters up to date.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from django.db import connections, router
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Coalesce
+from django.db.models.sql import InsertQuery
+from django.utils.text import slugify
+
+from . import versions
+from .models import Quote, QuoteTag, Tag
+
+
+def normalize_tag_names(names: Iterable[str]) -> List[str]:
+    """Lowercase, strip and de-duplicate tag names, keeping their order."""
+    seen = {}
+    for name in names:
+        name = name.lower().strip()
+        if name:
+            seen.setdefault(name, None)
+    return list(seen)
+
+
+def resolve_tags(names: Iterable[str]) -> List[Tag]:
+    """
+    Fetch or create the tags for `names`: one lookup, one
+    `bulk_create(ignore_conflicts=True)` for the missing ones and one
+    re-read to pick up their ids (and any rows a concurrent writer added).
+    """
+    names = normalize_tag_names(names)
+    if not names:
+        return []
+
+    by_name = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        slugs = {name: slugify(name) for name in missing}
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slugs[name]) for name in missing],
+            ignore_conflicts=True,
+        )
+        versions.bump(versions.TAGS)
+        created = Tag.objects.filter(
+            Q(name__in=missing) | Q(slug__in=slugs.values())
+        )
+        by_slug = {}
+        for tag in created:
+            by_name.setdefault(tag.name, tag)
+            by_slug[tag.slug] = tag
+        # A name whose slug is already taken maps onto the existing tag.
+        for name in missing:
+            if name not in by_name and slugs[name] in by_slug:
+                by_name[name] = by_slug[slugs[name]]
+
+    return [by_name[name] for name in names if name in by_name]
+
+
+def set_quote_tags(quote: Quote, names: Iterable[str], replace: bool = True):
+    """
+    Attach tags to a quote with one through-table insert, or when replacing,
+    with a diff against the current rows instead of clear-and-re-add.
+    """
+    wanted = {tag.pk for tag in resolve_tags(names)}
+    current = QuoteTag.objects.filter(quote_id=quote.pk)
+    if not replace:
+        current = current.filter(tag_id__in=wanted)
+    current = set(current.values_list("tag_id", flat=True))
+    removed = current - wanted if replace else set()
+    deleted = 0
+    if removed:
+        deleted, _ = QuoteTag.objects.filter(
+            quote_id=quote.pk, tag_id__in=removed
+        ).delete()
+
+    added = wanted - current
+    inserted = insert_quote_tags(quote.pk, added)
+    if inserted or deleted:
+        # Bulk through-table writes skip the signals that bump versions.
+        versions.bump(versions.QUOTES)
+    # A concurrent writer may have added or removed some of the same links
+    # since we read them; then only a recount knows which rows were ours.
+    if inserted == len(added) and deleted == len(removed):
+        adjust_quote_counts(
+            {**{tag_id: 1 for tag_id in added}, **{tag_id: -1 for tag_id in removed}}
+        )
+    else:
+        recount_quote_counts(added | removed)
+    if hasattr(quote, "_prefetched_objects_cache"):
+        quote._prefetched_objects_cache.pop("tags", None)
+
+
+def insert_quote_tags(quote_id: int, tag_ids: Iterable[int]) -> int:
+    """
+    INSERT the quote's links to `tag_ids`, skipping the ones that already
+    exist. Returns the number of rows inserted, which `bulk_create()` with
+    `ignore_conflicts=True` does not report.
+    """
+    links = [QuoteTag(quote_id=quote_id, tag_id=tag_id) for tag_id in tag_ids]
+    if not links:
+        return 0
+    db = router.db_for_write(QuoteTag)
+    fields = [
+        field for field in QuoteTag._meta.concrete_fields if not field.primary_key
+    ]
+    query = InsertQuery(QuoteTag, on_conflict=OnConflict.IGNORE)
+    query.insert_values(fields, links)
+    inserted = 0
+    with connections[db].cursor() as cursor:
+        for sql, params in query.get_compiler(db).as_sql():
+            cursor.execute(sql, params)
+            inserted += cursor.rowcount
+    return inserted
+
+
+def adjust_quote_counts(deltas: Dict[int, int]):
+    """Atomically add `{tag_id: delta}` to the tags' quote counts."""
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    # One UPDATE per distinct delta, usually just +1 or -1.
+    for delta, tag_ids in by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(quote_count=F("quote_count") + delta)
+    if by_delta:
+        versions.bump(versions.TAGS)
+
+
+def recount_quote_counts(tag_ids: Iterable[int]):
+    """Set the tags' quote counts from the through table, in one UPDATE."""
+    tag_ids = list(tag_ids)
+    if not tag_ids:
+        return
+    count = (
+        QuoteTag.objects.filter(tag_id=OuterRef("pk"))
+        .values("tag_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Tag.objects.filter(pk__in=tag_ids).update(
+        quote_count=Coalesce(Subquery(count), Value(0))
+    )
+    versions.bump(versions.TAGS)
+
+
+def refresh_quote_counts() -> int:
+    """
+    Recompute every tag's quote count with one GROUP BY over the through
+    table and fix the ones that drifted. Returns the number corrected.
+    """
+    actual = dict(
+        QuoteTag.objects.values_list("tag_id").annotate(count=Count("id")).order_by()
+    )
+    stale = []
+    for tag in Tag.objects.only("pk", "quote_count"):
+        count = actual.get(tag.pk, 0)
+        if tag.quote_count != count:
+            tag.quote_count = count
+            stale.append(tag)
+    if stale:
+        Tag.objects.bulk_update(stale, ["quote_count"], batch_size=500)
+        versions.bump(versions.TAGS)
+    return len(stale)
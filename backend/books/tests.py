@@ -1,3 +1,1990 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.db import IntegrityError
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from backend import metrics
+from backend.db_routing import ReplicaRoutingMiddleware, pin_key, sync_replica
+
+from . import (
+    enrichment,
+    exports,
+    imports,
+    reactions,
+    search,
+    tags,
+    timeline,
+    trending,
+)
+from .management.commands import run_benchmarks
+from .models import Book, Comment, Quote, Reaction, Tag
+from .reaction_buffer import ReactionBuffer
+from .row_serializers import (
+    quote_rows,
+    serialize_books,
+    serialize_comment_thread,
+    serialize_quote_rows,
+)
+from .serializers import (
+    BookSerializer,
+    CommentSerializer,
+    QuoteSerializer,
+)
+from .tags import refresh_quote_counts, set_quote_tags
+from .threads import load_thread
+from .singleflight import SingleFlight
+from .upstream import (
+    AsyncUpstreamClient,
+    CircuitBreaker,
+    CircuitOpenError,
+    UpstreamClient,
+)
+from .views import BookService, QuoteViewSet, book_service
+from .utils import (
+    AsyncGoogleBooksAPI,
+    GoogleBooksAPI,
+    normalize_query,
+    search_cache_key,
+    search_cache_stats,
+)
+
+
+class QuoteFeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        now = timezone.now()
+        self.quotes = []
+        for index in range(5):
+            quote = Quote.objects.create(user=self.user, book=self.book, text=f"q{index}")
+            # Two quotes share a timestamp so the id tie-breaker is exercised.
+            created_at = now - timedelta(minutes=index if index != 3 else 2)
+            Quote.objects.filter(pk=quote.pk).update(created_at=created_at)
+            self.quotes.append(quote)
+
+    def test_feed_walks_all_pages_without_gaps_or_duplicates(self):
+        seen = []
+        url = "/api/quotes/feed/?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["quotes"]), 2)
+            seen.extend(quote["id"] for quote in response.data["quotes"])
+            cursor = response.data["next"]
+            url = f"/api/quotes/feed/?page_size=2&cursor={cursor}" if cursor else None
+
+        expected = list(
+            Quote.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        response = self.client.get("/api/quotes/feed/?page_size=100000")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["quotes"]), 5)
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/quotes/feed/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHE_SHARED=True)
+class TimelineTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.other = User.objects.create_user("writer", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+
+    def create_quote(self, user, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Quote.objects.create(user=user, book=self.book, text=text)
+
+    def feed_ids(self, url="/api/quotes/feed/"):
+        return [quote["id"] for quote in self.client.get(url).data["quotes"]]
+
+    def test_new_quotes_are_fanned_out_to_warm_timelines(self):
+        first = self.create_quote(self.user, "first")
+        self.assertEqual(self.feed_ids(), [first.id])
+
+        second = self.create_quote(self.other, "second")
+        entries = cache.get("timeline:home")
+        self.assertEqual([quote_id for _, quote_id in entries], [second.id, first.id])
+        self.assertEqual(self.feed_ids(), [second.id, first.id])
+        self.assertEqual(
+            self.feed_ids(f"/api/quotes/feed/?user={self.other.id}"), [second.id]
+        )
+
+    def test_deleted_quotes_are_removed(self):
+        quote = self.create_quote(self.user, "gone")
+        self.assertEqual(self.feed_ids(), [quote.id])
+        quote.delete()
+        self.assertEqual(cache.get("timeline:home"), [])
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_a_page_of_deleted_quotes_does_not_end_the_feed(self):
+        quotes = [self.create_quote(self.user, f"q{index}") for index in range(4)]
+        self.assertEqual(len(self.feed_ids()), 4)
+        # Deleted while the timeline still lists them (e.g. its lock was busy).
+        with mock.patch.object(timeline, "remove"):
+            Quote.objects.filter(pk__in=[quotes[3].pk, quotes[2].pk]).delete()
+
+        first = self.client.get("/api/quotes/feed/?page_size=2").data
+        self.assertEqual(first["quotes"], [])
+        self.assertIsNotNone(first["next"])
+        second = self.client.get(
+            "/api/quotes/feed/", {"page_size": 2, "cursor": first["next"]}
+        ).data
+        self.assertEqual(
+            [quote["id"] for quote in second["quotes"]], [quotes[1].id, quotes[0].id]
+        )
+
+    def test_pages_past_the_trimmed_tail_fall_back_to_the_database(self):
+        quotes = [self.create_quote(self.user, f"q{index}") for index in range(5)]
+        with mock.patch.object(timeline, "MAX_LENGTH", 3):
+            timeline.rebuild(timeline.HOME)
+            self.assertEqual(len(cache.get("timeline:home")), 3)
+            first = self.client.get("/api/quotes/feed/?page_size=2").data
+            second = self.client.get(
+                f"/api/quotes/feed/?page_size=2&cursor={first['next']}"
+            ).data
+            third = self.client.get(
+                f"/api/quotes/feed/?page_size=2&cursor={second['next']}"
+            ).data
+
+        ids = [q["id"] for page in (first, second, third) for q in page["quotes"]]
+        self.assertEqual(ids, [quote.id for quote in reversed(quotes)])
+        self.assertIsNone(third["next"])
+
+    def test_rebuild_command(self):
+        quote = Quote.objects.create(user=self.user, book=self.book, text="q")
+        out = StringIO()
+        call_command("rebuild_timelines", stdout=out)
+        self.assertIn("Rebuilt 2 timelines", out.getvalue())
+        self.assertEqual(cache.get("timeline:home")[0][1], quote.id)
+
+    def test_concurrent_pushes_keep_every_quote(self):
+        timeline.rebuild(timeline.HOME)
+        now = timezone.now()
+        slow_insort = timeline.insort
+
+        def insort(*args, **kwargs):
+            # Widen the read-modify-write window.
+            time.sleep(0.01)
+            return slow_insort(*args, **kwargs)
+
+        with mock.patch.object(timeline, "insort", side_effect=insort):
+            threads = [
+                threading.Thread(
+                    target=timeline.push,
+                    args=(timeline.HOME, now + timedelta(seconds=index), index),
+                )
+                for index in range(1, 11)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        entries = cache.get("timeline:home")
+        self.assertEqual([quote_id for _, quote_id in entries], list(range(10, 0, -1)))
+
+    def test_writer_that_cannot_lock_marks_the_timeline_stale(self):
+        first = self.create_quote(self.user, "first")
+        self.assertEqual(self.feed_ids(), [first.id])
+        cache.add("timeline_lock:home", 1)
+        with mock.patch.object(timeline, "LOCK_WAIT", 0):
+            second = self.create_quote(self.user, "second")
+        cache.delete("timeline_lock:home")
+        self.assertEqual(self.feed_ids(), [second.id, first.id])
+
+    @override_settings(CACHE_SHARED=False)
+    def test_without_a_shared_cache_feeds_come_from_the_database(self):
+        quote = self.create_quote(self.user, "q")
+        self.assertEqual(self.feed_ids(), [quote.id])
+        self.assertIsNone(cache.get("timeline:home"))
+
+
+class ReactionCounterTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.other = User.objects.create_user("writer", password="pass12345")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quote = Quote.objects.create(user=self.user, book=book, text="fear")
+
+    def counts(self):
+        self.quote.refresh_from_db()
+        return self.quote.reaction_counts
+
+    def test_counters_follow_create_change_and_delete(self):
+        reaction = Reaction.objects.create(user=self.user, quote=self.quote, type="LIKE")
+        Reaction.objects.create(user=self.other, quote=self.quote, type="LIKE")
+        self.assertEqual(self.counts(), {"LIKE": 2, "LOVE": 0, "THINK": 0, "INSPIRE": 0})
+
+        reaction = Reaction.objects.get(pk=reaction.pk)
+        reaction.type = "LOVE"
+        reaction.save()
+        self.assertEqual(self.counts(), {"LIKE": 1, "LOVE": 1, "THINK": 0, "INSPIRE": 0})
+
+        reaction.delete()
+        self.assertEqual(self.counts(), {"LIKE": 1, "LOVE": 0, "THINK": 0, "INSPIRE": 0})
+
+    def test_feed_reads_counts_without_touching_reactions(self):
+        Reaction.objects.create(user=self.user, quote=self.quote, type="THINK")
+        self.client.get("/api/quotes/feed/")
+        # Author summaries are warm: the page and its tags.
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/quotes/feed/")
+        self.assertEqual(response.data["quotes"][0]["reaction_counts"]["THINK"], 1)
+
+    def test_reaction_and_counter_writes_commit_together(self):
+        reaction = Reaction.objects.create(user=self.user, quote=self.quote, type="LIKE")
+        self.client.force_authenticate(self.user)
+        with mock.patch(
+            "books.signals.apply_count_deltas", side_effect=DatabaseError("gone")
+        ), self.assertRaises(DatabaseError):
+            self.client.patch(
+                f"/api/reactions/{reaction.pk}/", {"type": "LOVE"}, format="json"
+            )
+        self.assertEqual(Reaction.objects.get().type, "LIKE")
+        self.assertEqual(self.counts(), {"LIKE": 1, "LOVE": 0, "THINK": 0, "INSPIRE": 0})
+
+    def test_reconcile_fixes_drift(self):
+        Reaction.objects.create(user=self.user, quote=self.quote, type="INSPIRE")
+        Quote.objects.filter(pk=self.quote.pk).update(inspire_count=7, like_count=3)
+
+        out = StringIO()
+        call_command("reconcile_reaction_counts", stdout=out)
+        self.assertIn("Fixed counters on 1 quotes", out.getvalue())
+        self.assertEqual(self.counts(), {"LIKE": 0, "LOVE": 0, "THINK": 0, "INSPIRE": 1})
+
+    def test_editing_a_quote_keeps_counts_made_since_it_was_loaded(self):
+        stale = Quote.objects.get(pk=self.quote.pk)
+        Reaction.objects.create(user=self.other, quote=self.quote, type="LOVE")
+
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(QuoteViewSet, "get_object", return_value=stale):
+            response = self.client.patch(
+                f"/api/quotes/{self.quote.pk}/", {"text": "edited"}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts()["LOVE"], 1)
+        self.assertGreater(self.quote.trending_score, 0)
+        self.assertEqual(self.quote.text, "edited")
+
+
+class CommentThreadTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="pass12345")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quote = Quote.objects.create(user=self.user, book=book, text="fear")
+        self.root = self.comment("root")
+        self.reply = self.comment("reply", parent=self.root)
+        self.nested = self.comment("nested", parent=self.reply)
+        self.sibling = self.comment("sibling", parent=self.root)
+        self.other_root = self.comment("other root")
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(
+            user=self.user, quote=self.quote, parent=parent, content=content
+        )
+
+    def test_paths_and_depths_are_maintained(self):
+        self.nested.refresh_from_db()
+        self.assertEqual(
+            self.nested.path,
+            f"{self.root.pk:010d}/{self.reply.pk:010d}/{self.nested.pk:010d}/",
+        )
+        self.assertEqual(self.nested.depth, 2)
+
+    def test_thread_loads_in_one_query(self):
+        cache.clear()
+        for index in range(3):
+            author = User.objects.create_user(f"author{index}", password="pass12345")
+            Comment.objects.create(
+                user=author, quote=self.quote, parent=self.sibling, content="deep"
+            )
+        # Cold: the thread plus one batch of author summaries.
+        with self.assertNumQueries(2):
+            self.client.get(f"/api/comments/quote/{self.quote.pk}/")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/comments/quote/{self.quote.pk}/")
+        self.assertEqual(
+            [comment["content"] for comment in response.data], ["other root", "root"]
+        )
+        root = response.data[1]
+        self.assertEqual(
+            [reply["content"] for reply in root["replies"]], ["sibling", "reply"]
+        )
+        self.assertEqual(len(root["replies"][0]["replies"]), 3)
+        self.assertEqual(root["replies"][1]["replies"][0]["content"], "nested")
+
+    def test_depth_limited_thread(self):
+        response = self.client.get(f"/api/comments/quote/{self.quote.pk}/?depth=1")
+        reply = response.data[1]["replies"][1]
+        self.assertEqual(reply["content"], "reply")
+        self.assertEqual(reply["replies"], [])
+
+    def test_subtree_retrieve(self):
+        response = self.client.get(f"/api/comments/{self.reply.pk}/")
+        self.assertEqual(response.data["content"], "reply")
+        self.assertEqual(response.data["replies"][0]["content"], "nested")
+
+    def test_unknown_quote_is_404(self):
+        response = self.client.get("/api/comments/quote/999/")
+        self.assertEqual(response.status_code, 404)
+
+
+class FakeGoogleBooks:
+    """A local stand-in for the Google Books API, served from a thread."""
+
+    def __init__(self):
+        self.replies = []  # (status, payload, delay) consumed in order
+        self.requests = []
+        self.client_ports = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                fake.client_ports.add(self.client_address[1])
+                status, payload, delay = (
+                    fake.replies.pop(0) if fake.replies else (200, {"items": []}, 0)
+                )
+                time.sleep(delay)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/volumes"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def volume(google_books_id, title="Dune"):
+    return {
+        "id": google_books_id,
+        "volumeInfo": {"title": title, "authors": ["Frank Herbert"]},
+    }
+
+
+class UpstreamClientTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.upstream = FakeGoogleBooks()
+        self.addCleanup(self.upstream.close)
+
+    def api(self, **options):
+        options.setdefault("backoff", 0)
+        options.setdefault("read_timeout", 1)
+        return GoogleBooksAPI(self.upstream.url, UpstreamClient(**options))
+
+    def test_connections_are_kept_alive_and_reused(self):
+        api = self.api()
+        for query in ("a", "b", "c"):
+            self.upstream.replies.append((200, {"items": [volume(query)]}, 0))
+            self.assertEqual(api.search_books(query)[0]["google_books_id"], query)
+        self.assertEqual(len(self.upstream.client_ports), 1)
+
+    def test_retries_transient_errors(self):
+        self.upstream.replies += [(503, {}, 0), (200, {"items": [volume("x")]}, 0)]
+        self.assertEqual(len(self.api(retries=2).search_books("dune")), 1)
+        self.assertEqual(len(self.upstream.requests), 2)
+
+    def test_slow_upstream_is_cut_off_by_the_read_timeout(self):
+        self.upstream.replies.append((200, {"items": [volume("x")]}, 1))
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            self.api(retries=0, read_timeout=0.2).fetch_book_details("x")
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        api = self.api(retries=0, breaker=breaker)
+        self.upstream.replies += [(500, {}, 0), (500, {}, 0)]
+        api.search_books("one")
+        api.search_books("two")
+        self.assertEqual(breaker.state, "open")
+
+        self.assertEqual(api.search_books("three"), [])
+        self.assertEqual(len(self.upstream.requests), 2)
+        with self.assertRaises(CircuitOpenError):
+            api.client.get(self.upstream.url)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "half-open")
+        self.assertEqual(self.api(breaker=breaker).search_books("dune"), [])
+        self.assertEqual(breaker.state, "closed")
+
+    def test_unexpected_error_in_the_trial_still_resolves_it(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        client = UpstreamClient(breaker=breaker)
+        with mock.patch.object(client.session, "get", side_effect=ValueError("bad")):
+            with self.assertRaises(ValueError):
+                client.get(self.upstream.url)
+        # The trial counted as a failure; the next call gets its own trial.
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+
+
+class BookSearchCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        search_cache_stats.reset()
+        self.upstream = FakeGoogleBooks()
+        self.addCleanup(self.upstream.close)
+        self.api = GoogleBooksAPI(self.upstream.url, UpstreamClient(retries=0))
+
+    def expire(self, query):
+        key = search_cache_key(normalize_query(query))
+        entry = cache.get(key)
+        cache.set(key, {**entry, "fresh_until": 0})
+
+    def test_queries_are_normalized(self):
+        self.assertEqual(normalize_query("  Ｄｕｎｅ\tMESSIAH "), "dune messiah")
+        self.upstream.replies.append((200, {"items": [volume("x")]}, 0))
+        self.api.search_books("Dune  Messiah")
+        self.api.search_books("dune messiah")
+        self.assertEqual(len(self.upstream.requests), 1)
+        self.assertEqual(search_cache_stats.snapshot(), {"miss": 1, "hit": 1})
+
+    def test_empty_and_failed_results_are_cached(self):
+        self.upstream.replies.append((200, {}, 0))
+        self.assertEqual(self.api.search_books("nothing"), [])
+        self.assertEqual(self.api.search_books("nothing"), [])
+        self.upstream.replies.append((500, {}, 0))
+        self.assertEqual(self.api.search_books("broken"), [])
+        self.assertEqual(self.api.search_books("broken"), [])
+        self.assertEqual(len(self.upstream.requests), 2)
+        self.assertEqual(search_cache_stats.snapshot()["error"], 1)
+
+    def test_stale_entries_are_served_while_one_refresh_runs(self):
+        self.upstream.replies.append((200, {"items": [volume("old")]}, 0))
+        self.api.search_books("dune")
+        self.expire("dune")
+        self.upstream.replies.append((200, {"items": [volume("new")]}, 0.3))
+
+        for _ in range(3):
+            books = self.api.search_books("dune")
+            self.assertEqual(books[0]["google_books_id"], "old")
+
+        deadline = time.monotonic() + 5
+        while self.api.search_books("dune")[0]["google_books_id"] != "new":
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(len(self.upstream.requests), 2)
+        self.assertEqual(search_cache_stats.snapshot()["refresh"], 1)
+
+    def test_failed_refresh_keeps_the_stale_results(self):
+        self.upstream.replies.append((200, {"items": [volume("old")]}, 0))
+        self.api.search_books("dune")
+        self.expire("dune")
+        self.upstream.replies.append((500, {}, 0))
+
+        self.assertEqual(self.api.refresh_search("dune")[0]["google_books_id"], "old")
+        entry = cache.get(search_cache_key("dune"))
+        self.assertEqual(entry["books"][0]["google_books_id"], "old")
+        # Fresh again for the error TTL, so upstream isn't asked on every read.
+        self.assertGreater(entry["fresh_until"], time.time())
+        self.assertEqual(self.api.search_books("dune")[0]["google_books_id"], "old")
+        self.assertEqual(len(self.upstream.requests), 2)
+
+
+class AsyncSearchTests(APITestCase):
+    DELAY = 0.2
+
+    def setUp(self):
+        cache.clear()
+        self.upstream = FakeGoogleBooks()
+        self.addCleanup(self.upstream.close)
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.token = Token.objects.get(user=self.user).key
+
+    def slow_replies(self, count):
+        self.upstream.replies += [
+            (200, {"items": [volume(f"v{index}")]}, self.DELAY) for index in range(count)
+        ]
+
+    def test_sync_client_waits_for_each_search_in_turn(self):
+        self.slow_replies(5)
+        api = GoogleBooksAPI(self.upstream.url, UpstreamClient(retries=0))
+        started = time.monotonic()
+        for index in range(5):
+            api.search_books(f"query {index}")
+        self.assertGreaterEqual(time.monotonic() - started, 5 * self.DELAY)
+
+    async def test_async_client_overlaps_upstream_searches(self):
+        self.slow_replies(5)
+        api = AsyncGoogleBooksAPI(self.upstream.url, AsyncUpstreamClient(retries=0))
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(api.search_books(f"query {index}") for index in range(5))
+        )
+        self.assertLess(time.monotonic() - started, 2.5 * self.DELAY)
+        self.assertEqual(
+            sorted(books[0]["google_books_id"] for books in results),
+            [f"v{index}" for index in range(5)],
+        )
+
+    def test_one_pool_serves_every_event_loop(self):
+        self.upstream.replies += [(200, {"items": [volume("dune")]}, 0)] * 2
+        client = AsyncUpstreamClient(retries=0)
+        api = AsyncGoogleBooksAPI(self.upstream.url, client)
+        # Each asyncio.run is a fresh loop, as for async views under WSGI.
+        sessions = []
+        for query in ("dune", "messiah"):
+            asyncio.run(api.search_books(query))
+            sessions.append(client.session)
+        self.assertEqual(len(self.upstream.requests), 2)
+        self.assertIs(sessions[0], sessions[1])
+        session = sessions[0]
+
+        client.close()
+        self.assertTrue(session.is_closed)
+        self.assertIsNone(client._loop)
+
+    async def test_search_view_serves_concurrent_requests(self):
+        self.slow_replies(5)
+        api = AsyncGoogleBooksAPI(self.upstream.url, AsyncUpstreamClient(retries=0))
+        headers = {"Authorization": f"Token {self.token}"}
+        with mock.patch.object(book_service, "async_api", api):
+            started = time.monotonic()
+            responses = await asyncio.gather(
+                *(
+                    self.async_client.get(
+                        "/api/books/search/", {"q": f"query {index}"}, headers=headers
+                    )
+                    for index in range(5)
+                )
+            )
+        self.assertLess(time.monotonic() - started, 2.5 * self.DELAY)
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        self.assertEqual(len(responses[0].json()["results"]), 1)
+
+    async def test_search_view_requires_authentication(self):
+        response = await self.async_client.get("/api/books/search/", {"q": "dune"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+
+class LocalSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.dune = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.messiah = Book.objects.create(
+            title="Dune Messiah", authors=["Frank Herbert"], google_books_id="messiah"
+        )
+        self.quote = Quote.objects.create(
+            user=self.user,
+            book=self.dune,
+            text="Fear is the mind-killer.",
+            context="Litany against fear",
+        )
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(search.search_books("herb"), [self.dune, self.messiah])
+        self.messiah.title = "Children of Dune"
+        self.messiah.save()
+        self.assertEqual(search.search_books("children"), [self.messiah])
+        self.messiah.delete()
+        self.assertEqual(search.search_books("children"), [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(search.search_books('"dune*('), [self.dune, self.messiah])
+        self.assertEqual(search.search_books("()"), [])
+
+    @override_settings(LOCAL_SEARCH_MIN_RESULTS=2)
+    def test_enough_local_matches_skip_upstream(self):
+        with mock.patch.object(AsyncGoogleBooksAPI, "search_books") as upstream:
+            response = self.client.get("/api/books/search/?q=dune")
+        upstream.assert_not_called()
+        ids = [book["google_books_id"] for book in response.json()["results"]]
+        self.assertEqual(sorted(ids), ["dune", "messiah"])
+
+    @override_settings(LOCAL_SEARCH_MIN_RESULTS=5)
+    def test_few_local_matches_are_topped_up_from_upstream(self):
+        remote = [
+            {"google_books_id": "messiah", "title": "Dune Messiah"},
+            {"google_books_id": "children", "title": "Children of Dune"},
+        ]
+        with mock.patch.object(
+            AsyncGoogleBooksAPI, "search_books", return_value=remote
+        ):
+            response = self.client.get("/api/books/search/?q=messiah")
+        ids = [book["google_books_id"] for book in response.json()["results"]]
+        self.assertEqual(ids, ["messiah", "children"])
+
+    def test_quote_search_endpoint(self):
+        response = self.client.get("/api/quotes/search/?q=litany")
+        self.assertEqual(
+            [quote["id"] for quote in response.data["results"]], [self.quote.id]
+        )
+        self.assertEqual(self.client.get("/api/quotes/search/").status_code, 400)
+
+
+class QuoteTagWriteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        Tag.objects.create(name="existing")
+
+    def save(self, tags, instance=None):
+        serializer = QuoteSerializer(
+            instance, data={"text": "fear", "tags_list": tags}, partial=bool(instance)
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(user=self.user, book=self.book)
+
+    def create_query_count(self, tags):
+        with CaptureQueriesContext(connection) as queries:
+            self.save(tags)
+        return len(queries)
+
+    def test_create_takes_a_constant_number_of_queries(self):
+        few = self.create_query_count(["existing", "a"])
+        many = self.create_query_count(["existing"] + [f"tag{i}" for i in range(20)])
+        self.assertEqual(few, many)
+
+    def test_tags_are_normalized_and_deduplicated(self):
+        quote = self.save([" Existing", "New", "new "])
+        self.assertEqual(
+            sorted(quote.tags.values_list("name", flat=True)), ["existing", "new"]
+        )
+        self.assertEqual(Tag.objects.get(name="new").slug, "new")
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_update_applies_a_diff(self):
+        quote = self.save(["existing", "a", "b"])
+        Through = Quote.tags.through
+        kept = Through.objects.get(quote=quote, tag__name="a").pk
+
+        self.save(["a", "c"], instance=quote)
+        self.assertEqual(
+            sorted(quote.tags.values_list("name", flat=True)), ["a", "c"]
+        )
+        self.assertTrue(Through.objects.filter(pk=kept).exists())
+
+    def test_create_quote_endpoint_saves_tags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            "/api/quotes/create-quote/",
+            {"book": "dune", "text": "fear", "tags": ["Sci-Fi", "classics"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(tag["name"] for tag in response.data["tags"]), ["classics", "sci-fi"]
+        )
+
+
+class SingleFlightBookCreationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def fetch_book_details(self, google_books_id):
+        with self.calls_lock:
+            self.calls += 1
+        time.sleep(0.2)
+        return {"title": "Dune", "authors": ["Frank Herbert"], "genres": []}
+
+    def run_concurrently(self, target, count=8):
+        results, errors = [], []
+
+        def worker():
+            try:
+                results.append(target())
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_requests_fetch_and_insert_once(self):
+        service = BookService()
+        with mock.patch.object(
+            service.api, "fetch_book_details", side_effect=self.fetch_book_details
+        ):
+            books = self.run_concurrently(lambda: service.create_or_get_book("dune"))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(Book.objects.filter(google_books_id="dune").count(), 1)
+        self.assertEqual({book.pk for book in books}, {books[0].pk})
+
+    def test_separate_processes_coordinate_through_the_cache(self):
+        # Separate BookService instances sharing this process's cache stand
+        # in for processes sharing a cache server (CACHE_SHARED).
+        services = [BookService() for _ in range(4)]
+        patches = [
+            mock.patch.object(
+                service.api, "fetch_book_details", side_effect=self.fetch_book_details
+            )
+            for service in services
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        pending = list(services)
+        self.run_concurrently(
+            lambda: pending.pop().create_or_get_book("dune"), count=len(services)
+        )
+        self.assertEqual(self.calls, 1)
+
+    def test_integrity_error_falls_back_to_a_reread(self):
+        service = BookService()
+
+        def racing_fetch(google_books_id):
+            # Another writer inserts the book while we're talking to upstream.
+            self.winner = Book.objects.create(
+                title="Dune", authors=["Frank Herbert"], google_books_id=google_books_id
+            )
+            return self.fetch_book_details(google_books_id)
+
+        with mock.patch.object(service.api, "fetch_book_details", side_effect=racing_fetch):
+            self.assertEqual(service.create_or_get_book("dune"), self.winner)
+
+    def test_upstream_errors_are_not_cached_as_missing_books(self):
+        service = BookService()
+        with mock.patch.object(
+            service.api,
+            "fetch_book_details",
+            side_effect=[requests.ConnectionError("down"), self.fetch_book_details("")],
+        ):
+            with self.assertRaises(requests.ConnectionError):
+                service.create_or_get_book("dune")
+            self.assertEqual(service.create_or_get_book("dune").title, "Dune")
+
+    def test_missing_books_are_cached_for_the_lock_timeout(self):
+        service = BookService()
+        with mock.patch.object(
+            service.api, "fetch_book_details", return_value=None
+        ) as fetch:
+            self.assertIsNone(service.create_or_get_book("nope"))
+            self.assertIsNone(service.create_or_get_book("nope"))
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_fetch_book_details_tells_missing_books_from_errors(self):
+        upstream = FakeGoogleBooks()
+        self.addCleanup(upstream.close)
+        api = GoogleBooksAPI(upstream.url, UpstreamClient(retries=0))
+        upstream.replies += [(404, {}, 0), (500, {}, 0)]
+        self.assertIsNone(api.fetch_book_details("nope"))
+        with self.assertRaises(requests.HTTPError):
+            api.fetch_book_details("dune")
+
+    def test_single_flight_shares_errors(self):
+        flights = SingleFlight()
+
+        def boom():
+            time.sleep(0.1)
+            raise IntegrityError("boom")
+
+        errors = []
+
+        def worker():
+            try:
+                flights.do("key", boom)
+            except IntegrityError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+
+
+class RowSerializerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune",
+            authors=["Frank Herbert"],
+            google_books_id="dune",
+            genres=["Science Fiction"],
+        )
+        self.quote = Quote.objects.create(
+            user=self.user, book=self.book, text="Fear is the mind-killer."
+        )
+        tags = [Tag.objects.create(name=name) for name in ("fear", "litany")]
+        self.quote.tags.set(tags)
+        Quote.objects.create(user=self.user, book=self.book, text="untagged")
+        root = Comment.objects.create(quote=self.quote, user=self.user, content="root")
+        reply = Comment.objects.create(
+            quote=self.quote, user=self.user, parent=root, content="reply"
+        )
+        Comment.objects.create(
+            quote=self.quote, user=self.user, parent=reply, content="deep"
+        )
+
+    def test_quotes_match_model_serializer(self):
+        queryset = Quote.objects.order_by("-created_at", "-id")
+        expected = QuoteSerializer(
+            queryset.select_related("book").prefetch_related("tags"), many=True
+        ).data
+        self.assertEqual(serialize_quote_rows(quote_rows(queryset)), expected)
+
+    def test_books_match_model_serializer(self):
+        queryset = Book.objects.order_by("id")
+        self.assertEqual(
+            serialize_books(queryset), BookSerializer(queryset, many=True).data
+        )
+
+    def test_comment_thread_matches_model_serializer(self):
+        roots, reply_map = load_thread(self.quote.pk)
+        expected = CommentSerializer(
+            roots, many=True, context={"reply_map": reply_map}
+        ).data
+        self.assertEqual(
+            serialize_comment_thread(Comment.objects.filter(quote=self.quote)),
+            expected,
+        )
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = Book.objects.create(
+                title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+            )
+            self.quote = Quote.objects.create(
+                user=self.user, book=self.book, text="first"
+            )
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("Last-Modified"))
+        return first["ETag"]
+
+    def test_unchanged_resources_return_304_without_queries(self):
+        for url in ("/api/quotes/feed/", "/api/tags/", f"/api/books/{self.book.pk}/"):
+            etag = self.revalidate(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        feed = self.revalidate("/api/quotes/feed/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Reaction.objects.create(user=self.user, quote=self.quote, type="LIKE")
+        response = self.client.get("/api/quotes/feed/", HTTP_IF_NONE_MATCH=feed)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], feed)
+
+        tags = self.revalidate("/api/tags/")
+        book = self.revalidate(f"/api/books/{self.book.pk}/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="spice")
+            self.book.title = "Dune Messiah"
+            self.book.save()
+        response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH=tags)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            f"/api/books/{self.book.pk}/", HTTP_IF_NONE_MATCH=book
+        )
+        self.assertEqual(response.data["title"], "Dune Messiah")
+
+    def test_evicted_versions_never_match_old_etags(self):
+        etag = self.revalidate("/api/tags/")
+        cache.clear()
+        response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_without_a_shared_cache_responses_carry_no_validators(self):
+        response = self.client.get("/api/tags/")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(response.has_header("Last-Modified"))
+        response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 200)
+
+
+class SeedDataTests(APITestCase):
+    def test_seeded_rows_are_consistent(self):
+        call_command(
+            "seed_data", users=5, books=5, quotes=20, tags=5, stdout=StringIO()
+        )
+        self.assertEqual(Quote.objects.count(), 20)
+        for comment in Comment.objects.select_related("parent"):
+            prefix = comment.parent.path if comment.parent else ""
+            self.assertEqual(comment.path, f"{prefix}{comment.pk:010d}/")
+            self.assertEqual(comment.depth, comment.path.count("/") - 1)
+        for quote in Quote.objects.all():
+            counts = dict(
+                quote.reactions.values_list("type").annotate(n=Count("id")).order_by()
+            )
+            self.assertEqual(
+                quote.reaction_counts,
+                {kind: counts.get(kind, 0) for kind in Reaction.COUNTER_FIELDS},
+            )
+        self.assertTrue(search.search_quotes(Quote.objects.first().text.split()[0]))
+
+    @override_settings(CACHE_SHARED=True)
+    def test_seeding_refreshes_timelines_and_versions(self):
+        cache.clear()
+        feed = self.client.get("/api/quotes/feed/")
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "seed_data", users=3, books=2, quotes=5, tags=2, stdout=StringIO()
+            )
+        newest = Quote.objects.order_by("-created_at", "-id").first()
+        self.assertEqual(timeline.get_entries(timeline.HOME)[0][1], newest.pk)
+        response = self.client.get("/api/quotes/feed/", HTTP_IF_NONE_MATCH=feed["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+
+class BenchmarkGateTests(SimpleTestCase):
+    def test_latency_is_reported_apart_from_query_counts(self):
+        baseline = {"feed": {"queries": 3, "p95_ms": 1.0}}
+        compare = run_benchmarks.Command().compare
+        failures, slow = compare(
+            {"feed": {"queries": 3, "p95_ms": 50.0}}, baseline, 1.5, 2.0
+        )
+        self.assertEqual(failures, [])
+        self.assertIn("feed: p95 50.00 ms", slow[0])
+        failures, slow = compare(
+            {"feed": {"queries": 4, "p95_ms": 1.0}}, baseline, 1.5, 2.0
+        )
+        self.assertEqual(failures, ["feed: 4 queries, baseline 3"])
+        self.assertEqual(slow, [])
+
+
+class RequestMetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        Quote.objects.create(user=self.user, book=self.book, text="first")
+
+    @override_settings(CACHE_SHARED=True)
+    def test_server_timing_reports_queries_and_cache(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/quotes/feed/")
+        timing = response["Server-Timing"]
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        self.assertIn("serialize;dur=", timing)
+        # Cold timeline and user summary, then both warm.
+        self.assertIn('desc="0 hits, 2 misses"', timing)
+        response = self.client.get("/api/quotes/feed/", HTTP_IF_NONE_MATCH="nope")
+        self.assertIn('desc="2 hits, 0 misses"', response["Server-Timing"])
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.assertFalse(self.client.get("/api/quotes/feed/").has_header("Server-Timing"))
+        self.client.force_authenticate(self.user)
+        self.assertFalse(self.client.get("/api/quotes/feed/").has_header("Server-Timing"))
+        with override_settings(REQUEST_METRICS_SERVER_TIMING=True):
+            self.assertTrue(
+                self.client.get("/api/quotes/feed/").has_header("Server-Timing")
+            )
+
+    def test_metrics_are_aggregated_per_endpoint_for_admins(self):
+        self.client.get("/api/quotes/feed/")
+        self.client.get("/api/quotes/feed/")
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get("/api/metrics/").data["GET quote-feed"]
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(sum(stats["histogram_ms"].values()), 2)
+        self.assertGreater(stats["counts"]["db"], 0)
+
+
+KINDLE_CLIPPINGS = """\ufeffDune (Frank Herbert)
+- Your Highlight on page 8 | Location 120-121 | Added on Monday, 1 January 2024
+
+I must not fear. Fear is the mind-killer.
+==========
+Dune (Frank Herbert)
+- Your Bookmark on page 10 | Location 140 | Added on Monday, 1 January 2024
+
+
+==========
+The Left Hand of Darkness (Ursula K. Le Guin)
+- Your Highlight on page 3 | Location 40-41 | Added on Tuesday, 2 January 2024
+
+Truth is a matter of the imagination.
+==========
+Dune (Frank Herbert)
+- Your Note on page 8 | Location 121 | Added on Monday, 1 January 2024
+
+a note, not a highlight
+==========
+Dune (Frank Herbert)
+- Your Highlight on page 9 | Location 130 | Added on Monday, 1 January 2024
+
+The mystery of life isn't a problem to solve.
+==========
+"""
+
+
+class HighlightImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.dune = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.upstream = mock.patch.object(
+            GoogleBooksAPI,
+            "search_books",
+            return_value=[
+                {
+                    "google_books_id": "left-hand",
+                    "title": "The Left Hand of Darkness",
+                    "authors": ["Ursula K. Le Guin"],
+                    "genres": [],
+                    "thumbnail_url": None,
+                }
+            ],
+        )
+        self.upstream_search = self.upstream.start()
+        self.addCleanup(self.upstream.stop)
+
+    def upload(self, name, content, **data):
+        response = self.client.post(
+            "/api/quotes/import/",
+            {"file": SimpleUploadedFile(name, content.encode()), **data},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_kindle_clippings_parser_skips_bookmarks_and_notes(self):
+        lines = KINDLE_CLIPPINGS.splitlines()
+        highlights = list(imports.parse_kindle_clippings(lines))
+        self.assertEqual(
+            [(h.title, h.author) for h in highlights],
+            [
+                ("Dune", "Frank Herbert"),
+                ("The Left Hand of Darkness", "Ursula K. Le Guin"),
+                ("Dune", "Frank Herbert"),
+            ],
+        )
+
+    @override_settings(IMPORT_BATCH_SIZE=2)
+    def test_import_streams_progress_and_skips_duplicates(self):
+        events = self.upload("My Clippings.txt", KINDLE_CLIPPINGS)
+        self.assertEqual([event["read"] for event in events], [2, 3, 3])
+        self.assertEqual(
+            events[-1],
+            {
+                "read": 3,
+                "imported": 3,
+                "duplicates": 0,
+                "books_created": 1,
+                "done": True,
+            },
+        )
+        self.assertEqual(self.dune.quotes.count(), 2)
+        self.assertEqual(
+            Book.objects.get(google_books_id="left-hand").quotes.get().text,
+            "Truth is a matter of the imagination.",
+        )
+        # Known titles never go upstream, unknown ones once per book.
+        self.assertEqual(self.upstream_search.call_count, 1)
+        self.assertEqual(len(search.search_quotes("imagination")), 1)
+        feed = self.client.get("/api/quotes/feed/").data["quotes"]
+        self.assertEqual(len(feed), 3)
+
+        events = self.upload("My Clippings.txt", KINDLE_CLIPPINGS)
+        self.assertEqual(events[-1]["imported"], 0)
+        self.assertEqual(events[-1]["duplicates"], 3)
+        self.assertEqual(Quote.objects.count(), 3)
+
+    def test_csv_import_attaches_tags(self):
+        content = (
+            "Highlight,Title,Author,Note,Tags\n"
+            '"Fear is the mind-killer.",Dune,Frank Herbert,ch. 1,"fear, Litany"\n'
+            '"Unknown words.",Some Obscure Pamphlet,,,\n'
+        )
+        self.upstream_search.return_value = []
+        events = self.upload("highlights.csv", content)
+        self.assertEqual(events[-1]["imported"], 2)
+        quote = self.dune.quotes.get()
+        self.assertEqual(quote.context, "ch. 1")
+        self.assertEqual(
+            sorted(quote.tags.values_list("name", flat=True)), ["fear", "litany"]
+        )
+        pamphlet = Quote.objects.get(text="Unknown words.").book
+        self.assertTrue(pamphlet.google_books_id.startswith("local:"))
+
+    def test_chunk_bumps_versions_once(self):
+        self.upstream_search.return_value = []
+        content = "Highlight,Title,Author\n" + "".join(
+            f"Line {index},Pamphlet {index},\n" for index in range(3)
+        )
+        with mock.patch.object(imports.versions, "bump") as bump:
+            events = self.upload("highlights.csv", content)
+        self.assertEqual(events[-1]["books_created"], 3)
+        bump.assert_called_once()
+        self.assertEqual(len(bump.call_args.args), 4)
+        self.assertIn(imports.versions.QUOTES, bump.call_args.args)
+
+    def test_upload_is_required(self):
+        response = self.client.post("/api/quotes/import/", {}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+
+
+class QuoteExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        other = User.objects.create_user("writer", password="pass12345")
+        self.client.force_authenticate(self.user)
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quotes = [
+            Quote.objects.create(user=self.user, book=book, text=f"quote, {index}")
+            for index in range(5)
+        ]
+        self.quotes[0].tags.add(Tag.objects.create(name="fear"))
+        Quote.objects.create(user=other, book=book, text="not mine")
+
+    def export(self, **params):
+        response = self.client.get("/api/quotes/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_ndjson_matches_the_api_representation(self):
+        response, body = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        expected = QuoteSerializer(
+            Quote.objects.filter(user=self.user).order_by("id"), many=True
+        ).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_chunks_use_a_constant_number_of_queries(self):
+        queryset = Quote.objects.filter(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(exports.quote_chunks(queryset))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        # Per chunk: one tag query; plus the row cursor and one user lookup.
+        self.assertLessEqual(len(queries), len(chunks) + 3)
+
+    def test_gzipped_csv(self):
+        response, body = self.export(output="csv", compress="gzip")
+        self.assertIn("quotes.csv.gz", response["Content-Disposition"])
+        rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode())))
+        self.assertEqual(rows[0], exports.CSV_COLUMNS)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][5], "quote, 0")
+        self.assertEqual(rows[1][7], "fear")
+
+    def test_unknown_output_is_rejected(self):
+        response = self.client.get("/api/quotes/export/", {"output": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TrendingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.other = User.objects.create_user("writer", password="pass12345")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quotes = [
+            Quote.objects.create(user=self.user, book=book, text=f"quote {index}")
+            for index in range(4)
+        ]
+
+    def score(self, quote):
+        quote.refresh_from_db()
+        return quote.trending_score
+
+    def test_scores_follow_reactions_and_comments(self):
+        quote = self.quotes[0]
+        reaction = Reaction.objects.create(user=self.user, quote=quote, type="LIKE")
+        Comment.objects.create(user=self.other, quote=quote, content="yes")
+        self.assertEqual(self.score(quote), 3.0)
+
+        reaction = Reaction.objects.get(pk=reaction.pk)
+        reaction.type = "LOVE"
+        reaction.save()
+        self.assertEqual(self.score(quote), 3.0)
+
+        reaction.delete()
+        self.assertEqual(self.score(quote), 2.0)
+
+    def test_removing_a_reaction_takes_off_its_weight_as_last_decayed(self):
+        now = timezone.now()
+        quote = self.quotes[0]
+        reaction = Reaction.objects.create(user=self.user, quote=quote, type="LIKE")
+        self.client.force_authenticate(self.user)
+        self.client.post(
+            f"/api/quotes/{self.quotes[1].pk}/toggle-reaction/",
+            {"reaction_type": "LIKE"},
+        )
+        Comment.objects.create(user=self.other, quote=self.quotes[1], content="yes")
+        Reaction.objects.update(created_at=now - timedelta(hours=48))
+        # No run since the likes: the stored scores still hold their full weight.
+        trending.record_decay(now - timedelta(hours=72))
+        Reaction.objects.get(pk=reaction.pk).delete()
+        self.assertEqual(self.score(quote), 0.0)
+
+        # A run a day after the like halves the whole score, like included.
+        call_command("decay_trending_scores", hours=24, stdout=StringIO())
+        trending.record_decay(now - timedelta(hours=24))
+        self.assertEqual(self.score(self.quotes[1]), 1.5)
+        self.client.post(
+            f"/api/quotes/{self.quotes[1].pk}/toggle-reaction/",
+            {"reaction_type": "LIKE"},
+        )
+        self.assertEqual(self.score(self.quotes[1]), 1.0)
+
+    def test_decay_halves_scores_and_drops_tiny_ones(self):
+        Quote.objects.filter(pk=self.quotes[0].pk).update(trending_score=8.0)
+        Quote.objects.filter(pk=self.quotes[1].pk).update(trending_score=0.015)
+
+        out = StringIO()
+        call_command("decay_trending_scores", hours=24, stdout=out)
+        self.assertEqual(self.score(self.quotes[0]), 4.0)
+        self.assertEqual(self.score(self.quotes[1]), 0.0)
+        self.assertIn("Decayed 1", out.getvalue())
+        self.assertIsNotNone(trending.last_decay())
+
+    def test_rebuild_weights_events_by_age(self):
+        Reaction.objects.create(user=self.user, quote=self.quotes[0], type="LIKE")
+        Comment.objects.create(user=self.user, quote=self.quotes[1], content="old")
+        Comment.objects.filter(quote=self.quotes[1]).update(
+            created_at=timezone.now() - timedelta(hours=24)
+        )
+        Quote.objects.update(trending_score=0.0)
+
+        self.assertEqual(trending.rebuild(), 2)
+        self.assertAlmostEqual(self.score(self.quotes[0]), 1.0, places=3)
+        self.assertAlmostEqual(self.score(self.quotes[1]), 1.0, places=3)
+
+    def test_endpoint_pages_by_score(self):
+        for score, quote in zip([5.0, 1.5, 1.5, 0.0], self.quotes):
+            Quote.objects.filter(pk=quote.pk).update(trending_score=score)
+
+        self.client.get("/api/quotes/trending/")
+        # Author summaries are warm: the page and its tags.
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/quotes/trending/", {"page_size": 2})
+        self.assertEqual(
+            [quote["id"] for quote in response.data["quotes"]],
+            [self.quotes[0].pk, self.quotes[2].pk],
+        )
+
+        response = self.client.get(
+            "/api/quotes/trending/", {"page_size": 2, "cursor": response.data["next"]}
+        )
+        self.assertEqual(
+            [quote["id"] for quote in response.data["quotes"]], [self.quotes[1].pk]
+        )
+        self.assertIsNone(response.data["next"])
+
+
+class TagPopularityTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+
+    def quote(self, *tags):
+        quote = Quote.objects.create(user=self.user, book=self.book, text="fear")
+        set_quote_tags(quote, tags, replace=False)
+        return quote
+
+    def counts(self):
+        return dict(Tag.objects.values_list("name", "quote_count"))
+
+    def test_counts_follow_tag_writes_and_deletes(self):
+        first = self.quote("scifi", "classics")
+        self.quote("scifi")
+        set_quote_tags(first, ["scifi"], replace=False)
+        self.assertEqual(self.counts(), {"scifi": 2, "classics": 1})
+
+        set_quote_tags(first, ["classics", "desert"])
+        self.assertEqual(self.counts(), {"scifi": 1, "classics": 1, "desert": 1})
+
+        first.delete()
+        self.assertEqual(self.counts(), {"scifi": 1, "classics": 0, "desert": 0})
+
+    def test_links_a_concurrent_writer_added_are_not_counted_twice(self):
+        quote = self.quote()
+        insert = tags.insert_quote_tags
+
+        def racing_insert(quote_id, tag_ids):
+            # Another request links the same tag between our read and insert.
+            insert(quote_id, tag_ids)
+            tags.adjust_quote_counts({tag_id: 1 for tag_id in tag_ids})
+            return insert(quote_id, tag_ids)
+
+        with mock.patch.object(tags, "insert_quote_tags", racing_insert):
+            set_quote_tags(quote, ["scifi"], replace=False)
+        self.assertEqual(self.counts(), {"scifi": 1})
+
+    def test_refresh_fixes_drift(self):
+        self.quote("scifi")
+        Tag.objects.update(quote_count=9)
+        self.assertEqual(refresh_quote_counts(), 1)
+        self.assertEqual(self.counts(), {"scifi": 1})
+
+    def test_list_ranks_by_usage_and_filters_by_prefix(self):
+        self.quote("scifi", "classics")
+        self.quote("scifi", "science")
+        self.quote("science")
+        response = self.client.get("/api/tags/")
+        self.assertEqual(
+            [(tag["name"], tag["quote_count"]) for tag in response.data],
+            [("science", 2), ("scifi", 2), ("classics", 1)],
+        )
+        response = self.client.get("/api/tags/", {"q": "Sc", "limit": "1"})
+        self.assertEqual([tag["name"] for tag in response.data], ["science"])
+
+    def test_created_tags_are_normalized(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post("/api/tags/", {"name": " Space Opera "})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["name"], "space opera")
+        response = self.client.get("/api/tags/", {"q": "Space"})
+        self.assertEqual([tag["name"] for tag in response.data], ["space opera"])
+        response = self.client.post("/api/tags/", {"name": "SPACE OPERA"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tag_quotes_are_newest_first_and_paginated(self):
+        quotes = [self.quote("scifi") for _ in range(3)]
+        self.quote("classics")
+
+        self.client.get("/api/tags/scifi/quotes/")
+        # Author summaries are warm: tag, page of links, quotes and their tags.
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/tags/scifi/quotes/", {"page_size": 2})
+        self.assertEqual(
+            [quote["id"] for quote in response.data["quotes"]],
+            [quotes[2].pk, quotes[1].pk],
+        )
+        response = self.client.get(
+            "/api/tags/scifi/quotes/", {"page_size": 2, "cursor": response.data["next"]}
+        )
+        self.assertEqual([quote["id"] for quote in response.data["quotes"]], [quotes[0].pk])
+        self.assertIsNone(response.data["next"])
+
+        response = self.client.get("/api/tags/missing/quotes/")
+        self.assertEqual(response.status_code, 404)
+
+
+class ReactionToggleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quote = Quote.objects.create(user=self.user, book=book, text="fear")
+        self.client.force_authenticate(self.user)
+
+    def toggle(self, reaction_type, quote_id=None):
+        return self.client.post(
+            f"/api/quotes/{quote_id or self.quote.pk}/toggle-reaction/",
+            {"reaction_type": reaction_type},
+            format="json",
+        )
+
+    def test_add_switch_and_remove_return_counts(self):
+        response = self.toggle("LIKE")
+        self.assertEqual(response.data["status"], "updated")
+        self.assertEqual(response.data["reaction"], "LIKE")
+        self.assertEqual(
+            response.data["reaction_counts"],
+            {"LIKE": 1, "LOVE": 0, "THINK": 0, "INSPIRE": 0},
+        )
+
+        response = self.toggle("LOVE")
+        self.assertEqual(response.data["reaction"], "LOVE")
+        self.assertEqual(
+            response.data["reaction_counts"],
+            {"LIKE": 0, "LOVE": 1, "THINK": 0, "INSPIRE": 0},
+        )
+
+        response = self.toggle("LOVE")
+        self.assertEqual(response.data["status"], "removed")
+        self.assertIsNone(response.data["reaction"])
+        self.assertEqual(response.data["reaction_counts"]["LOVE"], 0)
+        self.assertFalse(Reaction.objects.exists())
+
+        self.quote.refresh_from_db()
+        self.assertAlmostEqual(self.quote.trending_score, 0.0)
+
+    def test_toggle_is_a_read_and_two_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.toggle("LIKE")
+        statements = [
+            query["sql"].split()[0]
+            for query in queries.captured_queries
+            if not query["sql"].startswith(("SAVEPOINT", "RELEASE"))
+        ]
+        # Session/token auth aside: the reaction read, its write and the
+        # counter UPDATE ... RETURNING.
+        self.assertEqual(statements[-3:], ["SELECT", "INSERT", "UPDATE"])
+
+    def test_unknown_quote_and_type(self):
+        self.assertEqual(self.toggle("LIKE", quote_id=999).status_code, 404)
+        self.assertFalse(Reaction.objects.exists())
+        self.assertEqual(self.toggle("like").status_code, 400)
+
+
+class ReactionToggleConcurrencyTests(TransactionTestCase):
+    def test_concurrent_toggles_keep_counts_exact(self):
+        users = [User.objects.create_user(f"reader-{index}") for index in range(6)]
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        quote = Quote.objects.create(user=users[0], book=book, text="fear")
+        types = list(Reaction.COUNTER_FIELDS)
+        errors = []
+
+        def worker(index):
+            try:
+                for step in range(20):
+                    # Two threads per user, so toggles also race on one row.
+                    user = users[index % len(users)]
+                    reactions.toggle(user.pk, quote.pk, types[(index + step) % 2])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(index,)) for index in range(12)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        quote.refresh_from_db()
+        actual = dict(
+            Reaction.objects.filter(quote=quote)
+            .values_list("type")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        self.assertEqual(
+            quote.reaction_counts, {kind: actual.get(kind, 0) for kind in types}
+        )
+        self.assertEqual(quote.trending_score, float(sum(actual.values())))
+
+
+@override_settings(REACTION_WRITE_BEHIND=True)
+class ReactionBufferTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        self.quote = Quote.objects.create(user=self.user, book=book, text="fear")
+        # No flush thread: the tests flush by hand.
+        self.buffer = ReactionBuffer(interval=0)
+        patcher = mock.patch("books.views.reaction_buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(self.user)
+
+    def toggle(self, reaction_type):
+        return self.client.post(
+            f"/api/quotes/{self.quote.pk}/toggle-reaction/",
+            {"reaction_type": reaction_type},
+            format="json",
+        )
+
+    def test_toggles_are_buffered_with_read_your_writes(self):
+        response = self.toggle("LIKE")
+        self.assertEqual(response.data["reaction"], "LIKE")
+        self.assertEqual(response.data["reaction_counts"]["LIKE"], 1)
+        self.assertFalse(Reaction.objects.exists())
+
+        response = self.toggle("LIKE")
+        self.assertEqual(response.data["status"], "removed")
+        self.assertEqual(response.data["reaction_counts"]["LIKE"], 0)
+        response = self.toggle("LOVE")
+        self.assertEqual(response.data["reaction_counts"]["LOVE"], 1)
+        self.assertEqual(len(self.buffer), 1)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(
+            list(Reaction.objects.values_list("user_id", "type")),
+            [(self.user.pk, "LOVE")],
+        )
+        self.quote.refresh_from_db()
+        self.assertEqual(
+            self.quote.reaction_counts, {"LIKE": 0, "LOVE": 1, "THINK": 0, "INSPIRE": 0}
+        )
+        self.assertEqual(self.quote.trending_score, 1.0)
+
+    def test_bulk_removal_takes_off_the_decayed_weight(self):
+        Reaction.objects.create(user=self.user, quote=self.quote, type="LIKE")
+        Reaction.objects.update(created_at=timezone.now() - timedelta(hours=48))
+        # The last run, a day after the like, halved it.
+        trending.record_decay(timezone.now() - timedelta(hours=24))
+        Quote.objects.filter(pk=self.quote.pk).update(trending_score=2.5)
+
+        reactions.apply_reactions({(self.user.pk, self.quote.pk): None})
+        self.quote.refresh_from_db()
+        self.assertAlmostEqual(self.quote.trending_score, 2.0)
+
+    def test_flush_cost_does_not_grow_with_reactions(self):
+        users = User.objects.bulk_create(
+            [User(username=f"fan-{index}") for index in range(40)]
+        )
+        for user in users:
+            self.buffer.react(user.pk, self.quote.pk, "LIKE")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 40)
+        self.assertLessEqual(len(queries), 8)
+        self.quote.refresh_from_db()
+        self.assertEqual(self.quote.like_count, 40)
+
+    def test_flush_applies_the_difference_to_what_is_stored(self):
+        self.buffer.toggle(self.user.pk, self.quote.pk, "THINK")
+        # Written directly meanwhile, e.g. by another process.
+        Reaction.objects.create(user=self.user, quote=self.quote, type="LIKE")
+        self.buffer.flush()
+        self.quote.refresh_from_db()
+        self.assertEqual(
+            self.quote.reaction_counts, {"LIKE": 0, "LOVE": 0, "THINK": 1, "INSPIRE": 0}
+        )
+
+    def test_failed_flush_keeps_the_reactions(self):
+        self.buffer.toggle(self.user.pk, self.quote.pk, "LIKE")
+        with mock.patch(
+            "books.reactions.apply_reactions", side_effect=IntegrityError("boom")
+        ):
+            with self.assertRaises(IntegrityError):
+                self.buffer.flush()
+        response = self.toggle("LOVE")
+        self.assertEqual(response.data["reaction_counts"]["LIKE"], 0)
+        self.buffer.flush()
+        self.assertEqual(
+            list(Reaction.objects.values_list("type", flat=True)), ["LOVE"]
+        )
+
+    def test_unknown_quote_is_not_buffered(self):
+        response = self.client.post(
+            "/api/quotes/999/toggle-reaction/", {"reaction_type": "LIKE"}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.buffer), 0)
+
+
+class ReactionBufferThreadTests(TransactionTestCase):
+    def test_flushes_within_the_interval_and_drains_on_stop(self):
+        user = User.objects.create_user("reader")
+        book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        quote = Quote.objects.create(user=user, book=book, text="fear")
+        buffer = ReactionBuffer(interval=0.05)
+        self.addCleanup(buffer.stop)
+
+        buffer.react(user.pk, quote.pk, "LIKE")
+        deadline = time.monotonic() + 5
+        while (len(buffer) or buffer._flushing) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(Reaction.objects.get().type, "LIKE")
+
+        buffer._interval = 60
+        buffer.react(user.pk, quote.pk, "LOVE")
+        buffer.stop()
+        self.assertEqual(Reaction.objects.get().type, "LOVE")
+
+
+@override_settings(DATABASE_REPLICA="replica", CACHE_SHARED=True)
+class ReplicaRoutingTests(APITransactionTestCase):
+    # Resolved in setUpClass, once the replica alias below exists.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # The alias only exists with DATABASE_REPLICA_NAME set, so these
+        # tests bring a replica file of their own.
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(cls.replica_dir.name, "replica.sqlite3"),
+        }
+        connections.settings["replica"] = connections.configure_settings(
+            {**connections.settings, "replica": replica}
+        )["replica"]
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.book = Book.objects.create(
+            title="Dune", authors=["Frank Herbert"], google_books_id="dune"
+        )
+        sync_replica()
+
+    def authorized(self):
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        return client
+
+    def book_titles(self, client):
+        return [book["title"] for book in client.get("/api/books/").json()]
+
+    def test_safe_reads_go_to_the_replica(self):
+        Book.objects.create(title="Emma", authors=["Jane Austen"], google_books_id="emma")
+        self.assertEqual(self.book_titles(self.client), ["Dune"])
+        sync_replica()
+        self.assertEqual(sorted(self.book_titles(self.client)), ["Dune", "Emma"])
+
+    def test_writer_reads_from_the_primary_for_a_while(self):
+        client = self.authorized()
+        response = client.post(
+            "/api/books/",
+            {"title": "Emma", "authors": ["Jane Austen"], "google_books_id": "emma"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        # The writer sees their book; everyone else reads the stale replica.
+        self.assertEqual(sorted(self.book_titles(client)), ["Dune", "Emma"])
+        self.assertEqual(self.book_titles(self.client), ["Dune"])
+
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            cache.clear()
+            self.assertEqual(self.book_titles(client), ["Dune"])
+
+    def test_signing_in_pins_the_issued_session_and_token(self):
+        response = self.client.post(
+            "/login", {"username": "reader", "password": "pass12345"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        Book.objects.create(title="Emma", authors=["Jane Austen"], google_books_id="emma")
+        # The session cookie the login set, and the token it returned.
+        self.assertEqual(sorted(self.book_titles(self.client)), ["Dune", "Emma"])
+        self.assertEqual(sorted(self.book_titles(self.authorized())), ["Dune", "Emma"])
+        self.assertEqual(self.book_titles(self.client_class()), ["Dune"])
+
+    def test_only_unsafe_requests_that_wrote_pin_the_client(self):
+        def writing_view(request):
+            Book.objects.create(
+                title=request.method, authors=[], google_books_id=request.method
+            )
+            return HttpResponse()
+
+        credentials = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        request = RequestFactory().get("/api/books/", **credentials)
+        ReplicaRoutingMiddleware(writing_view)(request)
+        self.assertIsNone(cache.get(pin_key(request)))
+
+        request = RequestFactory().post("/api/books/", **credentials)
+        ReplicaRoutingMiddleware(writing_view)(request)
+        self.assertTrue(cache.get(pin_key(request)))
+
+    def test_other_views_and_writes_use_the_primary(self):
+        Quote.objects.create(user=self.user, book=self.book, text="fear")
+        client = self.authorized()
+        response = client.get("/api/quotes/export/")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 1)
+        response = client.post(
+            f"/api/quotes/{Quote.objects.get().pk}/toggle-reaction/",
+            {"reaction_type": "LIKE"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Reaction.objects.using("replica").exists())
+
+    def test_revoked_tokens_are_not_cached_from_the_replica(self):
+        client = self.authorized()
+        Token.objects.filter(pk=self.token.pk).delete()
+        self.assertTrue(Token.objects.using("replica").exists())
+        self.assertEqual(client.get("/api/books/").status_code, 401)
+
+    def test_without_a_shared_cache_reads_use_the_primary(self):
+        Book.objects.create(title="Emma", authors=["Jane Austen"], google_books_id="emma")
+        with override_settings(CACHE_SHARED=False):
+            self.assertEqual(sorted(self.book_titles(self.client)), ["Dune", "Emma"])
+
+    def test_cached_reads_come_from_the_primary(self):
+        Quote.objects.create(user=self.user, book=self.book, text="fear")
+        sync_replica()
+        User.objects.filter(pk=self.user.pk).update(username="renamed")
+        newer = Quote.objects.create(user=self.user, book=self.book, text="hope")
+
+        response = self.authorized().get("/api/quotes/feed/")
+        # The page itself is read from the (stale) replica...
+        self.assertEqual([quote["text"] for quote in response.json()["quotes"]], ["fear"])
+        # ...but what gets cached for later requests is not.
+        self.assertEqual(response.json()["quotes"][0]["user"]["username"], "renamed")
+        self.assertEqual(timeline.get_entries(timeline.HOME)[0][1], newer.pk)
+
+
+class BookEnrichmentTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.details = {
+            "google_books_id": "dune",
+            "title": "Dune",
+            "authors": ["Frank Herbert"],
+            "genres": ["Fiction"],
+            "cover_image": "https://covers.example/dune.jpg",
+        }
+
+    def create_quote(self, **extra):
+        return self.client.post(
+            "/api/quotes/create-quote/",
+            {"book": "dune", "text": "Fear is the mind-killer.", **extra},
+            format="json",
+        )
+
+    def test_new_book_is_stored_as_a_placeholder_without_upstream(self):
+        result = {
+            "google_books_id": "dune",
+            "title": "Dune",
+            "authors": ["Frank Herbert"],
+            "genres": [],
+            "thumbnail_url": None,
+        }
+        with mock.patch.object(
+            book_service.api, "fetch_search_results", return_value=[result]
+        ):
+            book_service.api.search_books("dune")
+
+        with mock.patch.object(
+            book_service.api, "fetch_book_details"
+        ) as fetch, mock.patch.object(
+            book_service.enricher, "enqueue"
+        ) as enqueue, self.captureOnCommitCallbacks(execute=True):
+            response = self.create_quote()
+
+        self.assertEqual(response.status_code, 201)
+        fetch.assert_not_called()
+        enqueue.assert_called_once_with("dune")
+        book = Book.objects.get(google_books_id="dune")
+        self.assertTrue(book.is_placeholder)
+        self.assertEqual(book.authors, ["Frank Herbert"])
+
+    def test_book_data_from_clients_is_not_trusted(self):
+        forged = {"title": "Forged", "thumbnail_url": "https://evil.example/x.jpg"}
+        with mock.patch.object(
+            book_service.api, "fetch_book_details", return_value=None
+        ):
+            response = self.create_quote(book="made-up", book_details=forged)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Book.objects.exists())
+
+        with mock.patch.object(
+            book_service.api, "fetch_book_details", return_value=self.details
+        ):
+            self.assertEqual(self.create_quote(book_details=forged).status_code, 201)
+        book = Book.objects.get(google_books_id="dune")
+        self.assertEqual(book.title, "Dune")
+        self.assertFalse(book.is_placeholder)
+
+    def test_without_details_the_book_is_fetched_inline(self):
+        with mock.patch.object(
+            book_service.api, "fetch_book_details", return_value=self.details
+        ), mock.patch.object(book_service.enricher, "enqueue") as enqueue:
+            self.assertEqual(self.create_quote().status_code, 201)
+        enqueue.assert_not_called()
+        self.assertFalse(Book.objects.get(google_books_id="dune").is_placeholder)
+
+    def test_upstream_outage_is_reported_as_unavailable(self):
+        with mock.patch.object(
+            book_service.api,
+            "fetch_book_details",
+            side_effect=requests.ConnectionError("down"),
+        ):
+            response = self.create_quote()
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Book.objects.exists())
+
+    def test_enrich_fills_in_the_placeholder_after_retries(self):
+        enrichment.create_placeholder(
+            "dune", {"title": "Dune", "thumbnail_url": "https://covers.example/s.jpg"}
+        )
+        fetch = mock.Mock(
+            side_effect=[requests.Timeout("slow"), ConnectionError("down"), self.details]
+        )
+        enricher = enrichment.BookEnricher(fetch, attempts=3, retry_delay=0)
+
+        with self.assertLogs("books.enrichment", "WARNING"):
+            self.assertTrue(enricher.enrich("dune"))
+        self.assertEqual(fetch.call_count, 3)
+        book = Book.objects.get(google_books_id="dune")
+        self.assertFalse(book.is_placeholder)
+        self.assertEqual(book.genres, ["Fiction"])
+        self.assertEqual(book.cover_image, "https://covers.example/dune.jpg")
+        # Nothing left to do the second time round.
+        self.assertFalse(enricher.enrich("dune"))
+        self.assertEqual(fetch.call_count, 3)
+
+    def test_enrich_gives_up_and_keeps_the_placeholder(self):
+        enrichment.create_placeholder("dune", {"title": "Dune"})
+        fetch = mock.Mock(side_effect=requests.ConnectionError("down"))
+        enricher = enrichment.BookEnricher(fetch, attempts=2, retry_delay=0)
+        with self.assertLogs("books.enrichment", "WARNING") as logs:
+            self.assertFalse(enricher.enrich("dune"))
+        self.assertIn("Giving up", logs.output[-1])
+        self.assertEqual(fetch.call_count, 2)
+        self.assertTrue(Book.objects.get(google_books_id="dune").is_placeholder)
+
+        out = StringIO()
+        with mock.patch.object(
+            book_service.api, "fetch_book_details", return_value=self.details
+        ):
+            call_command("enrich_books", stdout=out)
+        self.assertIn("Enriched 1 of 1", out.getvalue())
+        self.assertFalse(Book.objects.get(google_books_id="dune").is_placeholder)
+
+    def test_missing_book_is_settled_instead_of_retried(self):
+        enrichment.create_placeholder("dune", {"title": "Dune"})
+        fetch = mock.Mock(return_value=None)
+        enricher = enrichment.BookEnricher(fetch, attempts=3, retry_delay=0)
+        with self.assertLogs("books.enrichment", "WARNING"):
+            self.assertFalse(enricher.enrich("dune"))
+        self.assertEqual(fetch.call_count, 1)
+        book = Book.objects.get(google_books_id="dune")
+        self.assertFalse(book.is_placeholder)
+        self.assertEqual(book.title, "Dune")
+
+        out = StringIO()
+        call_command("enrich_books", stdout=out)
+        self.assertIn("Enriched 0 of 0", out.getvalue())
+
+    def test_details_are_applied_once(self):
+        enrichment.create_placeholder("dune", {"title": "Dune"})
+        self.assertTrue(enrichment.apply_details("dune", self.details))
+        self.assertFalse(enrichment.apply_details("dune", {"title": "Other"}))
+        self.assertEqual(Book.objects.get(google_books_id="dune").title, "Dune")
+
+    def test_enrichment_is_deduplicated_across_processes(self):
+        enrichment.create_placeholder("dune", {"title": "Dune"})
+        cache.add("book_enrich_lock:dune", 1)
+        fetch = mock.Mock(return_value=self.details)
+        self.assertFalse(enrichment.BookEnricher(fetch).enrich("dune"))
+        fetch.assert_not_called()
+
+
+class BookEnrichmentThreadTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_enqueue_runs_once_per_book_in_the_background(self):
+        enrichment.create_placeholder("dune", {"title": "Dune"})
+        started, release = threading.Event(), threading.Event()
+
+        def fetch(google_books_id):
+            started.set()
+            release.wait(5)
+            return {"title": "Dune", "authors": ["Frank Herbert"]}
+
+        enricher = enrichment.BookEnricher(fetch, workers=2)
+        future = enricher.enqueue("dune")
+        started.wait(5)
+        self.assertIsNone(enricher.enqueue("dune"))
+        release.set()
+
+        self.assertTrue(future.result(timeout=5))
+        self.assertEqual(
+            Book.objects.get(google_books_id="dune").authors, ["Frank Herbert"]
+        )
@@ -0,0 +1,30 @@
+"""Load whole comment threads in one query and assemble them in Python."""
+from collections import defaultdict
+
+from .models import Comment
+
+
+def load_thread(quote_id, max_depth=None, root=None):
+    """
+    Return `(roots, reply_map)` for a quote's comments, where `reply_map`
+    maps a comment id to its direct replies. Pass `root` to load only the
+    subtree under one comment, and `max_depth` to stop at a nesting level
+    (top-level comments are depth 0).
+    """
+    comments = Comment.objects.filter(quote_id=quote_id)
+    if root is not None:
+        comments = comments.filter(path__startswith=root.path)
+    if max_depth is not None:
+        comments = comments.filter(depth__lte=max_depth)
+
+    roots = []
+    reply_map = defaultdict(list)
+    # Rows arrive in Comment.Meta.ordering, so sibling lists keep that order.
+    for comment in comments:
+        if root is not None and comment.pk == root.pk:
+            roots.append(comment)
+        elif root is None and comment.parent_id is None:
+            roots.append(comment)
+        else:
+            reply_map[comment.parent_id].append(comment)
+    return roots, reply_map
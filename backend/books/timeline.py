@@ -0,0 +1,186 @@
+"""
+Precomputed, cache-backed quote timelines.
+
+Each timeline is a newest-first list of `(created_at, quote_id)` pairs kept
+in the cache. New quotes are fanned out to the timelines they belong to when
+they are saved, so serving a feed page is a slice of that list plus a
+primary-key lookup instead of re-sorting the `Quote` table on every request.
+
+There is no follow graph yet, so a quote is fanned out to the shared home
+timeline and to its author's own timeline.
+
+Timelines need a cache every worker process shares (`CACHE_SHARED`): with a
+per-process cache each worker would serve its own copy, missing the quotes
+fanned out by the others, so feeds are read from the database instead.
+Every change to a timeline, rebuilds included, holds a short per-timeline
+lock in the cache, so concurrent fan-outs never drop each other's quotes. A
+writer that can't get the lock in time marks the timeline stale instead and
+the next read rebuilds it.
+"""
+import time
+from bisect import bisect_right, insort
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from backend import metrics
+from .models import Quote
+
+HOME = "home"
+
+MAX_LENGTH = getattr(settings, "TIMELINE_MAX_LENGTH", 500)
+CACHE_TIMEOUT = getattr(settings, "TIMELINE_CACHE_TIMEOUT", 60 * 10)
+# How long a crashed lock holder can block a timeline, and how long a writer
+# waits for the lock before marking the timeline stale, in seconds
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 1.0
+
+
+def user_timeline(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def _cache_key(name: str) -> str:
+    return f"timeline:{name}"
+
+
+def _lock_key(name: str) -> str:
+    return f"timeline_lock:{name}"
+
+
+def _stale_key(name: str) -> str:
+    return f"timeline_stale:{name}"
+
+
+def enabled() -> bool:
+    return settings.CACHE_SHARED
+
+
+@contextmanager
+def _locked(name: str):
+    """Hold the timeline's lock; yields False if it couldn't be had in time."""
+    key = _lock_key(name)
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(0.005)
+    try:
+        yield True
+    finally:
+        cache.delete(key)
+
+
+def _queryset(name: str):
+    quotes = Quote.objects.all()
+    if name.startswith("user:"):
+        quotes = quotes.filter(user_id=name.split(":", 1)[1])
+    return quotes
+
+
+def _sort_key(entry):
+    created_at, quote_id = entry
+    return (-created_at.timestamp(), -quote_id)
+
+
+def targets(quote: Quote):
+    """Timelines a quote is fanned out to."""
+    return [HOME, user_timeline(quote.user_id)]
+
+
+def _load(name: str, using=None):
+    return list(
+        _queryset(name)
+        .using(using)
+        .order_by("-created_at", "-id")
+        .values_list("created_at", "id")[:MAX_LENGTH]
+    )
+
+
+def rebuild(name: str):
+    """Reload a timeline from the database, keeping the newest entries."""
+    if not enabled():
+        return _load(name)
+    with _locked(name) as locked:
+        if not locked:
+            return _load(name)
+        # Cleared before reading, so a writer that gives up on the lock
+        # while we read still leaves the result marked stale.
+        cache.delete(_stale_key(name))
+        # From the primary: a lagging replica would be cached past its lag.
+        entries = _load(name, using=DEFAULT_DB_ALIAS)
+        cache.set(_cache_key(name), entries, CACHE_TIMEOUT)
+    return entries
+
+
+def get_entries(name: str):
+    stored = cache.get_many([_cache_key(name), _stale_key(name)])
+    entries = None if _stale_key(name) in stored else stored.get(_cache_key(name))
+    metrics.record_cache(hits=entries is not None, misses=entries is None)
+    if entries is None:
+        entries = rebuild(name)
+    return entries
+
+
+def _update(name: str, change):
+    """Apply `change(entries) -> entries` to a warm timeline under its lock."""
+    if not enabled():
+        return
+    with _locked(name) as locked:
+        if not locked:
+            cache.set(_stale_key(name), 1, CACHE_TIMEOUT)
+            return
+        entries = cache.get(_cache_key(name))
+        if entries is None:
+            # A cold timeline is rebuilt from the database on its next read.
+            return
+        cache.set(_cache_key(name), change(entries)[:MAX_LENGTH], CACHE_TIMEOUT)
+
+
+def push(name: str, created_at, quote_id: int):
+    entry = (created_at, quote_id)
+
+    def add(entries):
+        if entry not in entries:
+            insort(entries, entry, key=_sort_key)
+        return entries
+
+    _update(name, add)
+
+
+def remove(name: str, quote_id: int):
+    _update(name, lambda entries: [entry for entry in entries if entry[1] != quote_id])
+
+
+def fan_out(quote: Quote):
+    for name in targets(quote):
+        push(name, quote.created_at, quote.pk)
+
+
+def retract(quote: Quote):
+    for name in targets(quote):
+        remove(name, quote.pk)
+
+
+def read_page(name: str, after=None, limit: int = 20):
+    """
+    Return `(entries, has_next)` for the page following the `after`
+    position, as `(created_at, quote_id)` pairs, or `None` when the page reaches past the trimmed tail of the
+    timeline and has to be served from the database instead (always, without
+    a shared cache).
+    """
+    if not enabled():
+        return None
+    entries = get_entries(name)
+    truncated = len(entries) >= MAX_LENGTH
+    if after is not None:
+        start = bisect_right(entries, _sort_key(tuple(after)), key=_sort_key)
+        entries = entries[start:]
+
+    page = entries[: limit + 1]
+    if len(page) <= limit and truncated:
+        return None
+    return page[:limit], len(page) > limit
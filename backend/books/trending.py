@@ -0,0 +1,122 @@
+"""
+Incrementally maintained "trending" scores.
+
+Every reaction and comment adds its weight to `Quote.trending_score` with a
+single `F()` update, and `decay()` (run periodically by the
+`decay_trending_scores` command) multiplies every live score by
+`0.5 ** (elapsed / half_life)`. The stored score is therefore always the
+exponentially time-decayed sum of a quote's recent activity, and the
+trending list is a range scan over the `(-trending_score, -id)` index
+instead of an aggregate over the reactions and comments tables.
+
+Scores that decay below `TRENDING_MIN_SCORE` are reset to zero, so each
+decay run only touches quotes with recent activity.
+
+Between runs the stored score is not decayed at all, so removing a reaction
+takes off its weight decayed only up to the last run, which is recorded in
+`TrendingDecay`.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Subquery, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Comment, Quote, Reaction, TrendingDecay
+
+
+def reaction_weight() -> float:
+    return settings.TRENDING_REACTION_WEIGHT
+
+
+def comment_weight() -> float:
+    return settings.TRENDING_COMMENT_WEIGHT
+
+
+def score_change(amount: float):
+    """Expression adding `amount` to the score without going below zero."""
+    return Greatest(F("trending_score") + amount, Value(0.0))
+
+
+def add(quote_id: int, amount: float):
+    if amount:
+        Quote.objects.filter(pk=quote_id).update(trending_score=score_change(amount))
+
+
+def decay_factor(elapsed: timedelta) -> float:
+    half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+    return 0.5 ** (elapsed / half_life)
+
+
+def last_decay():
+    """When the stored scores were last decayed, or None if never."""
+    return TrendingDecay.objects.values_list("decayed_at", flat=True).first()
+
+
+def last_decay_subquery():
+    """`last_decay()` as an expression, to read it along with other rows."""
+    return Subquery(TrendingDecay.objects.values("decayed_at")[:1])
+
+
+def record_decay(decayed_at):
+    TrendingDecay.objects.update_or_create(pk=1, defaults={"decayed_at": decayed_at})
+
+
+def reaction_contribution(created_at, decayed_at) -> float:
+    """
+    What a reaction made at `created_at` still adds to its quote's score:
+    its weight, decayed by the runs since then, `decayed_at` being the last
+    one (see `last_decay()`). Removing a reaction takes this off.
+    """
+    if decayed_at is None or decayed_at <= created_at:
+        return reaction_weight()
+    return reaction_weight() * decay_factor(decayed_at - created_at)
+
+
+def decay(elapsed: timedelta) -> int:
+    """
+    Decay every live score by `elapsed` worth of half-lives. Returns the
+    number of quotes updated.
+    """
+    record_decay(timezone.now())
+    live = Quote.objects.filter(trending_score__gt=0)
+    factor = decay_factor(elapsed)
+    # Zeroing scores that would fall below the floor keeps the live set small.
+    live.filter(trending_score__lt=settings.TRENDING_MIN_SCORE / factor).update(
+        trending_score=0.0
+    )
+    return live.update(trending_score=F("trending_score") * factor)
+
+
+def rebuild(now=None) -> int:
+    """
+    Recompute every score from the reactions and comments of the last few
+    half-lives, each decayed by its own age. Returns the number of quotes
+    with a non-zero score.
+    """
+    now = now or timezone.now()
+    # Older events have decayed to well below any weight.
+    window = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS * 10)
+    scores = {}
+    for model, weight in ((Reaction, reaction_weight()), (Comment, comment_weight())):
+        rows = (
+            model.objects.filter(created_at__gte=now - window)
+            .values_list("quote_id", "created_at")
+            .iterator()
+        )
+        for quote_id, created_at in rows:
+            scores[quote_id] = scores.get(quote_id, 0.0) + weight * decay_factor(
+                now - created_at
+            )
+
+    Quote.objects.filter(trending_score__gt=0).update(trending_score=0.0)
+    live = [
+        Quote(pk=quote_id, trending_score=score)
+        for quote_id, score in scores.items()
+        if score >= settings.TRENDING_MIN_SCORE
+    ]
+    Quote.objects.bulk_update(live, ["trending_score"], batch_size=500)
+    # The new scores are decayed up to `now`, as if a run had just happened.
+    record_decay(now)
+    return len(live)
@@ -0,0 +1,297 @@
+"""
+Shared HTTP clients for upstream APIs.
+
+One pooled `requests.Session` per process, with connect/read timeouts,
+bounded retries with jittered exponential backoff and a circuit breaker, so
+a slow or failing upstream can't hold our workers hostage. The async views
+use `AsyncUpstreamClient`, the same policy on a pooled `httpx.AsyncClient`.
+"""
+import asyncio
+import atexit
+import random
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from backend import metrics
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without touching the network while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class UpstreamClient:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.3,
+        max_backoff: float = 2.0,
+        pool_size: int = 10,
+        breaker: CircuitBreaker = None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def sleep_before_retry(self, attempt: int):
+        # "Full jitter" backoff: uniform over [0, min(cap, base * 2^attempt)].
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt)))
+
+    def get(self, url: str, params=None) -> requests.Response:
+        """
+        GET with retries on connection errors, timeouts and 429/5xx replies.
+        Returns the last response received, or raises the last network error.
+        """
+        with metrics.timed("upstream"):
+            return self._get(url, params)
+
+    def _get(self, url: str, params=None) -> requests.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}")
+        # Whatever happens, the call resolves the breaker, so a half-open
+        # trial can't leave it stuck open.
+        try:
+            response = self._get_with_retries(url, params)
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code in self.RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _get_with_retries(self, url: str, params=None) -> requests.Response:
+        response, error = None, None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.sleep_before_retry(attempt - 1)
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                response, error = None, exc
+                continue
+            if response.status_code not in self.RETRY_STATUSES:
+                return response
+        if response is not None:
+            return response
+        raise error
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> UpstreamClient:
+    """The process-wide client, built from settings on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UpstreamClient(
+                    connect_timeout=settings.GOOGLE_BOOKS_CONNECT_TIMEOUT,
+                    read_timeout=settings.GOOGLE_BOOKS_READ_TIMEOUT,
+                    retries=settings.GOOGLE_BOOKS_RETRIES,
+                    pool_size=settings.GOOGLE_BOOKS_POOL_SIZE,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.GOOGLE_BOOKS_BREAKER_THRESHOLD,
+                        reset_timeout=settings.GOOGLE_BOOKS_BREAKER_RESET,
+                    ),
+                )
+    return _client
+
+
+class AsyncUpstreamClient:
+    """
+    `UpstreamClient` for async code: while one request waits on the
+    upstream, the event loop keeps serving others.
+
+    Pooled connections belong to the event loop that opened them, and under
+    WSGI every async view runs on a fresh loop. So the client does its I/O
+    on one long-lived loop of its own, on a daemon thread, with a single
+    `httpx.AsyncClient` there; callers on any loop await the result.
+    `close()` shuts the pool and the loop down.
+    """
+
+    RETRY_STATUSES = UpstreamClient.RETRY_STATUSES
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.3,
+        max_backoff: float = 2.0,
+        pool_size: int = 10,
+        breaker: CircuitBreaker = None,
+    ):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limits = httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def session(self) -> httpx.AsyncClient:
+        # Only used on `loop`, so there is only ever one.
+        if self._session is None:
+            self._session = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._session
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The client's own event loop, started on first use."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="upstream-io", daemon=True
+                ).start()
+            return self._loop
+
+    def close(self):
+        """Close the pooled connections and stop the client's loop."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.aclose(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    async def sleep_before_retry(self, attempt: int):
+        await asyncio.sleep(
+            random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        )
+
+    async def get(self, url: str, params=None) -> httpx.Response:
+        """
+        GET with retries on connection errors, timeouts and 429/5xx replies.
+        Returns the last response received, or raises the last network error.
+        """
+        with metrics.timed("upstream"):
+            future = asyncio.run_coroutine_threadsafe(self._get(url, params), self.loop)
+            return await asyncio.wrap_future(future)
+
+    async def _get(self, url: str, params=None) -> httpx.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}")
+        try:
+            response = await self._get_with_retries(url, params)
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code in self.RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _get_with_retries(self, url: str, params=None) -> httpx.Response:
+        response, error = None, None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await self.sleep_before_retry(attempt - 1)
+            try:
+                response = await self.session.get(url, params=params)
+            except httpx.TransportError as exc:
+                response, error = None, exc
+                continue
+            if response.status_code not in self.RETRY_STATUSES:
+                return response
+        if response is not None:
+            return response
+        raise error
+
+
+_async_client = None
+
+
+def get_async_client() -> AsyncUpstreamClient:
+    """The process-wide async client, built from settings on first use."""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncUpstreamClient(
+                    connect_timeout=settings.GOOGLE_BOOKS_CONNECT_TIMEOUT,
+                    read_timeout=settings.GOOGLE_BOOKS_READ_TIMEOUT,
+                    retries=settings.GOOGLE_BOOKS_RETRIES,
+                    pool_size=settings.GOOGLE_BOOKS_ASYNC_POOL_SIZE,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.GOOGLE_BOOKS_BREAKER_THRESHOLD,
+                        reset_timeout=settings.GOOGLE_BOOKS_BREAKER_RESET,
+                    ),
+                )
+                atexit.register(_async_client.close)
+    return _async_client
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import QuoteViewSet, BookViewSet, TagViewSet, ReactionViewSet, CommentViewSet, UserFavoriteViewSet
+from .views import book_search, search_books
 
 # Initialize the default router
 router = DefaultRouter()
@@ -14,5 +15,8 @@ router.register(r'favorites', UserFavoriteViewSet, basename='favorite')
 
 # Include the router URLs into the main URL patterns
 urlpatterns = [
+    # Async views; listed before the router so they win over books/<pk>/.
+    path('api/books/search/', book_search, name='book-search'),
+    path('api/search-books/', search_books, name='search-books'),
     path('api/', include(router.urls)),
 ]
@@ -1,56 +1,288 @@
+import asyncio
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import requests
 from typing import Dict, List, Optional
 from django.core.cache import cache
 from django.conf import settings
 
+from backend import metrics
+from .upstream import (
+    AsyncUpstreamClient,
+    CircuitOpenError,
+    UpstreamClient,
+    get_async_client,
+    get_client,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, unicode compatibility forms and whitespace runs."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def search_cache_key(normalized_query: str) -> str:
+    digest = hashlib.sha1(normalized_query.encode()).hexdigest()
+    return f"book_search:{digest}"
+
+
+def search_result_cache_key(google_books_id: str) -> str:
+    return f"book_search_result:{google_books_id}"
+
+
+def get_search_result(google_books_id: str) -> Optional[Dict]:
+    """
+    The book as a recent upstream search returned it, if one did. Unlike
+    book data sent by clients, this came from Google Books itself.
+    """
+    return cache.get(search_result_cache_key(google_books_id))
+
+
+def search_result_entries(books: List[Dict]) -> Dict[str, Dict]:
+    """Cache entries keeping each search result under its id."""
+    return {
+        search_result_cache_key(book["google_books_id"]): book
+        for book in books
+        if book.get("google_books_id")
+    }
+
+
+class CacheStats:
+    """Thread-safe in-process counters for monitoring cache behaviour."""
 
-class GoogleBooksAPI:
     def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+        if name in ("hit", "stale"):
+            metrics.record_cache(hits=1)
+        elif name == "miss":
+            metrics.record_cache(misses=1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+search_cache_stats = CacheStats()
+
+
+def search_cache_entry(books: Optional[List[Dict]], previous: dict = None):
+    """
+    Cache entry and timeout for upstream search results; `None` (a failed
+    lookup) and empty results are kept for a shorter time. A failed lookup
+    keeps the books of the `previous` entry, if there was one, so one
+    upstream error doesn't turn good results into none.
+    """
+    if books is None:
+        search_cache_stats.incr("error")
+        books = previous["books"] if previous else []
+        ttl = settings.BOOK_SEARCH_ERROR_TTL
+    elif not books:
+        ttl = settings.BOOK_SEARCH_EMPTY_TTL
+    else:
+        ttl = settings.BOOK_SEARCH_CACHE_TTL
+    entry = {"books": books, "fresh_until": time.time() + ttl}
+    return entry, ttl + settings.BOOK_SEARCH_STALE_TTL
+
+
+def parse_search_results(payload: dict) -> List[Dict]:
+    return [
+        {
+            "google_books_id": item.get("id"),
+            "title": item.get("volumeInfo", {}).get("title", ""),
+            "authors": item.get("volumeInfo", {}).get("authors", []),
+            "genres": item.get("volumeInfo", {}).get("categories", []),
+            "thumbnail_url": item.get("volumeInfo", {})
+            .get("imageLinks", {})
+            .get("thumbnail"),
+        }
+        for item in payload.get("items", [])
+    ]
+
+
+def parse_book_details(google_books_id: str, payload: dict) -> Dict:
+    data = payload.get("volumeInfo", {})
+    return {
+        "google_books_id": google_books_id,
+        "title": data.get("title", ""),
+        "authors": data.get("authors", []),
+        "genres": data.get("categories", []),
+        "cover_image": data.get("imageLinks", {}).get("thumbnail", ""),
+    }
+
+refresh_executor = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="book-search-refresh"
+)
+
+
+class GoogleBooksAPI:
+    def __init__(self, base_url: str = None, client: UpstreamClient = None):
         self.api_key = settings.GOOGLE_BOOKS_API_KEY
-        self.base_url = "https://www.googleapis.com/books/v1/volumes"
+        self.base_url = base_url or settings.GOOGLE_BOOKS_API_URL
+        self.client = client or get_client()
 
     def search_books(self, query: str) -> List[Dict]:
-        """Search for books using Google Books API and cache results."""
-        cache_key = f"book_search_{query}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-
-        response = requests.get(
-            self.base_url, params={"q": query, "key": self.api_key, "maxResults": 20}
-        )
+        """
+        Search for books using Google Books API, serving from the cache.
+
+        Entries past their freshness window are still returned immediately
+        while a single background refresh replaces them. Empty and failed
+        lookups are cached too, for a shorter time.
+        """
+        query = normalize_query(query)
+        cache_key = search_cache_key(query)
+        entry = cache.get(cache_key)
+        if entry is None:
+            search_cache_stats.incr("miss")
+            return self.refresh_search(query)
+
+        if entry["fresh_until"] > time.time():
+            search_cache_stats.incr("hit")
+        else:
+            search_cache_stats.incr("stale")
+            self.refresh_search_in_background(query)
+        return entry["books"]
+
+    def refresh_search(self, query: str) -> List[Dict]:
+        """Fetch a (normalized) query from upstream and store the result."""
+        cache_key = search_cache_key(query)
+        books = self.fetch_search_results(query)
+        previous = cache.get(cache_key) if books is None else None
+        entry, timeout = search_cache_entry(books, previous)
+        cache.set(cache_key, entry, timeout)
+        if books:
+            cache.set_many(search_result_entries(books), timeout)
+        return entry["books"]
+
+    def refresh_search_in_background(self, query: str):
+        lock_key = f"{search_cache_key(query)}:refreshing"
+        # cache.add only succeeds for the first caller, across processes too.
+        if not cache.add(lock_key, 1, settings.GOOGLE_BOOKS_READ_TIMEOUT * 3):
+            return None
+
+        def refresh():
+            try:
+                search_cache_stats.incr("refresh")
+                return self.refresh_search(query)
+            finally:
+                cache.delete(lock_key)
+
+        return refresh_executor.submit(refresh)
+
+    def fetch_search_results(self, query: str) -> Optional[List[Dict]]:
+        """Upstream search results, or `None` if the upstream failed."""
+        try:
+            response = self.client.get(
+                self.base_url, params={"q": query, "key": self.api_key, "maxResults": 20}
+            )
+        except requests.RequestException:
+            return None
         if response.status_code != 200:
-            return []
-
-        books = [
-            {
-                "google_books_id": item.get("id"),
-                "title": item.get("volumeInfo", {}).get("title", ""),
-                "authors": item.get("volumeInfo", {}).get("authors", []),
-                "genres": item.get("volumeInfo", {}).get("categories", []),
-                "thumbnail_url": item.get("volumeInfo", {})
-                .get("imageLinks", {})
-                .get("thumbnail"),
-            }
-            for item in response.json().get("items", [])
-        ]
-
-        cache.set(cache_key, books, 3600)  # Cache for 1 hour
-        return books
+            return None
+        return parse_search_results(response.json())
 
     def fetch_book_details(self, google_books_id: str) -> Optional[Dict]:
-        """Fetch detailed book data by Google Books ID."""
-        response = requests.get(
+        """
+        Fetch detailed book data by Google Books ID. Returns `None` if there
+        is no such book and raises `requests.RequestException` if the
+        upstream failed, so callers never mistake an outage for "not found".
+        """
+        response = self.client.get(
             f"{self.base_url}/{google_books_id}", params={"key": self.api_key}
         )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return parse_book_details(google_books_id, response.json())
+
+
+class AsyncGoogleBooksAPI:
+    """
+    `GoogleBooksAPI` for async views, sharing its cache entries. Waiting on
+    Google Books doesn't hold a thread, so one worker can have many upstream
+    searches in flight.
+    """
+
+    def __init__(self, base_url: str = None, client: AsyncUpstreamClient = None):
+        self.api_key = settings.GOOGLE_BOOKS_API_KEY
+        self.base_url = base_url or settings.GOOGLE_BOOKS_API_URL
+        self.client = client or get_async_client()
+        self._refreshes = set()
+
+    async def search_books(self, query: str) -> List[Dict]:
+        """Cached search; see `GoogleBooksAPI.search_books`."""
+        query = normalize_query(query)
+        entry = await cache.aget(search_cache_key(query))
+        if entry is None:
+            search_cache_stats.incr("miss")
+            return await self.refresh_search(query)
+
+        if entry["fresh_until"] > time.time():
+            search_cache_stats.incr("hit")
+        else:
+            search_cache_stats.incr("stale")
+            await self.refresh_search_in_background(query)
+        return entry["books"]
+
+    async def refresh_search(self, query: str) -> List[Dict]:
+        cache_key = search_cache_key(query)
+        books = await self.fetch_search_results(query)
+        previous = await cache.aget(cache_key) if books is None else None
+        entry, timeout = search_cache_entry(books, previous)
+        await cache.aset(cache_key, entry, timeout)
+        if books:
+            await cache.aset_many(search_result_entries(books), timeout)
+        return entry["books"]
+
+    async def refresh_search_in_background(self, query: str):
+        lock_key = f"{search_cache_key(query)}:refreshing"
+        if not await cache.aadd(lock_key, 1, settings.GOOGLE_BOOKS_READ_TIMEOUT * 3):
+            return None
+
+        async def refresh():
+            try:
+                search_cache_stats.incr("refresh")
+                return await self.refresh_search(query)
+            finally:
+                await cache.adelete(lock_key)
+
+        task = asyncio.create_task(refresh())
+        # The loop only keeps weak references to tasks.
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+        return task
+
+    async def fetch_search_results(self, query: str) -> Optional[List[Dict]]:
+        try:
+            response = await self.client.get(
+                self.base_url, params={"q": query, "key": self.api_key, "maxResults": 20}
+            )
+        except (httpx.HTTPError, CircuitOpenError):
+            return None
         if response.status_code != 200:
             return None
+        return parse_search_results(response.json())
 
-        data = response.json().get("volumeInfo", {})
-        return {
-            "google_books_id": google_books_id,
-            "title": data.get("title", ""),
-            "authors": data.get("authors", []),
-            "genres": data.get("categories", []),
-            "cover_image": data.get("imageLinks", {}).get("thumbnail", ""),
-        }
+    async def fetch_book_details(self, google_books_id: str) -> Optional[Dict]:
+        """See `GoogleBooksAPI.fetch_book_details`; raises `httpx.HTTPError`."""
+        response = await self.client.get(
+            f"{self.base_url}/{google_books_id}", params={"key": self.api_key}
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return parse_book_details(google_books_id, response.json())
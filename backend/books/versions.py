@@ -0,0 +1,121 @@
+"""
+Cache-backed version counters for conditional GETs.
+
+Every collection or resource a client polls has a counter and a
+last-modified time in the cache. Signals bump them after each write commits,
+and views compute strong ETags and `Last-Modified` from them alone, so an
+unchanged resource is answered with a 304 before its queryset is touched.
+
+Counters are seeded from the clock when missing, so an evicted counter never
+restarts at a value an old ETag could still match.
+
+A counter bumped in one worker's private cache would let every other worker
+answer 304 for changed data, so all of this only runs with a cache the
+workers share (`CACHE_SHARED`). Without one, responses carry no validators
+and writes bump nothing.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+QUOTES = "quotes"
+TAGS = "tags"
+USERS = "users"
+
+
+def book(book_id) -> str:
+    return f"book:{book_id}"
+
+
+def quote_comments(quote_id) -> str:
+    return f"comments:{quote_id}"
+
+
+def _version_key(name: str) -> str:
+    return f"version:{name}"
+
+
+def _modified_key(name: str) -> str:
+    return f"version_modified:{name}"
+
+
+def _seed() -> int:
+    return time.time_ns() // 1000
+
+
+def _bump(names):
+    for name in names:
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), None)
+    now = time.time()
+    cache.set_many({_modified_key(name): now for name in names}, None)
+
+
+def bump(*names: str):
+    """Bump `names` once the current transaction (if any) commits."""
+    if settings.CACHE_SHARED:
+        transaction.on_commit(lambda: _bump(names))
+
+
+def get_versions(*names: str):
+    """Return `(version, modified)` for each name, seeding missing ones."""
+    keys = [_version_key(name) for name in names] + [
+        _modified_key(name) for name in names
+    ]
+    stored = cache.get_many(keys)
+    result = []
+    for name in names:
+        version = stored.get(_version_key(name))
+        modified = stored.get(_modified_key(name))
+        if version is None:
+            version = _seed()
+            cache.add(_version_key(name), version, None)
+            version = cache.get(_version_key(name), version)
+        if modified is None:
+            # Unknown modification time: treat it as "now" so
+            # If-Modified-Since can never produce a false 304.
+            modified = time.time()
+            cache.add(_modified_key(name), modified, None)
+        result.append((version, modified))
+    return result
+
+
+def etag(*names: str) -> str:
+    return "-".join(str(version) for version, _ in get_versions(*names))
+
+
+def last_modified(*names: str) -> datetime:
+    newest = max(modified for _, modified in get_versions(*names))
+    return datetime.fromtimestamp(newest, tz=dt_timezone.utc)
+
+
+def conditional(get_names):
+    """
+    Conditional-GET decorator for viewset methods. `get_names(**kwargs)`
+    returns the versions the response depends on; the negotiated format is
+    part of the ETag so JSON and the browsable API never share one.
+    """
+
+    def etag_func(request, *args, **kwargs):
+        if not settings.CACHE_SHARED:
+            return None
+        renderer = getattr(request, "accepted_renderer", None)
+        suffix = f"-{renderer.format}" if renderer else ""
+        return etag(*get_names(**kwargs)) + suffix
+
+    def last_modified_func(request, *args, **kwargs):
+        if not settings.CACHE_SHARED:
+            return None
+        return last_modified(*get_names(**kwargs))
+
+    return method_decorator(
+        condition(etag_func=etag_func, last_modified_func=last_modified_func)
+    )
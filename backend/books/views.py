@@ -1,10 +1,16 @@
+import io
+import json
+import time
 from typing import Optional
+
+import requests
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from rest_framework.permissions import (
     IsAuthenticatedOrReadOnly,
     IsAuthenticated,
+    IsAdminUser,
     AllowAny,
 )
 from .serializers import (
@@ -13,87 +19,272 @@ from .serializers import (
     QuoteFeedSerializer,
     QuoteSerializer,
     ReactionSerializer,
-    TagSerializer,
+    TagCountSerializer,
     UserFavoriteSerializer,
+    preload_user_summaries,
 )
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-from rest_framework.decorators import api_view
-from django.db.models import Count, Prefetch
-from .models import Book, Quote, Tag, Reaction, Comment, UserFavorite
-from .utils import GoogleBooksAPI
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.parsers import MultiPartParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .models import Book, Quote, QuoteTag, Tag, Reaction, Comment, UserFavorite
+from . import enrichment, exports, imports, reactions, search, timeline, versions
+from .pagination import QuoteFeedPagination, TagQuotesPagination, TrendingPagination
+from .reaction_buffer import reaction_buffer
+from .row_serializers import (
+    quote_rows,
+    serialize_books,
+    serialize_comment_thread,
+    serialize_quote_rows,
+)
+from .singleflight import SingleFlight
+from .threads import load_thread
+from .utils import (
+    AsyncGoogleBooksAPI,
+    GoogleBooksAPI,
+    get_search_result,
+    search_cache_stats,
+)
 
 
 class BookService:
     def __init__(self):
         self.api = GoogleBooksAPI()
+        self.async_api = AsyncGoogleBooksAPI()
+        self.flights = SingleFlight()
+        self.enricher = enrichment.BookEnricher(self.fetch_book_details)
 
     def search_books(self, query: str):
-        """Delegates book search to GoogleBooksAPI and formats for frontend."""
-        return self.api.search_books(query)
+        """
+        Answer from the local full-text index first and only ask
+        GoogleBooksAPI when there are too few local matches.
+        """
+        books = self.search_local_books(query)
+        if len(books) >= settings.LOCAL_SEARCH_MIN_RESULTS:
+            return books
+        return self.merge_results(books, self.api.search_books(query))
+
+    async def asearch_books(self, query: str):
+        """`search_books` without blocking the event loop on Google Books."""
+        books = await sync_to_async(self.search_local_books)(query)
+        if len(books) >= settings.LOCAL_SEARCH_MIN_RESULTS:
+            return books
+        return self.merge_results(books, await self.async_api.search_books(query))
+
+    def search_local_books(self, query: str):
+        return [self.format_local_book(book) for book in search.search_books(query)]
+
+    @staticmethod
+    def merge_results(local, upstream):
+        known = {book["google_books_id"] for book in local}
+        return local + [book for book in upstream if book["google_books_id"] not in known]
+
+    @staticmethod
+    def format_local_book(book: Book) -> dict:
+        """Shape a stored book like a GoogleBooksAPI search result."""
+        return {
+            "google_books_id": book.google_books_id,
+            "title": book.title,
+            "authors": book.authors,
+            "genres": book.genres or [],
+            "thumbnail_url": book.cover_image,
+        }
 
     def create_or_get_book(self, google_books_id: str) -> Optional[Book]:
-        """Get book from DB or create from API"""
+        """
+        Get book from DB or create from API.
+
+        Concurrent requests for the same new book are coalesced: threads in
+        this process share one call, and with a shared cache (CACHE_SHARED)
+        processes take turns through a cache lock, so the book is fetched
+        once. Without one, each process may fetch it, and the unique
+        google_books_id still lets only one insert win.
+
+        Returns None if Google Books has no such book; raises
+        requests.RequestException if it couldn't be asked.
+        """
+        book = Book.objects.filter(google_books_id=google_books_id).first()
+        if book:
+            return book
+        return self.flights.do(google_books_id, self._fetch_and_create, google_books_id)
+
+    def get_book_for_quote(self, google_books_id: str) -> Optional[Book]:
+        """
+        Book for a new quote. A book we don't have but that a recent Google
+        Books search returned is stored as a placeholder from that result,
+        and its full details are fetched in the background instead of making
+        the client wait on Google Books. Book data from clients is never
+        trusted; without a search result the book is fetched inline.
+        """
+        details = get_search_result(google_books_id)
+        if not details or not details.get("title"):
+            return self.create_or_get_book(google_books_id)
+        book = enrichment.create_placeholder(google_books_id, details)
+        if book.is_placeholder:
+            transaction.on_commit(lambda: self.enricher.enqueue(google_books_id))
+        return book
+
+    def fetch_book_details(self, google_books_id: str) -> Optional[dict]:
+        return self.api.fetch_book_details(google_books_id)
+
+    def _fetch_and_create(self, google_books_id: str) -> Optional[Book]:
+        lock_key = f"book_create_lock:{google_books_id}"
+        details_key = f"book_details:{google_books_id}"
+        deadline = time.monotonic() + settings.BOOK_CREATE_LOCK_TIMEOUT
+        locked = False
+        while True:
+            book = Book.objects.filter(google_books_id=google_books_id).first()
+            if book:
+                return book
+            if cache.get(details_key) == {}:
+                return None  # Another process just found nothing upstream.
+            locked = cache.add(lock_key, 1, settings.BOOK_CREATE_LOCK_TIMEOUT)
+            if locked or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+
         try:
-            return Book.objects.get(google_books_id=google_books_id)
-        except Book.DoesNotExist:
-            # Fetch book details from Google API
-            book_data = self.api.fetch_book_details(google_books_id)
+            book_data = cache.get(details_key)
+            if book_data is None:
+                # Upstream errors propagate; only a real "no such book" is
+                # cached for the processes waiting on the lock.
+                book_data = self.api.fetch_book_details(google_books_id) or {}
+                cache.set(details_key, book_data, settings.BOOK_CREATE_LOCK_TIMEOUT)
             if not book_data:
                 return None
 
-            return Book.objects.create(
-                google_books_id=google_books_id,
-                title=book_data.get("title", ""),
-                authors=book_data.get("authors", []),
-                genres=book_data.get("genres", []),
-                cover_image=book_data.get("cover_image", ""),
-            )
-
-
-@api_view(["GET"])
-def search_books(request):
-    book_service = BookService()
-    query = request.query_params.get("query", "")
+            try:
+                with transaction.atomic():
+                    return Book.objects.create(
+                        google_books_id=google_books_id,
+                        title=book_data.get("title", ""),
+                        authors=book_data.get("authors", []),
+                        genres=book_data.get("genres", []),
+                        cover_image=book_data.get("cover_image", ""),
+                    )
+            except IntegrityError:
+                # Someone else inserted it first; theirs is just as good.
+                return Book.objects.get(google_books_id=google_books_id)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+
+# Shared by every view so the API client and its connection pool are reused.
+book_service = BookService()
+
+
+async def authenticate(request):
+    """
+    Run DRF's configured authenticators for a plain async view, returning
+    the authenticated user or an error response (401/403, as DRF would).
+    """
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        user = await sync_to_async(lambda: drf_request.user)()
+    except AuthenticationFailed as exc:
+        user, error = None, exc
+    else:
+        error = NotAuthenticated()
+    if user is not None and user.is_authenticated:
+        return user, None
+
+    response = JsonResponse({"detail": str(error.detail)}, status=error.status_code)
+    header = drf_request.authenticators[0].authenticate_header(drf_request)
+    if header:
+        response["WWW-Authenticate"] = header
+    else:
+        response.status_code = status.HTTP_403_FORBIDDEN
+    return None, response
+
+
+@require_GET
+async def search_books(request):
+    """Async book search, `?query=`: local matches topped up upstream."""
+    user, error = await authenticate(request)
+    if error:
+        return error
+    query = request.GET.get("query", "")
     if not query:
-        return Response(
+        return JsonResponse(
             {"error": "Query parameter is required."},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    books = book_service.search_books(query)
-    return Response(books, status=status.HTTP_200_OK)
+    books = await book_service.asearch_books(query)
+    return JsonResponse(books, safe=False)
+
+
+@require_GET
+async def book_search(request):
+    """
+    Search for books in the database and API if not found, `?q=`. Served at
+    /api/books/search/ as an async view so that waiting on Google Books
+    doesn't tie up a worker.
+    """
+    user, error = await authenticate(request)
+    if error:
+        return error
+    query = request.GET.get("q")
+    if not query:
+        return JsonResponse(
+            {"error": "No query provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        books = await book_service.asearch_books(query)
+        return JsonResponse({"results": books})
+    except Exception as e:
+        return JsonResponse(
+            {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
 
 class BookViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    service = BookService()
+    service = book_service
 
-    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
-    def search(self, request):
-        """Search for books in the database and API if not found."""
-        query = request.query_params.get("q")
-        if not query:
-            return Response(
-                {"error": "No query provided"}, status=status.HTTP_400_BAD_REQUEST
-            )
+    def list(self, request, *args, **kwargs):
+        return Response(serialize_books(self.filter_queryset(self.get_queryset())))
 
-        try:
-            books = self.service.search_books(query)
-            return Response({"results": books}, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+    @versions.conditional(lambda pk=None, **kwargs: [versions.book(pk)])
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="search-cache-stats",
+        permission_classes=[IsAdminUser],
+    )
+    def search_cache_stats(self, request):
+        """Hit/miss/stale counters of this process's book search cache."""
+        return Response(search_cache_stats.snapshot())
 
 
 class QuoteViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
     queryset = Quote.objects.all()
     serializer_class = QuoteSerializer
-    service = BookService()
+    service = book_service
+
+    def list(self, request, *args, **kwargs):
+        quotes = quote_rows(
+            self.filter_queryset(self.get_queryset()).order_by("-created_at", "-id")
+        )
+        return Response(serialize_quote_rows(quotes))
 
     @action(
         detail=False,
@@ -102,7 +293,11 @@ class QuoteViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
     )
     def create_quote(self, request):
-        """Create a quote with a linked book, creating the book if needed."""
+        """
+        Create a quote with a linked book, creating the book if needed. A
+        new book the user just found through book search doesn't have to be
+        looked up on Google Books first.
+        """
         try:
             google_books_id = request.data.get("book")
             if not google_books_id:
@@ -110,7 +305,7 @@ class QuoteViewSet(viewsets.ModelViewSet):
                     {"error": "Book ID is required."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            book = self.service.create_or_get_book(google_books_id)
+            book = self.service.get_book_for_quote(google_books_id)
             if not book:
                 return Response(
                     {"error": "Unable to fetch or create book."},
@@ -121,20 +316,95 @@ class QuoteViewSet(viewsets.ModelViewSet):
             quote_data = {
                 "text": request.data.get("text"),
                 "context": request.data.get("context", ""),
-                "tags": request.data.get("tags", []),
+                "tags_list": request.data.get("tags", []),
             }
-            print(quote_data)
 
             serializer = QuoteSerializer(data=quote_data)
             serializer.is_valid(raise_exception=True)
             serializer.save(user=request.user, book=book)
-            print(request.user)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except requests.RequestException:
+            return Response(
+                {"error": "Google Books is unavailable, please try again."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         # return Response(QuoteSerializer(quote).data, status=status.HTTP_201_CREATED)
         # return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[IsAuthenticated],
+        parser_classes=[MultiPartParser],
+    )
+    def import_highlights(self, request):
+        """
+        Import an uploaded highlights `file` (Kindle clippings or CSV; pick
+        with `source=kindle|csv`, default by extension). Progress is
+        streamed back as one JSON object per line after every chunk.
+        """
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"error": "A highlights file is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        source = request.data.get("source") or imports.guess_format(upload.name)
+        if source not in imports.FORMATS:
+            return Response(
+                {"error": f"Unknown source {source!r}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        lines = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+        importer = imports.HighlightImporter(request.user, api=self.service.api)
+
+        def events():
+            try:
+                for stats in importer.import_chunks(imports.PARSERS[source](lines)):
+                    yield json.dumps(stats._asdict()) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+                return
+            yield json.dumps({**importer.stats._asdict(), "done": True}) + "\n"
+
+        return StreamingHttpResponse(events(), content_type="application/x-ndjson")
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="export",
+        permission_classes=[IsAuthenticated],
+    )
+    def export(self, request):
+        """
+        Stream all of the user's quotes as `?output=ndjson` (default) or
+        `csv`; add `compress=gzip` for a gzipped download.
+        """
+        output = request.query_params.get("output", "ndjson")
+        if output not in exports.OUTPUTS:
+            return Response(
+                {"error": f"Unknown output {output!r}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        gzip = request.query_params.get("compress") == "gzip"
+
+        content_type, extension = exports.OUTPUTS[output]
+        filename = f"quotes.{extension}"
+        if gzip:
+            content_type, filename = "application/gzip", f"{filename}.gz"
+        response = StreamingHttpResponse(
+            exports.export_stream(
+                Quote.objects.filter(user=request.user), output, gzip=gzip
+            ),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
     @action(
         detail=True,
         methods=["post"],
@@ -145,10 +415,22 @@ class QuoteViewSet(viewsets.ModelViewSet):
         """Allows a user to react to a quote"""
         quote = self.get_object()
         serializer = ReactionSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(user=request.user, quote=quote)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if settings.REACTION_WRITE_BEHIND:
+            reaction_type, counts = reaction_buffer.react(
+                request.user.pk, quote.pk, serializer.validated_data["type"]
+            )
+            return Response(
+                {
+                    "user": request.user.pk,
+                    "type": reaction_type,
+                    "reaction_counts": counts,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+        serializer.save(user=request.user, quote=quote)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(
         detail=True,
@@ -157,57 +439,159 @@ class QuoteViewSet(viewsets.ModelViewSet):
         url_path="toggle-reaction",
     )
     def toggle_reaction(self, request, pk=None):
-        """Toggles a reaction on a quote."""
-        quote = self.get_object()
+        """
+        Toggles the user's reaction on a quote and returns the quote's new
+        per-type counts. See `reactions.toggle` for how it stays atomic, and
+        `reaction_buffer` for the write-behind mode.
+        """
         reaction_type = request.data.get("reaction_type")
 
-        if reaction_type not in dict(Reaction.type):
+        if reaction_type not in dict(Reaction.REACTION_CHOICES):
             return Response(
                 {"error": "Invalid reaction type"}, status=status.HTTP_400_BAD_REQUEST
             )
+        if not str(pk).isdigit():
+            return Response(status=status.HTTP_404_NOT_FOUND)
 
-        reaction, created = Reaction.objects.get_or_create(
-            user=request.user, quote=quote, defaults={"reaction_type": reaction_type}
+        toggle = (
+            reaction_buffer.toggle
+            if settings.REACTION_WRITE_BEHIND
+            else reactions.toggle
+        )
+        try:
+            current, counts = toggle(request.user.pk, int(pk), reaction_type)
+        except Quote.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            {
+                "status": "updated" if current else "removed",
+                "reaction": current,
+                "reaction_counts": counts,
+            }
         )
 
-        if not created:
-            if reaction.reaction_type == reaction_type:
-                reaction.delete()
-                return Response({"status": "removed"})
-            reaction.reaction_type = reaction_type
-            reaction.save()
+    @action(detail=False, methods=["get"], url_path="search")
+    def search(self, request):
+        """Ranked full-text search over quote text and context."""
+        query = request.query_params.get("q")
+        if not query:
+            return Response(
+                {"error": "No query provided"}, status=status.HTTP_400_BAD_REQUEST
+            )
 
-        return Response({"status": "updated"})
+        quotes = search.search_quotes(
+            query,
+            queryset=Quote.objects.select_related("user", "book").prefetch_related(
+                "tags"
+            ),
+        )
+        serializer = QuoteSerializer(quotes, many=True)
+        return Response({"results": serializer.data}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=["get"], url_path="feed")
+    @versions.conditional(lambda **kwargs: [versions.QUOTES, versions.USERS])
     def feed(self, request):
-        quotes = (
-            Quote.objects.select_related("user", "book")
-            .prefetch_related(
-                Prefetch("reactions", queryset=Reaction.objects.select_related("user")),
-                "tags",
-                Prefetch("comments", queryset=Comment.objects.select_related("user")),
-            )
-            .annotate(reaction_count=Count("reactions"))
-            .order_by("-created_at")
+        """
+        Newest-first feed, paginated by an opaque `(created_at, id)` cursor
+        and served from the precomputed timeline. Pass `?user=<id>` for the
+        timeline of a single author. Supports If-None-Match/If-Modified-Since.
+        """
+        paginator = QuoteFeedPagination()
+        quotes = quote_rows(Quote.objects.all())
+        name = timeline.HOME
+        user_id = request.query_params.get("user")
+        if user_id:
+            if not user_id.isdigit():
+                return Response(
+                    {"error": "Invalid user id."}, status=status.HTTP_400_BAD_REQUEST
+                )
+            name = timeline.user_timeline(int(user_id))
+            quotes = quotes.filter(user_id=user_id)
+
+        # Prefetches run against the returned page only, not the whole table.
+        page = paginator.paginate_timeline(name, quotes, request, view=self)
+        return paginator.get_paginated_response(serialize_quote_rows(page))
+
+    @action(detail=False, methods=["get"], url_path="trending")
+    def trending(self, request):
+        """
+        Quotes with recent reactions and comments, highest time-decayed score
+        first. Reads one page off the trending index; cursor paginated.
+        """
+        paginator = TrendingPagination()
+        quotes = quote_rows(
+            Quote.objects.filter(trending_score__gt=0), "trending_score"
         )
-
-        # Use the custom feed serializer for the feed response
-        serializer = QuoteSerializer(quotes, many=True)
-        return Response({"quotes": serializer.data})
+        page = paginator.paginate_queryset(quotes, request, view=self)
+        return paginator.get_paginated_response(serialize_quote_rows(page))
 
 
 class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.all()
-    serializer_class = TagSerializer
+    serializer_class = TagCountSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != "list":
+            return queryset
+        # Most used first, straight off the popularity index.
+        queryset = queryset.order_by("-quote_count", "name")
+        prefix = self.request.query_params.get("q", "").lower().strip()
+        if prefix:
+            # Tag names are stored lowercased, so a range scan on the unique
+            # index matches the prefix.
+            queryset = queryset.filter(name__gte=prefix, name__lt=prefix + "\uffff")
+        limit = self.request.query_params.get("limit")
+        if limit and limit.isdigit():
+            queryset = queryset[: int(limit)]
+        return queryset
+
+    @versions.conditional(lambda **kwargs: [versions.TAGS])
+    def list(self, request, *args, **kwargs):
+        """
+        Tags by popularity with their quote counts. `?q=` narrows to names
+        starting with a prefix (autocomplete) and `?limit=` caps the list.
+        """
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=["get"], url_path=r"(?P<slug>[-\w]+)/quotes")
+    @versions.conditional(lambda **kwargs: [versions.QUOTES, versions.USERS])
+    def quotes(self, request, slug=None):
+        """
+        Newest quotes with the tag, paginated by an opaque cursor. Each page
+        is one range scan of the (tag, quote) index on the through table.
+        """
+        tag = get_object_or_404(Tag.objects.only("pk"), slug=slug)
+        paginator = TagQuotesPagination()
+        links = QuoteTag.objects.filter(tag_id=tag.pk).values("quote_id")
+        page = paginator.paginate_queryset(links, request, view=self)
+        quote_ids = [link["quote_id"] for link in page]
+        by_id = {
+            row["id"]: row for row in quote_rows(Quote.objects.filter(pk__in=quote_ids))
+        }
+        quotes = [by_id[quote_id] for quote_id in quote_ids if quote_id in by_id]
+        return paginator.get_paginated_response(serialize_quote_rows(quotes))
+
 
 class ReactionViewSet(viewsets.ModelViewSet):
     queryset = Reaction.objects.select_related("user", "quote")
     serializer_class = ReactionSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    # Signals move the quote's counters; they commit with the reaction.
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+
 
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.select_related('user', 'quote', 'parent')
@@ -219,37 +603,53 @@ class CommentViewSet(viewsets.ModelViewSet):
         quote = get_object_or_404(Quote, pk=quote_id)
         serializer.save(user=self.request.user, quote=quote)
 
+    def get_thread_context(self, roots, reply_map):
+        """Serializer context for a preloaded thread, authors included."""
+        context = {**self.get_serializer_context(), "reply_map": reply_map}
+        comments = roots + [reply for replies in reply_map.values() for reply in replies]
+        preload_user_summaries(context, [comment.user_id for comment in comments])
+        return context
+
+    def get_max_depth(self):
+        depth = self.request.query_params.get("depth")
+        return int(depth) if depth and depth.isdigit() else None
+
+    def retrieve(self, request, *args, **kwargs):
+        """A comment with its whole reply subtree, loaded in one query."""
+        comment = self.get_object()
+        max_depth = self.get_max_depth()
+        roots, reply_map = load_thread(
+            comment.quote_id,
+            max_depth=None if max_depth is None else comment.depth + max_depth,
+            root=comment,
+        )
+        context = self.get_thread_context(roots, reply_map)
+        serializer = self.get_serializer(roots[0], context=context)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['GET'], url_path='quote/(?P<quote_pk>\d+)')
+    @versions.conditional(
+        lambda quote_pk=None, **kwargs: [
+            versions.quote_comments(quote_pk),
+            versions.USERS,
+        ]
+    )
     def comments_by_quote(self, request, quote_pk=None):
-        quote = get_object_or_404(Quote, pk=quote_pk)
-        comments = Comment.objects.filter(quote=quote, parent__isnull=True)
-        serializer = self.get_serializer(comments, many=True)
-        return Response(serializer.data)
+        """
+        The quote's whole comment thread in a single query. `?depth=N` stops
+        at N levels of replies below the top-level comments.
+        """
+        comments = Comment.objects.filter(quote_id=quote_pk)
+        max_depth = self.get_max_depth()
+        if max_depth is not None:
+            comments = comments.filter(depth__lte=max_depth)
+        thread = serialize_comment_thread(comments)
+        if not thread:
+            get_object_or_404(Quote, pk=quote_pk)
+        return Response(thread)
 
 
 class UserFavoriteViewSet(viewsets.ModelViewSet):
     queryset = UserFavorite.objects.select_related("user", "book")
     serializer_class = UserFavoriteSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-
-
-@action(detail=True, methods=["post"], url_path="toggle-reaction")
-def toggle_reaction(request, quote_id):
-    quote = get_object_or_404(Quote, id=quote_id)
-    reaction_type = request.POST.get("reaction_type")
-
-    if reaction_type not in dict(Reaction.type):
-        return JsonResponse({"error": "Invalid reaction type"}, status=400)
-
-    reaction, created = Reaction.objects.get_or_create(
-        user=request.user, quote=quote, defaults={"reaction_type": reaction_type}
-    )
-
-    if not created:
-        if reaction.reaction_type == reaction_type:
-            reaction.delete()
-            return JsonResponse({"status": "removed"})
-        reaction.reaction_type = reaction_type
-        reaction.save()
-
-    return JsonResponse({"status": "updated"})